@@ -0,0 +1,106 @@
+"""
+Concurrency stress test of data layer.
+
+Runs many concurrent clients against in-process app, each doing mixed reads
+and writes through HTTP handlers. Every database connection refuses to be
+used by two callers at the same time, so any connection shared between
+concurrent requests shows up as error. Runs against backend configured with
+`ST_DB_BACKEND` (and `ST_DB_*` for migrated Postgres database).
+
+    python benchmarks/concurrency.py --clients 64 --requests 200
+    python benchmarks/concurrency.py --gevent --clients 500
+
+With `--gevent`, clients are greenlets and standard library is monkey
+patched, same as in gunicorn gevent worker.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+
+if '--gevent' in sys.argv:
+    from gevent import monkey
+    monkey.patch_all()
+
+import threading
+from collections import Counter
+
+from seventweets.app import create_app
+from seventweets.db import default_backend
+
+
+def _post_json(http, method: str, path: str, body: dict):
+    # Flask 0.12 test client does not accept `json=`
+    return http.open(path, method=method, data=json.dumps(body), content_type='application/json')
+
+
+def _body(resp) -> dict:
+    try:
+        return json.loads(resp.data)
+    except ValueError:
+        return {}
+
+
+def client(app, requests, errors: Counter, statuses: Counter):
+    http = app.test_client()
+    created = []
+    for _ in range(requests):
+        op = random.choice(('create', 'read', 'list', 'search', 'modify', 'count'))
+        try:
+            if op == 'create' or not created:
+                resp = _post_json(http, 'POST', '/tweets/create', {'tweet': 'stress test'})
+                if resp.status_code == 201:
+                    created.append(_body(resp)['id'])
+            elif op == 'read':
+                resp = http.get(f'/tweets/{random.choice(created)}')
+            elif op == 'list':
+                resp = http.get('/tweets/')
+            elif op == 'search':
+                resp = http.get('/tweets/search', query_string={'content': 'stress'})
+            elif op == 'modify':
+                resp = _post_json(http, 'PUT', f'/tweets/{random.choice(created)}', {'tweet': 'modified'})
+            else:
+                resp = http.get('/')
+            statuses[resp.status_code] += 1
+            if resp.status_code >= 500:
+                errors[_body(resp).get('message', resp.status_code)] += 1
+        except Exception as e:
+            errors[repr(e)] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per client.')
+    parser.add_argument('--gevent', action='store_true', help='Run clients in greenlets.')
+    args = parser.parse_args()
+
+    app = create_app()
+    # stress data layer, not admission control and cache
+    app.extensions.pop('admission', None)
+    app.extensions.pop('search_cache', None)
+
+    errors, statuses = Counter(), Counter()
+    clients = [threading.Thread(target=client, args=(app, args.requests, errors, statuses))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.perf_counter() - start
+
+    total = sum(statuses.values())
+    print(f'backend {default_backend}, {args.clients} {"greenlets" if args.gevent else "threads"}')
+    print(f'{total} requests in {elapsed:.2f}s, {total / elapsed:.0f} req/s, statuses {dict(statuses)}')
+    if default_backend == 'pg':
+        from seventweets.db.backends.pg import pool_stats
+        print(f'connection pools: {pool_stats()}')
+    for message, count in errors.most_common():
+        print(f'{count:>6} x {message}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark of tweet creation throughput with and without write coalescing.
+
+Runs against database configured with `ST_DB_*` environment variables, which
+has to be migrated. Each thread simulates one request handler creating tweets.
+
+    python benchmarks/group_commit.py --threads 32 --tweets 200
+"""
+import time
+import argparse
+import threading
+
+from seventweets import tweet
+from seventweets.app import create_app
+from seventweets.coalesce import WriteCoalescer
+
+
+def run(app, threads, tweets_per_thread):
+    def worker():
+        with app.app_context():
+            for i in range(tweets_per_thread):
+                tweet.create(f'benchmark tweet {i}')
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--tweets', type=int, default=200, help='Tweets per thread.')
+    parser.add_argument('--delay', type=float, default=2, help='Max coalescing delay in ms.')
+    parser.add_argument('--batch', type=int, default=100, help='Max coalescing batch size.')
+    args = parser.parse_args()
+    total = args.threads * args.tweets
+
+    app = create_app()
+    app.extensions.pop('write_coalescer', None)
+    elapsed = run(app, args.threads, args.tweets)
+    print(f'single inserts: {total / elapsed:>10.0f} tweets/s ({elapsed:.2f}s)')
+
+    coalescer = WriteCoalescer(tweet.insert_many, args.delay / 1000, args.batch)
+    app.extensions['write_coalescer'] = coalescer
+    elapsed = run(app, args.threads, args.tweets)
+    print(f'group commit:   {total / elapsed:>10.0f} tweets/s ({elapsed:.2f}s), '
+          f'{coalescer.rows / max(coalescer.batches, 1):.1f} rows per commit')
+
+
+if __name__ == '__main__':
+    main()
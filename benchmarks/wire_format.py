@@ -0,0 +1,73 @@
+"""
+Compares payload size and encode/decode time of wire formats for list
+responses, as used by `GET /tweets` and search between nodes.
+
+    python benchmarks/wire_format.py --tweets 10000
+"""
+import gzip
+import time
+import argparse
+from datetime import datetime, timedelta
+
+from flask import json
+
+from seventweets import wire
+from seventweets.app import create_app
+from seventweets.tweet import Tweet
+
+
+def make_tweets(count):
+    now = datetime.utcnow()
+    return [
+        Tweet(i, f'Tweet number {i} with some #hashtag and @mention text', 'original',
+              now - timedelta(minutes=i), now - timedelta(minutes=i)).to_dict()
+        for i in range(count)
+    ]
+
+
+def measure(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = fn()
+    return res, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tweets', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    data = make_tweets(args.tweets)
+    formats = [
+        ('json', lambda d: json.dumps(d).encode('utf-8'), json.loads),
+        ('msgpack', wire.dumps_msgpack, wire.loads_msgpack),
+    ]
+    print(f'{"format":<16} {"size (KB)":>10} {"encode (ms)":>12} {"decode (ms)":>12} {"from_dict (ms)":>15}')
+    with app.app_context():
+        for name, dumps, loads in formats:
+            for compressed in (False, True):
+                if compressed:
+                    def encode(dumps=dumps):
+                        return gzip.compress(dumps(data), compresslevel=6)
+
+                    def decode(payload, loads=loads):
+                        return loads(gzip.decompress(payload))
+                else:
+                    def encode(dumps=dumps):
+                        return dumps(data)
+
+                    def decode(payload, loads=loads):
+                        return loads(payload)
+
+                payload, encode_ms = measure(encode, args.repeat)
+                decoded, decode_ms = measure(lambda: decode(payload), args.repeat)
+                _, from_dict_ms = measure(lambda: [Tweet.from_dict(t) for t in decoded], args.repeat)
+                label = name + ('+gzip' if compressed else '')
+                print(f'{label:<16} {len(payload) / 1024:>10.1f} {encode_ms:>12.1f} '
+                      f'{decode_ms:>12.1f} {from_dict_ms:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,7 @@ db_container_name = '7tweets-postgres'
 db_user = '7tweets'
 db_name = 'seventweets'
 db_port = 5431
-db_image = 'postgres:9.6.2'
+db_image = 'postgres:12'
 db_volume = 'postgres-7tweets-data'
 
 gunicorn_port = 8080
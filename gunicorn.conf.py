@@ -0,0 +1,35 @@
+"""
+Gunicorn configuration, values are taken from `ST_*` environment variables:
+
+    gunicorn -c gunicorn.conf.py seventweets.app:app
+
+`ST_WORKER_MODEL` selects worker class:
+    - sync: one request at a time per worker process.
+    - gthread: `ST_WORKER_THREADS` requests per worker, in threads.
+    - gevent: `ST_WORKER_CONNECTIONS` requests per worker, in greenlets.
+      Requires gevent package, gunicorn patches standard library so
+      database drivers do not block other greenlets.
+
+Database connections are pooled per worker process (`ST_DB_POOL_*`), so
+`ST_DB_POOL_MAX` times number of workers should fit into database
+`max_connections`. Log storage backend can be opened by single process only,
+use one worker with threads or greenlets with it.
+
+Background jobs queued in worker are finished when worker exits, so
+`graceful_timeout` should be longer than `ST_JOB_DRAIN_TIMEOUT`.
+"""
+from seventweets import config
+
+bind = '0.0.0.0:8080'
+worker_class = config.ST_WORKER_MODEL
+workers = int(config.ST_WORKERS)
+threads = int(config.ST_WORKER_THREADS)
+worker_connections = int(config.ST_WORKER_CONNECTIONS)
+
+
+def worker_exit(server, worker):
+    # finishes queued background jobs of worker before it exits
+    app = getattr(worker, 'wsgi', None)
+    executor = getattr(app, 'extensions', {}).get('executor')
+    if executor is not None:
+        executor.shutdown(float(config.ST_JOB_DRAIN_TIMEOUT))
@@ -0,0 +1,222 @@
+"""
+Admission control and load shedding.
+
+Every request handled by decorated endpoint takes a slot of worker capacity.
+Requests have priority and each priority can use only part of the capacity,
+so when expensive requests (searches) pile up, cheap and important ones
+(health check, point reads) are still admitted. Expensive endpoints also have
+their own concurrency limit and per client token bucket rate limit.
+
+Rejected requests fail fast with 503 (overloaded) or 429 (rate limited) and
+`Retry-After` header, instead of waiting in queue.
+
+Limits are kept per worker process. Capacity and concurrency limits apply to
+each worker. Rate limits are configured per node and split evenly between
+`ST_WORKERS` workers, which holds as long as requests of client are spread
+evenly between them.
+"""
+import hmac
+import time
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from typing import Dict, Tuple, Optional
+
+from flask import request, current_app
+
+from seventweets import deadline
+from seventweets.exception import TooManyRequests, ServiceUnavailable
+from seventweets.utils import per_worker
+
+logger = logging.getLogger(__name__)
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+# share of worker capacity requests of given priority can use
+PRIORITY_SHARE = {
+    HIGH: 1.0,
+    NORMAL: 0.8,
+    LOW: 0.5,
+}
+
+# max number of clients to track rate for, least recently seen are dropped
+MAX_CLIENTS = 10000
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average with bursts up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes one token if available.
+
+        :return: 0 if token was taken, otherwise seconds until token is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class EndpointLimit:
+    """
+    Concurrency and per client rate limit of single endpoint class.
+    """
+
+    def __init__(self, concurrency: int, rate: float, burst: float):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.in_flight = 0
+        self.buckets: Dict[str, TokenBucket] = OrderedDict()
+
+    def take_token(self, client: str) -> float:
+        if not self.rate:
+            return 0
+        bucket = self.buckets.pop(client, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        self.buckets[client] = bucket
+        if len(self.buckets) > MAX_CLIENTS:
+            self.buckets.popitem(last=False)
+        return bucket.take()
+
+
+class AdmissionController:
+    """
+    Decides if request can be handled now or has to be rejected.
+    """
+
+    def __init__(self, capacity: int, limits: Dict[str, Tuple[int, float, float]]):
+        """
+        :param capacity: Max number of concurrent requests in worker.
+        :param limits: Endpoint class name to (concurrency, rate, burst).
+        """
+        self.capacity = capacity
+        self.limits = {name: EndpointLimit(*limit) for name, limit in limits.items()}
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint: str, priority: int, client: str):
+        """
+        Admits request or raises exception.
+
+        :raises TooManyRequests: If client exceeded rate of endpoint.
+        :raises ServiceUnavailable: If worker or endpoint is at capacity.
+        """
+        limit = self.limits.get(endpoint)
+        with self._lock:
+            if self.in_flight >= self.capacity * PRIORITY_SHARE[priority]:
+                self.rejected += 1
+                raise ServiceUnavailable('Server is overloaded, try again later.')
+            if limit is not None:
+                if limit.concurrency and limit.in_flight >= limit.concurrency:
+                    self.rejected += 1
+                    raise ServiceUnavailable(f'Too many concurrent {endpoint} requests, try again later.')
+                wait = limit.take_token(client)
+                if wait:
+                    self.rejected += 1
+                    raise TooManyRequests(f'Rate limit for {endpoint} exceeded.', retry_after=wait)
+                limit.in_flight += 1
+            self.in_flight += 1
+
+    def release(self, endpoint: str):
+        limit = self.limits.get(endpoint)
+        with self._lock:
+            self.in_flight -= 1
+            if limit is not None:
+                limit.in_flight -= 1
+
+
+def create_controller(config) -> AdmissionController:
+    """
+    Creates admission controller from application config.
+    """
+    def limit(prefix):
+        return (int(config[f'ST_{prefix}_CONCURRENCY']),
+                per_worker(config[f'ST_{prefix}_RATE'], config),
+                per_worker(config[f'ST_{prefix}_BURST'], config))
+
+    return AdmissionController(
+        capacity=int(config['ST_ADMISSION_CAPACITY']),
+        limits={
+            'search': limit('SEARCH'),
+            'list': limit('LIST'),
+            # long polls hold slot while waiting, so they are only limited in number
+            'changes': (int(config['ST_CHANGES_CONCURRENCY']), 0, 0),
+        }
+    )
+
+
+def request_token() -> Optional[str]:
+    """
+    Returns API token provided by client in `Authorization: Token <token>`
+    or `X-Api-Token` header, None if there is none.
+    """
+    auth = request.headers.get('Authorization', '')
+    if auth.lower().startswith('token '):
+        return auth[6:].strip()
+    return request.headers.get('X-Api-Token') or None
+
+
+def has_valid_token() -> bool:
+    """
+    Checks if client provided token matching `ST_API_TOKEN`.
+    """
+    token = current_app.config['ST_API_TOKEN']
+    provided = request_token()
+    if not token or not provided:
+        return False
+    return hmac.compare_digest(provided.encode('utf-8'), token.encode('utf-8'))
+
+
+def client_key() -> str:
+    """
+    Returns key identifying client for rate limiting. API token is used if
+    client provided valid one, otherwise client address. Unchecked tokens
+    are not used, client could send new one with every request to get fresh
+    rate limit and to push other clients out of tracked ones.
+    """
+    if has_valid_token():
+        return 'token:' + request_token()
+    return 'addr:' + (request.remote_addr or '')
+
+
+def admit(endpoint: str, priority: int=NORMAL):
+    """
+    Decorator applying admission control to endpoint and setting deadline of
+    request. It has to be applied under `error_handler`, so rejections are
+    turned into responses.
+
+    :param endpoint: Name of endpoint class, used for endpoint limits and deadline.
+    :param priority: Priority of requests, one of HIGH, NORMAL and LOW.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            deadline.start(endpoint)
+            controller = current_app.extensions.get('admission')
+            if controller is None:
+                return f(*args, **kwargs)
+            controller.acquire(endpoint, priority, client_key())
+            try:
+                return f(*args, **kwargs)
+            finally:
+                controller.release(endpoint)
+        return wrapper
+    return decorator
@@ -1,14 +1,23 @@
 import sys
+import atexit
 import logging
 import time
 import click
 import datetime
 import traceback
-from seventweets.utils import generate_api_token
+from functools import partial
+from seventweets.utils import generate_api_token, as_bool
 from flask import Flask, g, current_app
 from seventweets import config as configuration
+from seventweets import tweet, mirror, wire, admission, maintenance, loadtest, bulk, jobs, push, client
+from seventweets.profiling import Profiler
+from seventweets.coalesce import WriteCoalescer, SingleFlight
+from seventweets.cache import SearchCache, SharedCache, data_version
+from seventweets.db import routing, default_backend
 from seventweets.handlers.base import base
 from seventweets.handlers.tweets import tweets
+from seventweets.handlers.admin import admin
+from seventweets.handlers.subscriptions import subscriptions
 from seventweets.migrate import MigrationManager
 
 LOG_FORMAT = ('%(asctime)-15s %(levelname)s: '
@@ -22,6 +31,38 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# worker models of gunicorn the app supports, see `gunicorn.conf.py`
+WORKER_MODELS = ('sync', 'gthread', 'gevent')
+
+
+def _check_worker_model(worker_model: str):
+    """
+    Validates configured worker model. With gevent, database drivers use
+    blocking sockets unless standard library is monkey patched, which would
+    stall all greenlets of worker while one waits for database.
+    """
+    if worker_model not in WORKER_MODELS:
+        raise ValueError(f'Invalid worker model: {worker_model}, expected one of {WORKER_MODELS}.')
+    if worker_model == 'gevent':
+        try:
+            from gevent import monkey
+        except ImportError:
+            raise RuntimeError('Worker model "gevent" requires gevent package.')
+        if not monkey.is_module_patched('socket'):
+            logger.warning('Worker model is "gevent", but socket module is not patched. '
+                           'Run with gunicorn gevent worker or call gevent.monkey.patch_all() first.')
+
+
+def _global_invalidation(config) -> bool:
+    """
+    Checks if writes of any process invalidate caches of this one. Data
+    version is per process unless it is shared through `SharedCache`, so it
+    is global only when there is single process writing to storage, which
+    is always the case with memory and log storage.
+    """
+    return (bool(config['ST_SHARED_CACHE_PATH']) or int(config['ST_WORKERS']) == 1
+            or default_backend in ('memory', 'log'))
+
 
 def create_app(_=None):
     """
@@ -32,9 +73,81 @@ def create_app(_=None):
 
     app = Flask('seventweets')
     app.config.from_object(configuration)
+    _check_worker_model(app.config['ST_WORKER_MODEL'])
+    if default_backend == 'log' and int(app.config['ST_WORKERS']) != 1:
+        # storage directory is locked by the first process opening it
+        raise ValueError('ST_DB_BACKEND=log requires ST_WORKERS=1, log storage is used by single process.')
 
     app.register_blueprint(base, url_prefix='/')
     app.register_blueprint(tweets, url_prefix='/tweets')
+    app.register_blueprint(subscriptions, url_prefix='/subscriptions')
+    app.after_request(wire.compress_response)
+
+    if as_bool(app.config['ST_PROFILING']):
+        if not app.config['ST_API_TOKEN']:
+            raise ValueError('ST_PROFILING requires ST_API_TOKEN to be set.')
+        profiler = Profiler(float(app.config['ST_PROFILING_SAMPLE_INTERVAL']) / 1000)
+        app.extensions['profiler'] = profiler
+        app.before_request(profiler.before_request)
+        app.teardown_request(profiler.teardown_request)
+        app.register_blueprint(admin, url_prefix='/admin')
+    app.extensions['admission'] = admission.create_controller(app.config)
+
+    read_router = routing.create_router(app.config)
+    if read_router is not None:
+        app.extensions['read_router'] = read_router
+        app.after_request(routing.set_sticky_cookie)
+
+    if as_bool(app.config['ST_WRITE_COALESCE']):
+        app.extensions['write_coalescer'] = WriteCoalescer(
+            tweet.insert_many,
+            max_delay=float(app.config['ST_WRITE_COALESCE_DELAY']) / 1000,
+            max_batch=int(app.config['ST_WRITE_COALESCE_BATCH']),
+        )
+
+    if as_bool(app.config['ST_READ_COALESCE']):
+        app.extensions['read_coalescer'] = SingleFlight()
+
+    if int(app.config['ST_SEARCH_CACHE_SIZE']) > 0 and not _global_invalidation(app.config):
+        # client could read results older than its own write from other worker
+        logger.warning('Search cache is disabled, it requires ST_SHARED_CACHE_PATH with %s workers.',
+                       app.config['ST_WORKERS'])
+    elif int(app.config['ST_SEARCH_CACHE_SIZE']) > 0:
+        app.extensions['search_cache'] = SearchCache(
+            max_entries=int(app.config['ST_SEARCH_CACHE_SIZE']),
+            max_rows=int(app.config['ST_SEARCH_CACHE_MAX_ROWS']),
+            ttl=float(app.config['ST_SEARCH_CACHE_TTL']),
+            granularity=int(app.config['ST_SEARCH_CACHE_GRANULARITY']),
+        )
+
+    if app.config['ST_SHARED_CACHE_PATH']:
+        shared_cache = SharedCache(
+            app.config['ST_SHARED_CACHE_PATH'],
+            slots=int(app.config['ST_SHARED_CACHE_SLOTS']),
+            slot_size=int(app.config['ST_SHARED_CACHE_SLOT_SIZE']),
+            ttl=float(app.config['ST_SHARED_CACHE_TTL']),
+        )
+        app.extensions['shared_cache'] = shared_cache
+        # writes of any worker invalidate caches of all of them
+        data_version.shared = shared_cache
+
+    app.extensions['http_client'] = client.create_client(app.config)
+
+    executor = jobs.create_executor(app)
+    app.extensions['executor'] = executor
+    # gunicorn drains executor in `worker_exit` hook, this covers other servers
+    atexit.register(executor.shutdown, float(app.config['ST_JOB_DRAIN_TIMEOUT']))
+
+    if as_bool(app.config['ST_PUSH']):
+        if not app.config['ST_API_TOKEN']:
+            raise ValueError('ST_PUSH requires ST_API_TOKEN to be set.')
+        app.extensions['pusher'] = push.create_pusher(app, executor)
+
+    # periodic jobs are scheduled on first request, so CLI commands do not run them
+    app.before_first_request(lambda: maintenance.start(app))
+
+    if app.config['ST_MIRROR_PEERS']:
+        app.before_first_request(lambda: mirror.start(app))
 
     @app.cli.command()
     def config():
@@ -51,17 +164,90 @@ def create_app(_=None):
         for k, v in cfg.items():
             print(f'{k} = {v}')
 
+    @app.cli.command('mirror')
+    def mirror_once():
+        """
+        Pulls new tweets from all peers configured in ST_MIRROR_PEERS once.
+        """
+        mirror.sync_all()
+        for peer, age in mirror.freshness().items():
+            print(f'{peer}: {"never synced" if age is None else f"synced {age:.1f}s ago"}')
+
     @app.cli.command()
     def generate_token():
         print(generate_api_token())
 
+    @app.cli.command('loadtest')
+    @click.option('--url', default=None, help='Base address of node, in-process app is used if not provided.')
+    @click.option('--concurrency', default=8, help='Number of concurrent workers.')
+    @click.option('--rate', default=0.0, help='Target requests per second, 0 is as fast as possible.')
+    @click.option('--duration', default=10.0, help='Duration in seconds, 0 is unlimited.')
+    @click.option('--requests', 'max_requests', default=0, help='Max number of requests, 0 is unlimited.')
+    @click.option('--mix', default=loadtest.DEFAULT_MIX, help='Comma separated operation=weight pairs.')
+    @click.option('--timeout', default=10.0, help='HTTP request timeout in seconds.')
+    def loadtest_command(url, concurrency, rate, duration, max_requests, mix, timeout):
+        """
+        Drives node with mixed workload and prints throughput, error rate and
+        latency percentiles per operation.
+        """
+        if url:
+            factory = partial(loadtest.HttpTransport, url, timeout)
+        else:
+            factory = partial(loadtest.AppTransport, current_app._get_current_object())
+        try:
+            test = loadtest.LoadTest(factory, loadtest.parse_mix(mix), concurrency,
+                                     rate=rate, duration=duration, max_requests=max_requests)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        elapsed = test.run()
+        print(loadtest.format_report(test.stats.report(elapsed), elapsed))
+
+    @app.cli.command('export-tweets')
+    @click.argument('output', type=click.File('wb'), default='-')
+    @click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='jsonl')
+    @click.option('--batch-size', default=10000, help='Number of tweets read at once.')
+    def export_tweets(output, fmt, batch_size):
+        """
+        Writes all tweets to OUTPUT (standard output by default) as JSON
+        Lines or CSV.
+        """
+        progress = bulk.print_progress('Exported')
+        progress(bulk.export_tweets(output, fmt, batch_size, progress))
+
+    @app.cli.command('import-tweets')
+    @click.argument('input', type=click.File('rb'), default='-')
+    @click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='jsonl')
+    @click.option('--batch-size', default=10000, help='Number of tweets inserted in single transaction.')
+    @click.option('--keep-ids', is_flag=True, help='Keep IDs of tweets, node has to be empty.')
+    def import_tweets(input, fmt, batch_size, keep_ids):
+        """
+        Inserts tweets from INPUT (standard input by default) exported by
+        export-tweets, keeping their times, type and reference.
+        """
+        progress = bulk.print_progress('Imported')
+        try:
+            progress(bulk.import_tweets(input, fmt, batch_size, keep_ids, progress))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
     @app.cli.command()
     @click.argument('direction', type=click.Choice(['up', 'down']), default='up')
     def migrate(direction):
         """
         Performs database migration.
         """
-        MigrationManager().migrate(direction)
+        applied = MigrationManager().migrate(direction)
+        for id_, name, duration in applied:
+            print(f'{id_:>4} {name:<50} {duration * 1000:.1f} ms')
+        if not applied:
+            print('Nothing to migrate.')
+
+    @app.cli.command()
+    def create_partitions():
+        """
+        Creates missing monthly partitions of tweets table.
+        """
+        print(f'Created {maintenance.ensure_partitions()} partitions.')
 
     @app.cli.command()
     @click.argument('name', type=str)
@@ -77,3 +263,4 @@ def create_app(_=None):
 
 
 app = create_app()
+
@@ -0,0 +1,194 @@
+"""
+Bulk export and import of tweets, for seeding new node or moving data of node
+to another one.
+
+Tweets are streamed as JSON Lines or CSV with columns of `TWEET_COLUMNS`
+and times in ISO format, so memory usage does not depend on number of tweets.
+Postgres backend exports with `COPY ... TO STDOUT` and imports with
+`COPY ... FROM STDIN`, other backends read tweets in pages ordered by ID and
+insert them in batches. Every imported batch is committed separately.
+"""
+import io
+import sys
+import csv
+import json
+import time
+from datetime import datetime, timezone
+from functools import partial
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional
+
+from seventweets import cache, events
+from seventweets.db import get_db, get_ops, TwResp, TWEET_COLUMNS
+
+FORMATS = ('jsonl', 'csv')
+TWEET_TYPES = ('original', 'retweet')
+
+Progress = Optional[Callable[[int], None]]
+
+
+def export_tweets(out: BinaryIO, fmt: str, batch_size: int=10000, progress: Progress=None) -> int:
+    """
+    Writes all tweets of this node to `out`, ordered by ID.
+
+    :param out: Binary stream to write to.
+    :param fmt: Either 'jsonl' or 'csv'.
+    :param batch_size: Number of tweets read at once and between calls of `progress`.
+    :param progress: Called with number of tweets written so far.
+    :return: Number of written tweets.
+    """
+    ops = get_ops()
+    if hasattr(ops, 'copy_tweets_out'):
+        return get_db().do(partial(ops.copy_tweets_out, fmt, out, progress, batch_size))
+
+    if fmt == 'csv':
+        out.write(_format_csv([TWEET_COLUMNS]))
+    written = 0
+    after_id = 0
+    while True:
+        page = get_db().do(partial(ops.get_tweets_page, after_id, batch_size))
+        if not page:
+            break
+        if fmt == 'csv':
+            out.write(_format_csv([_ts(v) for v in t] for t in page))
+        else:
+            out.write(_format_jsonl(page))
+        written += len(page)
+        after_id = page[-1][0]
+        if progress is not None:
+            progress(written)
+    return written
+
+
+def import_tweets(in_: BinaryIO, fmt: str, batch_size: int=10000, keep_ids: bool=False,
+                  progress: Progress=None) -> int:
+    """
+    Inserts tweets read from `in_`, keeping their content, type, reference
+    and creation and modification times.
+
+    :param in_: Binary stream to read from.
+    :param fmt: Either 'jsonl' or 'csv'.
+    :param batch_size: Number of tweets inserted in single transaction.
+    :param keep_ids: If IDs of tweets should be kept, which is possible only
+        if this node has no tweets. Otherwise new IDs are assigned.
+    :param progress: Called with number of tweets imported so far.
+    :raises ValueError: If input is not valid or IDs can not be kept.
+    :return: Number of imported tweets.
+    """
+    if keep_ids and get_db().do(partial(get_ops().count_tweets, '')):
+        raise ValueError('Tweets can be imported with their IDs only to node without tweets.')
+    values = read_jsonl(in_) if fmt == 'jsonl' else read_csv(in_)
+    tweets = (_tweet(v, line, keep_ids) for line, v in values)
+    imported = 0
+    for batch in _batches(tweets, batch_size):
+        imported += get_db().do(partial(get_ops().import_tweets, batch, keep_ids))
+        if progress is not None:
+            progress(imported)
+    if imported:
+        cache.data_version.bump()
+        events.changes.notify()
+    return imported
+
+
+def read_jsonl(in_: BinaryIO) -> Iterator[tuple]:
+    """
+    Yields (line number, dict) for every non empty line of JSON Lines input.
+    """
+    for line, data in enumerate(in_, 1):
+        if not data.strip():
+            continue
+        try:
+            values = json.loads(data)
+        except ValueError as e:
+            raise ValueError(f'Invalid JSON on line {line}: {e}')
+        if not isinstance(values, dict):
+            raise ValueError(f'Expected object on line {line}.')
+        yield line, values
+
+
+def read_csv(in_: BinaryIO) -> Iterator[tuple]:
+    """
+    Yields (line number, dict) for every row of CSV input with header. Empty
+    fields are read as missing values.
+    """
+    text = io.TextIOWrapper(in_, encoding='utf-8', newline='')
+    try:
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {k: v if v != '' else None for k, v in row.items()}
+    finally:
+        # leaves closing of `in_` to its owner
+        text.detach()
+
+
+def _tweet(values: dict, line: int, keep_ids: bool) -> TwResp:
+    try:
+        id_ = values.get('id')
+        if id_ is not None:
+            id_ = int(id_)
+        elif keep_ids:
+            raise ValueError('missing id')
+        content = values.get('tweet')
+        if content is not None and len(content) > 140:
+            raise ValueError('tweet length exceeds 140 characters')
+        type_ = values.get('type') or 'original'
+        if type_ not in TWEET_TYPES:
+            raise ValueError(f'unknown type {type_}')
+        created_at = _parse_ts(values['created_at'])
+        modified_at = _parse_ts(values.get('modified_at') or values['created_at'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid tweet on line {line}: {e}')
+    return id_, content, type_, created_at, modified_at, values.get('reference')
+
+
+def _parse_ts(value: str) -> datetime:
+    """
+    Parses time in ISO format to naive UTC datetime.
+    """
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _ts(value):
+    return value.isoformat(' ') if isinstance(value, datetime) else value
+
+
+def _format_jsonl(tweets: Iterable[TwResp]) -> bytes:
+    lines = []
+    for t in tweets:
+        lines.append(json.dumps(dict(zip(TWEET_COLUMNS, t)), default=datetime.isoformat, ensure_ascii=False))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _format_csv(rows: Iterable[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def print_progress(action: str) -> Callable[[int], None]:
+    """
+    Returns progress callback printing number of processed tweets and
+    throughput to standard error.
+
+    :param action: Past tense verb describing what was done with tweets.
+    """
+    start = time.perf_counter()
+
+    def progress(count: int):
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed else 0
+        print(f'{action} {count} tweets in {elapsed:.1f}s ({rate:.0f}/s)', file=sys.stderr)
+    return progress
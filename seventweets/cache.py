@@ -0,0 +1,337 @@
+"""
+Cache of search results and cache shared by worker processes of node.
+
+Search results are cached under normalized search parameters. Date ranges are
+widened to buckets of configurable granularity, so searches with slightly
+different bounds (e.g. "last hour" issued few seconds apart) share the same
+entry, and cached rows are filtered by exact bounds before they are returned.
+
+Every write bumps global data version and entries cached under older version
+are ignored, so invalidation is single counter increment. Writes done by
+other processes are picked up through change notifications, when they are
+being listened to, and entries always expire after TTL.
+
+`SharedCache` keeps hot reads (tweets by ID, counts, trending tags, complete
+search results) in memory-mapped file used by all workers, so each worker
+does not have to warm its own copy. When it is enabled, data version is kept
+in that file too, so write in any worker invalidates entries of all of them.
+"""
+import os
+import time
+import mmap
+import zlib
+import fcntl
+import pickle
+import struct
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List, Any
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class DataVersion:
+    """
+    Counter incremented on every write to tweets. It is counter of this
+    process, or of all workers if it is shared through `SharedCache`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+        self.shared: Optional['SharedCache'] = None
+
+    @property
+    def value(self) -> int:
+        if self.shared is not None:
+            return self.shared.version
+        return self._value
+
+    def bump(self):
+        if self.shared is not None:
+            self.shared.invalidate()
+            return
+        with self._lock:
+            self._value += 1
+
+
+data_version = DataVersion()
+
+
+def _floor(dt: Optional[datetime], granularity: int) -> Optional[datetime]:
+    if dt is None or granularity <= 0:
+        return dt
+    seconds = (dt - _EPOCH) // timedelta(seconds=1)
+    return _EPOCH + timedelta(seconds=seconds - seconds % granularity)
+
+
+def _ceil(dt: Optional[datetime], granularity: int) -> Optional[datetime]:
+    floored = _floor(dt, granularity)
+    if floored is None or floored == dt:
+        return floored
+    return floored + timedelta(seconds=granularity)
+
+
+class SearchCache:
+    """
+    LRU cache of search results bounded by number of entries and total number
+    of cached rows.
+    """
+
+    def __init__(self, max_entries: int, max_rows: int, ttl: float, granularity: int):
+        """
+        :param max_entries: Max number of cached searches.
+        :param max_rows: Max number of rows in all cached searches together.
+        :param ttl: Seconds after which entry expires regardless of version.
+        :param granularity: Seconds to which date range bounds are bucketed.
+        """
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.granularity = granularity
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def normalize(self, content, created_from, created_to, modified_from, modified_to,
+                  retweets) -> Tuple:
+        """
+        Returns normalized search parameters, which are used both as cache key
+        and as parameters of query that fills the cache. Lower date bounds are
+        floored and upper bounds are ceiled to granularity, so query returns
+        superset of requested results.
+        """
+        g = self.granularity
+        content = content.lower() if content is not None else None
+        return (content,
+                _floor(created_from, g), _ceil(created_to, g),
+                _floor(modified_from, g), _ceil(modified_to, g),
+                True if retweets is not None else None)
+
+    @staticmethod
+    def narrow(rows: List[Tuple], created_from, created_to, modified_from, modified_to) -> List[Tuple]:
+        """
+        Filters rows of widened query by exact date bounds.
+        Rows are in `TWEET_COLUMN_ORDER`.
+        """
+        if created_from is None and created_to is None and modified_from is None and modified_to is None:
+            return rows
+        return [
+            r for r in rows
+            if (created_from is None or r[3] > created_from)
+            and (created_to is None or r[3] < created_to)
+            and (modified_from is None or r[4] > modified_from)
+            and (modified_to is None or r[4] < modified_to)
+        ]
+
+    def get(self, key) -> Optional[List[Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != data_version.value or entry[1] < now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, rows: List[Any], version: int):
+        """
+        Caches rows under key.
+
+        :param version: Data version read before query was executed, so result
+            of query that raced with write is never served as current.
+        """
+        if len(rows) > self.max_rows:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._rows -= len(old[2])
+            self._entries[key] = (version, time.monotonic() + self.ttl, rows)
+            self._rows += len(rows)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._rows -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'rows': self._rows,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# magic, data version
+_SHARED_HEADER = struct.Struct('>8sQ')
+_SHARED_HEADER_SIZE = 64
+# sequence (odd while slot is written), data version, key digest, expiry
+# (unix time), payload length, crc32 of payload
+_SHARED_SLOT = struct.Struct('>QQ16sdII')
+_SHARED_MAGIC = b'7TWSHC01'
+
+
+class SharedCache:
+    """
+    Fixed size hash table in memory-mapped file, shared by processes which
+    open the same file, with the same get/set API as `SearchCache`.
+
+    Key is hashed to single slot, so entry with the same slot replaces
+    previous one. Values are pickled and values that do not fit into slot are
+    not cached. Writers are serialized with lock of the file. Readers do not
+    lock, slot is written like seqlock: its sequence is odd while it is being
+    written and reader which sees sequence change or checksum mismatch treats
+    entry as missing.
+
+    File is opened lazily in every process, so forked workers do not share
+    file lock of their parent. It should be on memory backed file system
+    (e.g. /dev/shm), readable only by user running the node.
+    """
+
+    def __init__(self, path: str, slots: int, slot_size: int, ttl: float):
+        """
+        :param path: Path of cache file, created if it does not exist.
+        :param slots: Number of entries.
+        :param slot_size: Size of single entry in bytes, including its header.
+        :param ttl: Seconds after which entry expires regardless of version.
+        """
+        if slot_size <= _SHARED_SLOT.size:
+            raise ValueError(f'Shared cache slot size has to be larger than {_SHARED_SLOT.size} bytes.')
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.size = _SHARED_HEADER_SIZE + slots * slot_size
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.too_large = 0
+
+    def _open(self) -> mmap.mmap:
+        if self._pid == os.getpid():
+            return self._map
+        with self._lock:
+            if self._pid != os.getpid():
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size != self.size or os.pread(fd, 8, 0) != _SHARED_MAGIC:
+                        logger.info('Initializing shared cache %s (%d bytes).', self.path, self.size)
+                        os.ftruncate(fd, 0)
+                        os.ftruncate(fd, self.size)
+                        os.pwrite(fd, _SHARED_HEADER.pack(_SHARED_MAGIC, 0), 0)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                self._fd = fd
+                self._map = mmap.mmap(fd, self.size)
+                self._pid = os.getpid()
+        return self._map
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds lock of this process and of cache file while inside of context.
+        """
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def version(self) -> int:
+        return _SHARED_HEADER.unpack_from(self._open())[1]
+
+    def invalidate(self):
+        """
+        Bumps data version, so entries cached by all processes are ignored.
+        """
+        data = self._open()
+        with self._locked():
+            magic, version = _SHARED_HEADER.unpack_from(data)
+            _SHARED_HEADER.pack_into(data, 0, magic, version + 1)
+
+    @staticmethod
+    def _digest(key) -> bytes:
+        # built-in hash of strings differs between processes
+        return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).digest()
+
+    def _offset(self, digest: bytes) -> int:
+        return _SHARED_HEADER_SIZE + int.from_bytes(digest[:8], 'big') % self.slots * self.slot_size
+
+    def get(self, key) -> Optional[Any]:
+        data = self._open()
+        digest = self._digest(key)
+        offset = self._offset(digest)
+        seq, version, slot_digest, expires, length, crc = _SHARED_SLOT.unpack_from(data, offset)
+        value = None
+        if (seq % 2 == 0 and slot_digest == digest and version == self.version
+                and expires > time.time() and length <= self.slot_size - _SHARED_SLOT.size):
+            start = offset + _SHARED_SLOT.size
+            payload = data[start:start + length]
+            if _SHARED_SLOT.unpack_from(data, offset)[0] == seq and zlib.crc32(payload) == crc:
+                try:
+                    value = pickle.loads(payload)
+                except Exception:
+                    logger.warning('Failed to load shared cache entry.', exc_info=True)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value, version: int):
+        """
+        Caches value under key.
+
+        :param version: Data version read before value was read, so value
+            that raced with write is never served as current.
+        """
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.slot_size - _SHARED_SLOT.size:
+            self.too_large += 1
+            return
+        data = self._open()
+        digest = self._digest(key)
+        offset = self._offset(digest)
+        with self._locked():
+            seq = _SHARED_SLOT.unpack_from(data, offset)[0]
+            # odd sequence marks slot as being written
+            _SHARED_SLOT.pack_into(data, offset, seq + 1, 0, b'', 0, 0, 0)
+            start = offset + _SHARED_SLOT.size
+            data[start:start + len(payload)] = payload
+            _SHARED_SLOT.pack_into(data, offset, seq + 2, version, digest, time.time() + self.ttl,
+                                   len(payload), zlib.crc32(payload))
+
+    def stats(self) -> dict:
+        """
+        Returns statistics of this process, cache itself is shared.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'too_large': self.too_large,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
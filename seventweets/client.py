@@ -0,0 +1,267 @@
+"""
+HTTP client for requests to other nodes.
+
+`PeerClient` is created once per worker by `create_app` and shared by all
+code talking to other nodes (mirror), so connections to peer are kept
+alive and reused instead of being opened for every request. Connections are
+pooled per peer, pools are created on first request, so they are not shared
+by forked worker processes.
+
+Failed requests are retried with exponential backoff and full jitter, so
+clients retrying after outage of peer do not hit it at the same time. Only
+requests that can be repeated safely are retried: idempotent methods, or
+any method if connecting to peer timed out.
+
+Every peer has circuit breaker. After `ST_HTTP_BREAKER_FAILURES` failures in
+a row, requests to peer fail right away with `CircuitOpen` for
+`ST_HTTP_BREAKER_RESET` seconds, then single trial request decides if peer is
+back. Failure is connection error, timeout or 5xx response. `CircuitOpen` is
+`requests.RequestException`, so callers handle it as any other failed request,
+and it is sent as 503 with `Retry-After` if it is not handled.
+
+In request with deadline, timeouts are capped by time left until it and peer
+gets the rest of the budget in `X-Request-Timeout` header. Retries stop when
+deadline passes, with `DeadlineExceeded`.
+"""
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional, Union, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+from seventweets import deadline
+from seventweets.exception import DeadlineExceeded, CircuitOpen
+from seventweets.utils import percentiles_ms
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+# number of recent requests latency percentiles are computed from
+LATENCY_SAMPLES = 1000
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class Peer:
+    """
+    Circuit breaker and metrics of single peer.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def state(self, now: float) -> str:
+        if self.open_until > now:
+            return 'open'
+        return 'half-open' if self.open_until else 'closed'
+
+    def stats(self, now: float) -> dict:
+        return {
+            'state': self.state(now),
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'latency_ms': percentiles_ms(sorted(self.latencies)),
+        }
+
+
+class PeerClient:
+    """
+    Keep-alive HTTP client with retries and circuit breaker per peer.
+    """
+
+    def __init__(self, pool_peers: int, pool_size: int, connect_timeout: float, read_timeout: float,
+                 retries: int, backoff: float, max_backoff: float, breaker_failures: int,
+                 breaker_reset: float):
+        """
+        :param pool_peers: Number of peers connection pools are kept for.
+        :param pool_size: Max number of kept connections to single peer.
+        :param connect_timeout: Default seconds to wait for connection.
+        :param read_timeout: Default seconds to wait for response data.
+        :param retries: Default max number of retries of failed request.
+        :param backoff: Max seconds before first retry, doubled with every next one.
+        :param max_backoff: Max seconds between retries.
+        :param breaker_failures: Failures in a row which open circuit of peer.
+        :param breaker_reset: Seconds circuit stays open.
+        """
+        self.pool_peers = pool_peers
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self._lock = threading.Lock()
+        self._peers: Dict[str, Peer] = {}
+        self._session: Optional[requests.Session] = None
+
+    def _get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_peers, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def _peer(self, url: str) -> Peer:
+        parts = urlsplit(url)
+        address = f'{parts.scheme}://{parts.netloc}'
+        with self._lock:
+            peer = self._peers.get(address)
+            if peer is None:
+                peer = self._peers[address] = Peer(address)
+            return peer
+
+    def request(self, method: str, url: str, timeout: Timeout=None, retries: int=None,
+                **kwargs) -> requests.Response:
+        """
+        Sends request, retrying it if it failed and can be repeated. Response
+        with error status is returned, it is up to caller to check it.
+
+        :param method: HTTP method.
+        :param url: Absolute URL of request.
+        :param timeout: Seconds to wait for response data, or (connect, read)
+            tuple, `ST_HTTP_CONNECT_TIMEOUT` and `ST_HTTP_READ_TIMEOUT` by default.
+        :param retries: Max number of retries, `ST_HTTP_RETRIES` by default.
+        :param kwargs: Passed to `requests.Session.request`.
+        :raises CircuitOpen: If circuit breaker of peer is open.
+        :raises DeadlineExceeded: If deadline of current request passed.
+        :raises requests.RequestException: If the last attempt failed.
+        """
+        method = method.upper()
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+        retries = self.retries if retries is None else retries
+        peer = self._peer(url)
+        session = self._get_session()
+        attempt = 0
+        while True:
+            attempt_timeout = timeout
+            left = deadline.check()
+            if left is not None:
+                attempt_timeout = (min(timeout[0], left), min(timeout[1], left))
+                kwargs['headers'] = {**(kwargs.get('headers') or {}), deadline.HEADER: f'{left:.3f}'}
+            self._admit(peer)
+            start = time.monotonic()
+            try:
+                resp = session.request(method, url, timeout=attempt_timeout, **kwargs)
+            except requests.RequestException as e:
+                self._record(peer, start, failed=True)
+                left = deadline.remaining()
+                if isinstance(e, requests.Timeout) and left is not None and left <= 0:
+                    raise DeadlineExceeded(f'Request deadline exceeded while waiting for {peer.address}.') from e
+                # request which did not connect did not reach peer, so it is safe to repeat
+                can_retry = method in IDEMPOTENT_METHODS or isinstance(e, requests.ConnectTimeout)
+                if attempt >= retries or not can_retry:
+                    raise
+                logger.debug('Request %s %s failed, retrying.', method, url, exc_info=True)
+            else:
+                failed = resp.status_code >= 500
+                self._record(peer, start, failed=failed)
+                if not failed or attempt >= retries or method not in IDEMPOTENT_METHODS:
+                    return resp
+                resp.close()
+            self._sleep(attempt)
+            attempt += 1
+            with self._lock:
+                peer.retries += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def _sleep(self, attempt: int):
+        time.sleep(random.uniform(0, min(self.backoff * 2 ** attempt, self.max_backoff)))
+
+    def _admit(self, peer: Peer):
+        """
+        Lets request through, unless circuit of peer is open. When open
+        period passed, only one trial request is let through until it
+        finishes.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = peer.state(now)
+            if state == 'closed':
+                return
+            if state == 'half-open' and not peer.trial:
+                peer.trial = True
+                return
+            peer.rejected += 1
+            retry_after = max(0.0, peer.open_until - now)
+        raise CircuitOpen(f'Circuit of {peer.address} is open.', retry_after)
+
+    def _record(self, peer: Peer, start: float, failed: bool):
+        now = time.monotonic()
+        with self._lock:
+            peer.requests += 1
+            peer.latencies.append(now - start)
+            peer.trial = False
+            if not failed:
+                peer.failures = 0
+                peer.open_until = 0.0
+                return
+            peer.errors += 1
+            peer.failures += 1
+            opened = peer.failures >= self.breaker_failures and peer.open_until <= now
+            if opened:
+                peer.open_until = now + self.breaker_reset
+        if opened:
+            logger.warning('Opening circuit of %s for %.1fs after %d failures.', peer.address,
+                           self.breaker_reset, peer.failures)
+
+    def stats(self) -> dict:
+        """
+        Returns state of circuit breaker, request counters and latency
+        percentiles of each peer.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {address: peer.stats(now) for address, peer in self._peers.items()}
+
+
+def create_client(config) -> PeerClient:
+    """
+    Creates client from application config.
+    """
+    return PeerClient(
+        pool_peers=int(config['ST_HTTP_POOL_PEERS']),
+        pool_size=int(config['ST_HTTP_POOL_SIZE']),
+        connect_timeout=float(config['ST_HTTP_CONNECT_TIMEOUT']),
+        read_timeout=float(config['ST_HTTP_READ_TIMEOUT']),
+        retries=int(config['ST_HTTP_RETRIES']),
+        backoff=float(config['ST_HTTP_BACKOFF']),
+        max_backoff=float(config['ST_HTTP_MAX_BACKOFF']),
+        breaker_failures=int(config['ST_HTTP_BREAKER_FAILURES']),
+        breaker_reset=float(config['ST_HTTP_BREAKER_RESET']),
+    )
+
+
+def get_client() -> PeerClient:
+    """
+    Returns HTTP client of current app.
+    """
+    return current_app.extensions['http_client']
@@ -0,0 +1,202 @@
+"""
+Coalescing of database work of concurrent requests.
+
+Group commit for tweet inserts: inserts arriving from concurrent requests
+within short window are combined into single multi-row insert and single
+commit, so burst of writes produces one WAL flush instead of one per tweet.
+Only one batch per process is written at a time and new inserts accumulate
+while previous batch is being written, so batches grow naturally with load.
+
+Single-flight for reads: identical reads that arrive while the same read is
+already running wait for it and share its result, instead of each running
+its own query.
+
+This only has effect when requests are handled concurrently inside of the
+same process (threaded or gevent workers).
+
+Shared work runs without request deadline, since it is done for several
+requests, each of which stops waiting for it at its own deadline.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, TypeVar, Generic
+
+from seventweets import deadline
+
+logger = logging.getLogger(__name__)
+
+_R = TypeVar('_R')
+_T = TypeVar('_T')
+
+
+class _Batch:
+    """
+    Group of rows that will be written together.
+    """
+    def __init__(self):
+        self.rows = []
+        self.results = []
+        self.errors = []
+        self.closed = False
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class WriteCoalescer(Generic[_R, _T]):
+    """
+    Combines rows submitted from multiple threads into batches.
+
+    First thread that submits row to new batch becomes its leader. Leader
+    waits until batch is full or `max_delay` expires, then writes whole batch
+    using `execute_batch`. Other threads wait for leader to finish and receive
+    their own result. If batch write fails, rows are written one by one, so
+    each caller receives its own result or error. Caller whose deadline
+    passes while waiting gets `DeadlineExceeded`, but its row is written.
+    """
+
+    def __init__(self, execute_batch: Callable[[List[_R]], List[_T]],
+                 max_delay: float=0.002, max_batch: int=100):
+        """
+        :param execute_batch:
+            Function writing list of rows and returning list of results in
+            the same order.
+        :param max_delay: Max time in seconds leader waits for batch to fill.
+        :param max_batch: Max number of rows in single batch.
+        """
+        self.execute_batch = execute_batch
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batch = None
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, row: _R) -> _T:
+        """
+        Adds row to current batch and blocks until it is written.
+
+        :param row: Row to write.
+        :return: Result of writing this row.
+        :raises DeadlineExceeded: If deadline of request passes while waiting for batch.
+        :raises: Exception raised while writing this row.
+        """
+        with self._lock:
+            batch = self._batch
+            leader = batch is None or batch.closed or len(batch.rows) >= self.max_batch
+            if leader:
+                batch = self._batch = _Batch()
+            index = len(batch.rows)
+            batch.rows.append(row)
+            if len(batch.rows) >= self.max_batch:
+                batch.full.set()
+
+        if leader:
+            with deadline.detached():
+                self._lead(batch)
+        else:
+            deadline.wait(batch.done)
+
+        error = batch.errors[index]
+        if error is not None:
+            raise error
+        return batch.results[index]
+
+    def _lead(self, batch: _Batch):
+        batch.full.wait(self.max_delay)
+        with self._flush_lock:
+            with self._lock:
+                batch.closed = True
+                if self._batch is batch:
+                    self._batch = None
+            try:
+                self._write(batch)
+            finally:
+                batch.done.set()
+
+    def _write(self, batch: _Batch):
+        start = time.perf_counter()
+        try:
+            batch.results = list(self.execute_batch(batch.rows))
+            batch.errors = [None] * len(batch.rows)
+        except Exception as e:
+            if len(batch.rows) == 1:
+                batch.results, batch.errors = [None], [e]
+                return
+            logger.warning('Writing batch of %d rows failed, writing rows one by one.',
+                           len(batch.rows), exc_info=True)
+            batch.results, batch.errors = [], []
+            for row in batch.rows:
+                try:
+                    batch.results.extend(self.execute_batch([row]))
+                    batch.errors.append(None)
+                except Exception as row_error:
+                    batch.results.append(None)
+                    batch.errors.append(row_error)
+        self.batches += 1
+        self.rows += len(batch.rows)
+        logger.debug('Wrote batch of %d rows in %.3fs.', len(batch.rows), time.perf_counter() - start)
+
+
+class _Call:
+    """
+    Read that is in progress.
+    """
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class SingleFlight(Generic[_T]):
+    """
+    Shares result of read among concurrent callers with the same key.
+
+    First caller with a key executes the read, callers arriving with the same
+    key before it finishes wait and receive the same result or exception.
+    Finished reads are forgotten immediately, so result is never older than
+    the duration of read it comes from.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], _T]) -> _T:
+        """
+        Returns result of `fn`, executing it only if there is no call with
+        the same key in progress.
+
+        :param key: Identifies read, callers with equal keys share result.
+        :param fn: Function executing read.
+        :raises DeadlineExceeded: If deadline of request passes while waiting for other caller.
+        :raises: Exception raised by `fn`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                with deadline.detached():
+                    call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            deadline.wait(call.done)
+
+        if call.error is not None:
+            raise call.error
+        return call.result
@@ -9,6 +9,161 @@ ST_OWN_NAME = None
 ST_OWN_ADDRESS = None
 ST_API_TOKEN = None
 
+# comma separated read replicas as [user[:password]@]host[:port][/database],
+# strategy is round_robin or least_latency; times in seconds
+ST_DB_REPLICAS = ''
+ST_DB_REPLICA_STRATEGY = 'round_robin'
+ST_DB_REPLICA_RETRY = 30
+ST_DB_STICKY_SECONDS = 5
+
+# connections per worker process: idle connections kept open, max open
+# connections (0 is unlimited) and seconds to wait for free one
+ST_DB_POOL_SIZE = 4
+ST_DB_POOL_MAX = 20
+ST_DB_POOL_TIMEOUT = 5
+
+# gunicorn worker model: sync, gthread or gevent; threads are used by
+# gthread workers, connections by gevent workers
+ST_WORKER_MODEL = 'sync'
+ST_WORKERS = 4
+ST_WORKER_THREADS = 8
+ST_WORKER_CONNECTIONS = 100
+
+# responses larger than this (in bytes) are compressed, -1 disables compression
+ST_COMPRESS_MIN_SIZE = 1024
+ST_COMPRESS_LEVEL = 6
+
+# admission control, max concurrent requests per worker and per endpoint
+# limits: concurrency per worker, requests per second per client and burst
+# per node, split evenly between ST_WORKERS workers (0 is unlimited)
+ST_ADMISSION_CAPACITY = 64
+ST_SEARCH_CONCURRENCY = 8
+ST_SEARCH_RATE = 10
+ST_SEARCH_BURST = 20
+ST_LIST_CONCURRENCY = 16
+ST_LIST_RATE = 20
+ST_LIST_BURST = 40
+
+# deadlines of requests in seconds by endpoint class (0 is none), clients can
+# set it with X-Request-Timeout header up to ST_DEADLINE_MAX; requests
+# exceeding it get 504
+ST_DEADLINE_HEALTH = 2
+ST_DEADLINE_READ = 2
+ST_DEADLINE_WRITE = 5
+ST_DEADLINE_LIST = 10
+ST_DEADLINE_SEARCH = 10
+ST_DEADLINE_CHANGES = 40
+ST_DEADLINE_MAX = 60
+
+# search result cache, 0 entries disables it; ttl and granularity in seconds.
+# With more than one worker on shared database it is enabled only together
+# with ST_SHARED_CACHE_PATH, which invalidates caches of all workers on write
+ST_SEARCH_CACHE_SIZE = 256
+ST_SEARCH_CACHE_MAX_ROWS = 100000
+ST_SEARCH_CACHE_TTL = 5
+ST_SEARCH_CACHE_GRANULARITY = 60
+
+# cache shared by worker processes of node, in memory-mapped file which should
+# be on memory backed file system (e.g. /dev/shm/seventweets.cache), empty
+# path disables it; slot size in bytes, ttl in seconds
+ST_SHARED_CACHE_PATH = ''
+ST_SHARED_CACHE_SLOTS = 16384
+ST_SHARED_CACHE_SLOT_SIZE = 4096
+ST_SHARED_CACHE_TTL = 5
+
+# on-demand profiling endpoints under /admin, protected by ST_API_TOKEN;
+# interval of call stack sampling in milliseconds
+ST_PROFILING = False
+ST_PROFILING_SAMPLE_INTERVAL = 5
+
+# group commit of tweet inserts, delay is in milliseconds
+ST_WRITE_COALESCE = False
+ST_WRITE_COALESCE_DELAY = 2
+ST_WRITE_COALESCE_BATCH = 100
+
+# sharing of identical concurrent reads (by ID, count, search)
+ST_READ_COALESCE = True
+
+# long polling of change feed, in seconds, and max concurrent long polls per
+# worker. Waiting request blocks sync worker, so `wait` is ignored with it
+ST_CHANGES_MAX_WAIT = 30
+ST_CHANGES_POLL_INTERVAL = 1
+ST_CHANGES_CONCURRENCY = 8
+
+# server-sent events stream, times in seconds. Open stream holds worker, so
+# streams are refused by sync workers and limited to ST_STREAM_MAX_CLIENTS per
+# node, split evenly between workers (0 is unlimited)
+ST_STREAM_HEARTBEAT = 15
+ST_STREAM_LISTEN_INTERVAL = 1
+ST_STREAM_QUEUE_SIZE = 1000
+ST_STREAM_MAX_CLIENTS = 200
+
+# background jobs: worker threads and max queued jobs per process, retries
+# of failed jobs with exponential backoff, seconds to finish queued jobs on
+# shutdown; times in seconds
+ST_JOB_WORKERS = 2
+ST_JOB_QUEUE_SIZE = 1000
+ST_JOB_RETRIES = 3
+ST_JOB_BACKOFF = 1
+ST_JOB_MAX_BACKOFF = 60
+ST_JOB_DRAIN_TIMEOUT = 10
+
+# monthly partitions of tweets table are created this many months ahead,
+# check is done every ST_MAINTENANCE_INTERVAL seconds
+ST_PARTITION_MONTHS_AHEAD = 3
+ST_MAINTENANCE_INTERVAL = 3600
+
+# HTTP client for requests to other nodes: kept alive connections per peer,
+# retries with jittered exponential backoff, circuit of peer is opened for
+# ST_HTTP_BREAKER_RESET seconds after ST_HTTP_BREAKER_FAILURES failures in a
+# row; times in seconds
+ST_HTTP_POOL_PEERS = 32
+ST_HTTP_POOL_SIZE = 10
+ST_HTTP_CONNECT_TIMEOUT = 3
+ST_HTTP_READ_TIMEOUT = 10
+ST_HTTP_RETRIES = 2
+ST_HTTP_BACKOFF = 0.2
+ST_HTTP_MAX_BACKOFF = 2
+ST_HTTP_BREAKER_FAILURES = 5
+ST_HTTP_BREAKER_RESET = 30
+
+# push of tweet changes to subscribers: events are batched for ST_PUSH_DELAY
+# seconds, failed deliveries are retried with exponential backoff and
+# subscriber failing for ST_PUSH_EVICT_AFTER seconds is removed; times in
+# seconds. Callbacks resolving to private, loopback or link-local addresses
+# are rejected unless ST_PUSH_ALLOW_PRIVATE is set (nodes on private network).
+# Managing subscriptions requires ST_API_TOKEN when push is enabled
+ST_PUSH = False
+ST_PUSH_MAX_SUBSCRIPTIONS = 100
+ST_PUSH_ALLOW_PRIVATE = False
+ST_PUSH_DELAY = 1
+ST_PUSH_BATCH = 500
+ST_PUSH_MAX_PENDING = 10000
+ST_PUSH_BACKOFF = 1
+ST_PUSH_MAX_BACKOFF = 300
+ST_PUSH_EVICT_AFTER = 3600
+ST_PUSH_TIMEOUT = 5
+
+# comma separated base addresses of peers to mirror, times in seconds
+ST_MIRROR_PEERS = ''
+ST_MIRROR_INTERVAL = 30
+ST_MIRROR_MAX_STALENESS = 300
+ST_MIRROR_TIMEOUT = 10
+
+# log-structured storage (ST_DB_BACKEND=log), sizes in bytes; log is compacted
+# when it is ST_LOG_COMPACT_RATIO times larger than live records in it
+ST_LOG_DIR = 'data'
+ST_LOG_SEGMENT_SIZE = 64 * 1024 * 1024
+ST_LOG_FSYNC = True
+ST_LOG_CHECKPOINT_RECORDS = 1000
+ST_LOG_COMPACT_RATIO = 2
+ST_LOG_COMPACT_MIN_SIZE = 16 * 1024 * 1024
+
+# SQLite storage (ST_DB_BACKEND=sqlite), busy timeout in seconds
+ST_SQLITE_PATH = 'seventweets.sqlite3'
+ST_SQLITE_BUSY_TIMEOUT = 5
+ST_SQLITE_SYNCHRONOUS = 'NORMAL'
+
 
 for name in list(globals().keys()):
     try:
@@ -1,7 +1,18 @@
+"""
+Storage of tweets, with pluggable backends.
+
+Data layer is safe to use from multiple threads and gevent greenlets at the
+same time. `Operations` are stateless, they work only with cursor they are
+given. Object returned by `get_db` gives every `do` call exclusive use of
+connection (pg borrows one from pool of worker process, sqlite uses
+connection of current thread, memory and log backends serialize calls with
+lock), so connection is never shared by concurrent requests.
+"""
 import logging
 import abc
 import os
-from typing import Tuple, TypeVar, Optional, Iterable
+import re
+from typing import Tuple, TypeVar, Optional, Iterable, List, Sequence
 from importlib import import_module
 from datetime import datetime
 
@@ -13,15 +24,115 @@ TwResp = Tuple[int, str, str, datetime, datetime, str]
 logger = logging.getLogger(__name__)
 
 TWEET_COLUMN_ORDER = 'id, tweet, type, created_at, modified_at, reference'
+TWEET_COLUMNS = tuple(TWEET_COLUMN_ORDER.split(', '))
+
+# subset of `TWEET_COLUMNS` to read, None for all of them
+Columns = Optional[Sequence[str]]
+
+# (tweet, type, reference) values of single row to insert
+NewTweet = Tuple[Optional[str], str, Optional[str]]
+
+# (seq, op, changed_at, tweet_id) followed by tweet columns, which are all
+# None if tweet does not exist any more
+ChangeResp = Tuple
+
+HASHTAG = 'hashtag'
+MENTION = 'mention'
+TAG_KINDS = {'#': HASHTAG, '@': MENTION}
+# `#` or `@` followed by word characters, not preceded by word character, so
+# e-mail addresses and `C#` are not tags
+TAG_PATTERN = r'(?<!\w)([#@])(\w+)'
+_tag_re = re.compile(TAG_PATTERN)
+
+# (kind, tag) of single tag
+Tag = Tuple[str, str]
+
+# (id, callback, created_at) of subscription to changes of tweets
+SubscriptionResp = Tuple[int, str, datetime]
+
+
+def make_reference(server: str, ref) -> str:
+    """
+    Returns reference stored with retweet pointing to tweet on other server.
+    """
+    return f'{server}#{ref}'
+
+
+def extract_tags(content: Optional[str]) -> List[Tag]:
+    """
+    Returns distinct hashtags and mentions of tweet content, lower cased and
+    without leading `#` or `@`, in order of appearance.
+    """
+    tags = []
+    for prefix, tag in _tag_re.findall(content or ''):
+        tag = (TAG_KINDS[prefix], tag.lower())
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def select_columns(columns: Columns) -> str:
+    """
+    Returns select list for provided tweet columns.
+
+    :raises ValueError: If column is not one of `TWEET_COLUMNS`.
+    """
+    if columns is None:
+        return TWEET_COLUMN_ORDER
+    unknown = set(columns) - set(TWEET_COLUMNS)
+    if unknown or not columns:
+        raise ValueError(f'Invalid tweet columns: {columns}.')
+    return ', '.join(columns)
+
+
+def project_tweets(tweets: Iterable[Tuple], columns: Columns) -> List[Tuple]:
+    """
+    Returns only provided columns of tweets in `TWEET_COLUMN_ORDER`.
+    """
+    if columns is None:
+        return list(tweets)
+    indexes = [TWEET_COLUMNS.index(c) for c in columns]
+    return [tuple(t[i] for i in indexes) for t in tweets]
+
+
+def filter_tweets(tweets: Iterable[Tuple],
+                  content: Optional[str],
+                  from_created: Optional[datetime],
+                  to_created: Optional[datetime],
+                  from_modified: Optional[datetime],
+                  to_modified: Optional[datetime],
+                  retweet: Optional[bool]) -> List[Tuple]:
+    """
+    Filters provided tweets by search criteria. Tweets have to have
+    attributes named as in `TWEET_COLUMN_ORDER`.
+    """
+    content = content.lower() if content is not None else None
+    res = []
+    for t in tweets:
+        if content is not None and content not in (t.tweet or '').lower():
+            continue
+        if from_created is not None and not t.created_at > from_created:
+            continue
+        if to_created is not None and not t.created_at < to_created:
+            continue
+        if from_modified is not None and not t.modified_at > from_modified:
+            continue
+        if to_modified is not None and not t.modified_at < to_modified:
+            continue
+        if retweet is not None and t.type != 'retweet':
+            continue
+        res.append(t)
+    return res
 
 
 class Operations(metaclass=abc.ABCMeta):
 
     @staticmethod
     @abc.abstractmethod
-    def get_all_tweets(cursor):
+    def get_all_tweets(columns: Columns, cursor):
         """
         Returns all tweets from database.
+        :param columns: Columns to read, all columns in `TWEET_COLUMN_ORDER` if None.
         :param cursor: Database cursor.
         :return: All tweets from database.
         """
@@ -50,6 +161,45 @@ class Operations(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError()
 
+    @staticmethod
+    @abc.abstractmethod
+    def insert_tweets(tweets: List[NewTweet], cursor) -> List[TwResp]:
+        """
+        Inserts multiple tweets at once.
+
+        :param tweets: List of (tweet, type, reference) tuples to insert.
+        :param cursor: Database cursor.
+        :return: Created tweets, in the same order as provided.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def import_tweets(tweets: List[TwResp], keep_ids: bool, cursor) -> int:
+        """
+        Inserts tweets exported from this or other node, keeping their
+        content, type, reference and creation and modification times.
+
+        :param tweets: Tweets as tuples of columns in `TWEET_COLUMN_ORDER`.
+        :param keep_ids: If IDs of tweets should be kept, otherwise new IDs
+            are assigned.
+        :param cursor: Database cursor.
+        :return: Number of inserted tweets.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def get_tweets_page(after_id: int, limit: int, cursor) -> List[TwResp]:
+        """
+        Returns tweets ordered by ID, for going through all tweets in pages.
+
+        :param after_id: ID of the last tweet of previous page, 0 for first page.
+        :param limit: Max number of tweets to return.
+        :param cursor: Database cursor.
+        """
+        raise NotImplementedError()
+
     @staticmethod
     @abc.abstractmethod
     def modify_tweet(id_: int, new_content: str, cursor) -> TwResp:
@@ -100,6 +250,30 @@ class Operations(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError()
 
+    @staticmethod
+    @abc.abstractmethod
+    def get_changes(since: int, limit: int, cursor) -> List[ChangeResp]:
+        """
+        Returns changes of tweets (create, modify, delete) recorded after
+        provided sequence number, ordered by sequence number.
+
+        :param since: Sequence number of last change caller has seen.
+        :param limit: Max number of changes to return.
+        :param cursor: Database cursor.
+        :return: List of changes with current state of changed tweet.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def last_change_seq(cursor) -> int:
+        """
+        Returns sequence number of the latest change, 0 if there are no changes.
+
+        :param cursor: Database cursor.
+        """
+        raise NotImplementedError()
+
     @staticmethod
     @abc.abstractmethod
     def search_tweets(content: Optional[str],
@@ -107,7 +281,7 @@ class Operations(metaclass=abc.ABCMeta):
                       to_created: Optional[datetime],
                       from_modified: Optional[datetime],
                       to_modified: Optional[datetime],
-                      retweet: Optional[bool], cursor) -> Iterable[TwResp]:
+                      retweet: Optional[bool], columns: Columns, cursor) -> Iterable[TwResp]:
         """
         :param content: Content to search in tweet.
         :param from_created: Start time for tweet creation.
@@ -115,23 +289,204 @@ class Operations(metaclass=abc.ABCMeta):
         :param from_modified: Start time for tweet modification.
         :param to_modified: End time for tweet modification.
         :param retweet: Flag indication if retweet or original tweets should be searched.
+        :param columns: Columns to read, all columns in `TWEET_COLUMN_ORDER` if None.
+        :param cursor: Database cursor.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def get_tagged_tweets(kind: str, tag: str, limit: int, cursor) -> List[TwResp]:
+        """
+        Returns tweets containing hashtag or mention, newest first. Tags are
+        extracted with `extract_tags` whenever tweet is created or modified.
+
+        :param kind: Either `HASHTAG` or `MENTION`.
+        :param tag: Lower cased tag without leading `#` or `@`.
+        :param limit: Max number of tweets to return.
+        :param cursor: Database cursor.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def count_tags(kind: str, window: int, limit: int, cursor) -> List[Tuple[str, int]]:
+        """
+        Returns tags of tweets created in the last `window` seconds with
+        number of tweets containing them, most used first.
+
+        :param kind: Either `HASHTAG` or `MENTION`.
+        :param window: Length of time window in seconds.
+        :param limit: Max number of tags to return.
+        :param cursor: Database cursor.
+        :return: List of (tag, count) tuples.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def ensure_partitions(months_ahead: int, cursor) -> int:
+        """
+        Makes sure that storage for tweets created in upcoming months exists.
+
+        :param months_ahead: Number of months after current one to prepare.
+        :param cursor: Database cursor.
+        :return: Number of created partitions.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def compact(cursor) -> bool:
+        """
+        Reclaims space taken by deleted and overwritten tweets, if there is
+        enough of it for compaction to pay off.
+
+        :param cursor: Database cursor.
+        :return: True if storage was compacted.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def add_subscription(callback: str, cursor) -> SubscriptionResp:
+        """
+        Subscribes callback address to changes of tweets. Subscribing the
+        same address again returns existing subscription.
+
+        :param callback: URL changes are sent to.
+        :param cursor: Database cursor.
+        :return: Subscription of callback.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def get_subscriptions(cursor) -> List[SubscriptionResp]:
+        """
+        Returns all subscriptions, oldest first.
+
+        :param cursor: Database cursor.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def delete_subscription(id_: int, cursor) -> bool:
+        """
+        Removes subscription with provided ID.
+
+        :param id_: ID of subscription.
+        :param cursor: Database cursor.
+        :return: False if subscription does not exist.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def upsert_peer_tweets(peer: str, tweets: List[TwResp], synced_at: datetime, cursor):
+        """
+        Stores tweets pulled from peer node into local mirror and moves
+        watermark of that peer to the latest modification time seen.
+
+        :param peer: Address of peer node.
+        :param tweets: Tweets of peer node.
+        :param synced_at: Time when tweets were pulled.
+        :param cursor: Database cursor.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def apply_peer_changes(peer: str, tweets: List[TwResp], deleted: List[int], seq: int,
+                           synced_at: datetime, cursor):
+        """
+        Applies changes pulled from change feed of peer node to local mirror:
+        stores created and modified tweets, removes deleted ones and records
+        sequence number of the last applied change.
+
+        :param peer: Address of peer node.
+        :param tweets: Created or modified tweets of peer node.
+        :param deleted: IDs of deleted tweets of peer node.
+        :param seq: Sequence number of the last applied change.
+        :param synced_at: Time when changes were pulled.
         :param cursor: Database cursor.
         """
         raise NotImplementedError()
 
+    @staticmethod
+    @abc.abstractmethod
+    def get_peer_sync(cursor) -> List[Tuple[str, Optional[datetime], datetime, Optional[int]]]:
+        """
+        Returns sync state of all mirrored peers. Sequence number is None
+        for peers not synced from change feed yet.
+
+        :param cursor: Database cursor.
+        :return: List of (peer, watermark, synced_at, seq) tuples.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    @abc.abstractmethod
+    def search_peer_tweets(content: Optional[str],
+                           from_created: Optional[datetime],
+                           to_created: Optional[datetime],
+                           from_modified: Optional[datetime],
+                           to_modified: Optional[datetime],
+                           retweet: Optional[bool], cursor) -> Iterable[Tuple]:
+        """
+        Performs search on tweets mirrored from peer nodes. Parameters are
+        the same as for `search_tweets`.
+
+        :return: Rows with peer address followed by tweet columns.
+        """
+        raise NotImplementedError()
+
 
 default_backend = os.getenv('ST_DB_BACKEND', 'pg')
 
 
 def get_db(backend=default_backend):
     """
-    Opens a new database connection if there is none yet for
-    the current application context.
+    Returns database to execute operations on with `do`. Backends that
+    pool connections return pool, others return `Database`.
     """
     backend_module = import_module(f'seventweets.db.backends.{backend}')
+    if hasattr(backend_module, 'get_db'):
+        return backend_module.get_db()
+    return backend_module.Database()
+
+
+def get_connection(backend=default_backend):
+    """
+    Opens new dedicated connection, owned by caller, for work that needs
+    connection itself and not just `do`, like migrations.
+    """
+    backend_module = import_module(f'seventweets.db.backends.{backend}')
+    return backend_module.Database()
+
+
+def get_read_db(backend=default_backend):
+    """
+    Opens database connection for read only operations. Backends with
+    replicas route it to replica, others return the same as `get_db`.
+    """
+    backend_module = import_module(f'seventweets.db.backends.{backend}')
+    if hasattr(backend_module, 'get_read_db'):
+        return backend_module.get_read_db()
     return backend_module.Database()
 
 
 def get_ops(backend=default_backend) -> Operations:
     backend_module = import_module(f'seventweets.db.backends.{backend}')
     return backend_module.Operations
+
+
+def get_listener(channel: str, backend=default_backend):
+    """
+    Returns listener for notifications about changes on provided channel.
+    Listener has `wait(timeout)` method returning True if notification was
+    received and `close()`.
+    """
+    backend_module = import_module(f'seventweets.db.backends.{backend}')
+    return backend_module.Listener(channel)
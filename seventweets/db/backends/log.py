@@ -0,0 +1,668 @@
+"""
+Log-structured storage for :class `Operations`, for small nodes that should
+not depend on Postgres.
+
+Every change of a tweet is appended as a record to segment files in
+`ST_LOG_DIR`. Record is length prefixed and checksummed::
+
+    length (4 bytes) | crc32 of payload (4 bytes) | payload (JSON)
+
+and holds full state of tweet after the change, so tweet is read with single
+read at offset found in index. Segments are rotated when they grow over
+`ST_LOG_SEGMENT_SIZE` bytes.
+
+Index is memory-mapped file with fixed size slot for every tweet ID, holding
+segment, offset and length of the latest record of that tweet. Header of
+index holds checkpoint, position in log up to which index was flushed, so on
+startup only records after checkpoint are replayed. Record torn by crash in
+the middle of write is cut off from the end of log.
+
+Compaction copies the latest records of existing tweets to new segment and
+atomically replaces index with one pointing to it, after which old segments
+are removed.
+
+Records are also change feed, each one holds sequence number of the change.
+Changes of tweets that were removed by compaction are not available any more.
+Position of every `_SEQ_MARK_INTERVAL`-th record written since startup is
+kept in memory, so reading recent changes scans only records after the
+closest mark instead of whole segment.
+
+Storage directory is locked, so it can be used by single process only and
+server has to run with one worker process. Mirror of peer tweets is kept in
+memory and is pulled again after restart. Subscriptions to changes are kept
+in memory as well, so subscribers have to subscribe again after restart. Index of hashtags and mentions is
+kept in memory too, it is built from all tweets on the first tag query.
+"""
+import os
+import json
+import mmap
+import zlib
+import fcntl
+import struct
+import atexit
+import logging
+import heapq
+import bisect
+import itertools
+import threading
+from datetime import datetime, timedelta
+from collections import namedtuple
+from typing import Iterable, Optional, List, Dict, Tuple, Iterator
+
+from flask import current_app
+
+from seventweets import db, deadline
+from seventweets.db import (
+    TwResp, TWEET_COLUMN_ORDER, NewTweet, ChangeResp, Columns, make_reference, filter_tweets,
+    project_tweets, extract_tags, Tag
+)
+from seventweets.db.backends import memory
+from seventweets.utils import as_bool
+
+logger = logging.getLogger(__name__)
+
+Tweet = namedtuple('Tweet', TWEET_COLUMN_ORDER)
+
+# changes are notified in process, same as with memory backend
+Listener = memory.Listener
+
+# length, crc32 of payload
+_RECORD_HEADER = struct.Struct('>II')
+# magic, flags, reserved, sequence number of the first record
+_SEGMENT_HEADER = struct.Struct('>8sIIQ')
+# magic, first segment, checkpoint segment, checkpoint offset,
+# next tweet ID, next sequence number, number of originals and retweets
+_INDEX_HEADER = struct.Struct('>8sIIQQQQQ')
+_INDEX_HEADER_SIZE = 64
+# segment (0 if tweet does not exist), offset, length
+_SLOT = struct.Struct('>IQI')
+
+_SEGMENT_MAGIC = b'7TWSEG01'
+_INDEX_MAGIC = b'7TWIDX01'
+# segment was written by compaction
+_COMPACTED = 1
+_INITIAL_SLOTS = 1024
+# records between two positions of change feed kept in memory
+_SEQ_MARK_INTERVAL = 64
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_micros(dt: datetime) -> int:
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _record(op: str, seq: int, tweet: Tweet) -> dict:
+    record = {'seq': seq, 'op': op, 'id': tweet.id, 'type': tweet.type,
+              'at': _to_micros(datetime.now())}
+    if op != 'delete':
+        record.update(tweet=tweet.tweet,
+                      created_at=_to_micros(tweet.created_at),
+                      modified_at=_to_micros(tweet.modified_at),
+                      reference=tweet.reference)
+    return record
+
+
+def _tweet(record: dict) -> Tweet:
+    return Tweet(id=record['id'], tweet=record['tweet'], type=record['type'],
+                 created_at=_from_micros(record['created_at']),
+                 modified_at=_from_micros(record['modified_at']),
+                 reference=record['reference'])
+
+
+def _frame(record: dict) -> bytes:
+    payload = json.dumps(record, separators=(',', ':')).encode()
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class Database:
+    """
+    Log-structured storage for :class `Operations`.
+
+    Storage is opened once per process and directory and shared by all
+    instances, access to it is serialized by lock.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __new__(cls):
+        path = os.path.abspath(current_app.config['ST_LOG_DIR'])
+        with cls._instances_lock:
+            instance = cls._instances.get(path)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance._open(path, current_app.config)
+                atexit.register(instance.checkpoint)
+                cls._instances[path] = instance
+            return instance
+
+    def _open(self, path: str, config):
+        self.path = path
+        self.segment_size = int(config['ST_LOG_SEGMENT_SIZE'])
+        self.fsync = as_bool(config['ST_LOG_FSYNC'])
+        self.checkpoint_records = int(config['ST_LOG_CHECKPOINT_RECORDS'])
+        self.compact_ratio = float(config['ST_LOG_COMPACT_RATIO'])
+        self.compact_min_size = int(config['ST_LOG_COMPACT_MIN_SIZE'])
+        self.lock = threading.RLock()
+        self.peer_tweets = dict()
+        self.peer_sync = dict()
+        self.subscriptions = dict()
+        self.subscription_counter = itertools.count(1)
+
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, 'LOCK'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f'Log storage {path} is already used by another process.')
+
+        self._segments: Dict[int, object] = {}
+        self._first_seqs: Dict[int, int] = {}
+        # (seq, segment, offset) of records, all records before have lower seq
+        self._seq_marks: List[Tuple[int, int, int]] = []
+        self._pending = 0
+        # index of tags is built on first use
+        self._tags: Optional[Dict[Tag, Dict[int, datetime]]] = None
+        self._tweet_tags: Dict[int, List[Tag]] = {}
+        self._open_index()
+        self._recover()
+
+    def test_connection(self):
+        pass
+
+    def close(self):
+        pass
+
+    def do(self, fn):
+        """
+        Executes provided fn and gives it a storage to work with.
+        :param fn:
+            Function to execute.
+            It has to accept one arguments, the :class: `Database` instance.
+        :return: Whatever `fn` returns.
+        """
+        deadline.check()
+        with self.lock:
+            return fn(self)
+
+    # index
+
+    def _index_path(self) -> str:
+        return os.path.join(self.path, 'index')
+
+    def _write_index(self, path: str, slots: bytes):
+        """
+        Writes complete index with current header and provided slots to file
+        at path and flushes it to disk.
+        """
+        header = _INDEX_HEADER.pack(
+            _INDEX_MAGIC, self.first_segment, self.active, self.active_size,
+            self.next_id, self.next_seq, self.counts['original'], self.counts['retweet']
+        )
+        with open(path, 'wb') as f:
+            f.write(header.ljust(_INDEX_HEADER_SIZE, b'\0'))
+            f.write(slots)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _open_index(self):
+        path = self._index_path()
+        if not os.path.exists(path):
+            self.first_segment = self.active = 1
+            self.active_size = _SEGMENT_HEADER.size
+            self.next_id = self.next_seq = 1
+            self.counts = {'original': 0, 'retweet': 0}
+            self._write_index(path, bytes(_SLOT.size * _INITIAL_SLOTS))
+        self._index_file = open(path, 'r+b')
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        (magic, self.first_segment, self.active, self.active_size, self.next_id,
+         self.next_seq, originals, retweets) = _INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != _INDEX_MAGIC:
+            raise RuntimeError(f'File {path} is not index of log storage.')
+        self.counts = {'original': originals, 'retweet': retweets}
+
+    def _slot(self, id_: int) -> Tuple[int, int, int]:
+        pos = _INDEX_HEADER_SIZE + id_ * _SLOT.size
+        if id_ <= 0 or pos + _SLOT.size > len(self._index):
+            return 0, 0, 0
+        return _SLOT.unpack_from(self._index, pos)
+
+    def _set_slot(self, id_: int, segment: int, offset: int, length: int):
+        pos = _INDEX_HEADER_SIZE + id_ * _SLOT.size
+        if pos + _SLOT.size > len(self._index):
+            size = len(self._index)
+            while pos + _SLOT.size > size:
+                size = _INDEX_HEADER_SIZE + (size - _INDEX_HEADER_SIZE) * 2
+            self._index.resize(size)
+        _SLOT.pack_into(self._index, pos, segment, offset, length)
+
+    def _slots(self, start: int=0) -> Iterator[Tuple[int, int, int, int]]:
+        """
+        Yields (id, segment, offset, length) of all existing tweets, in order
+        of ID, starting with ID `start`.
+        """
+        end = min(len(self._index), _INDEX_HEADER_SIZE + self.next_id * _SLOT.size)
+        begin = min(end, _INDEX_HEADER_SIZE + start * _SLOT.size)
+        slots = self._index[begin:end]
+        for id_, (segment, offset, length) in enumerate(_SLOT.iter_unpack(slots), start):
+            if segment:
+                yield id_, segment, offset, length
+
+    def checkpoint(self):
+        """
+        Flushes log and index to disk and moves checkpoint to the end of log,
+        so records before it are not replayed on next start.
+        """
+        with self.lock:
+            os.fsync(self._segments[self.active].fileno())
+            self._index.flush()
+            _INDEX_HEADER.pack_into(
+                self._index, 0, _INDEX_MAGIC, self.first_segment, self.active, self.active_size,
+                self.next_id, self.next_seq, self.counts['original'], self.counts['retweet']
+            )
+            self._index.flush(0, mmap.PAGESIZE)
+            self._pending = 0
+
+    # segments
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.path, f'{number:08d}.log')
+
+    def _segment_numbers(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.path)
+                      if name.endswith('.log') and name[:-4].isdigit())
+
+    def _create_segment(self, number: int, first_seq: int, flags: int=0, path: str=None):
+        with open(path or self._segment_path(number), 'wb') as f:
+            f.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, flags, 0, first_seq))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _open_segment(self, number: int):
+        f = open(self._segment_path(number), 'r+b')
+        magic, flags, _, first_seq = _SEGMENT_HEADER.unpack(f.read(_SEGMENT_HEADER.size))
+        if magic != _SEGMENT_MAGIC:
+            raise RuntimeError(f'File {f.name} is not segment of log storage.')
+        self._segments[number] = f
+        self._first_seqs[number] = first_seq
+        return f
+
+    def _read_flags(self, number: int) -> Optional[int]:
+        with open(self._segment_path(number), 'rb') as f:
+            header = f.read(_SEGMENT_HEADER.size)
+        if len(header) < _SEGMENT_HEADER.size:
+            return None
+        return _SEGMENT_HEADER.unpack(header)[1]
+
+    def _scan(self, number: int, start: int, end: Optional[int]=None,
+              truncate: bool=False) -> Iterator[Tuple[int, int, dict]]:
+        """
+        Yields (offset, length, record) of records in segment.
+
+        :param number: Segment number.
+        :param start: Offset to start from.
+        :param end: Offset to stop at, end of file if not provided.
+        :param truncate: Cut off torn record at the end of segment.
+        """
+        with open(self._segment_path(number), 'rb') as f:
+            f.seek(start)
+            offset = start
+            while end is None or offset < end:
+                header = f.read(_RECORD_HEADER.size)
+                if not header:
+                    return
+                payload = b''
+                if len(header) == _RECORD_HEADER.size:
+                    length, crc = _RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                if len(header) < _RECORD_HEADER.size or len(payload) < length \
+                        or zlib.crc32(payload) != crc:
+                    if truncate:
+                        logger.warning('Cutting off torn record at %d of segment %d.', offset, number)
+                        os.truncate(self._segment_path(number), offset)
+                    return
+                yield offset, _RECORD_HEADER.size + length, json.loads(payload)
+                offset += _RECORD_HEADER.size + length
+
+    def _recover(self):
+        for number in self._segment_numbers():
+            flags = self._read_flags(number)
+            # leftovers of interrupted compaction or segment creation
+            if (number < self.first_segment or flags is None
+                    or (number > self.active and flags & _COMPACTED)):
+                logger.warning('Removing unused segment %d of log storage.', number)
+                os.remove(self._segment_path(number))
+        numbers = self._segment_numbers()
+        if not numbers:
+            self._create_segment(self.first_segment, self.next_seq)
+            numbers = [self.first_segment]
+
+        replayed = 0
+        for number in numbers:
+            self._open_segment(number)
+            if number < self.active:
+                continue
+            start = self.active_size if number == self.active else _SEGMENT_HEADER.size
+            for offset, length, record in self._scan(number, start, truncate=True):
+                self._apply(record, number, offset, length)
+                replayed += 1
+        self.active = numbers[-1]
+        self.active_size = os.path.getsize(self._segment_path(self.active))
+        self._seq_marks.append((self.next_seq, self.active, self.active_size))
+        self.checkpoint()
+        logger.info('Opened log storage %s, replayed %d records.', self.path, replayed)
+
+    def _apply(self, record: dict, segment: int, offset: int, length: int):
+        """
+        Applies record to index. Replaying records that were already applied
+        leaves index in the same state.
+        """
+        id_ = record['id']
+        if record['op'] == 'delete':
+            self._set_slot(id_, 0, 0, 0)
+            self.counts[record['type']] -= 1
+        else:
+            self._set_slot(id_, segment, offset, length)
+            if record['op'] == 'create':
+                self.counts[record['type']] += 1
+        if self._tags is not None:
+            self._untag(id_)
+            if record['op'] != 'delete':
+                self._tag(id_, record['tweet'], _from_micros(record['created_at']))
+        self.next_id = max(self.next_id, id_ + 1)
+        self.next_seq = max(self.next_seq, record['seq'] + 1)
+        if not self._seq_marks or record['seq'] >= self._seq_marks[-1][0] + _SEQ_MARK_INTERVAL:
+            self._seq_marks.append((record['seq'], segment, offset))
+
+    def append(self, records: List[dict]):
+        """
+        Appends records to the end of log and applies them to index. Records
+        are written with single write and, if `ST_LOG_FSYNC` is set, flushed
+        to disk before index is changed.
+        """
+        framed = [_frame(r) for r in records]
+        f = self._segments[self.active]
+        f.seek(self.active_size)
+        f.write(b''.join(framed))
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+        offset = self.active_size
+        for record, data in zip(records, framed):
+            self._apply(record, self.active, offset, len(data))
+            offset += len(data)
+        self.active_size = offset
+
+        self._pending += len(records)
+        if self._pending >= self.checkpoint_records:
+            self.checkpoint()
+        if self.active_size >= self.segment_size:
+            self.checkpoint()
+            number = self.active + 1
+            self._create_segment(number, self.next_seq)
+            self._open_segment(number)
+            self.active = number
+            self.active_size = _SEGMENT_HEADER.size
+
+    def _read_raw(self, segment: int, offset: int, length: int) -> bytes:
+        return os.pread(self._segments[segment].fileno(), length, offset)
+
+    def read(self, segment: int, offset: int, length: int) -> dict:
+        return json.loads(self._read_raw(segment, offset, length)[_RECORD_HEADER.size:])
+
+    def get(self, id_: int) -> Optional[Tweet]:
+        segment, offset, length = self._slot(id_)
+        if not segment:
+            return None
+        return _tweet(self.read(segment, offset, length))
+
+    def all(self) -> List[Tweet]:
+        return [_tweet(self.read(segment, offset, length))
+                for _, segment, offset, length in self._slots()]
+
+    @property
+    def tags(self) -> Dict[Tag, Dict[int, datetime]]:
+        """
+        Index of hashtags and mentions, (kind, tag) -> {tweet id: created_at}.
+        It is built from all tweets on first use and kept up to date by
+        `_apply` afterwards.
+        """
+        if self._tags is None:
+            self._tags = {}
+            for tweet in self.all():
+                self._tag(tweet.id, tweet.tweet, tweet.created_at)
+        return self._tags
+
+    def _tag(self, id_: int, content: Optional[str], created_at: datetime):
+        tags = extract_tags(content)
+        for tag in tags:
+            self._tags.setdefault(tag, {})[id_] = created_at
+        if tags:
+            self._tweet_tags[id_] = tags
+
+    def _untag(self, id_: int):
+        for tag in self._tweet_tags.pop(id_, ()):
+            tagged = self._tags[tag]
+            del tagged[id_]
+            if not tagged:
+                del self._tags[tag]
+
+    def changes(self, since: int) -> Iterator[dict]:
+        """
+        Yields records with sequence number greater than `since`.
+        """
+        numbers = sorted(self._segments)
+        start, start_offset = numbers[0], _SEGMENT_HEADER.size
+        i = bisect.bisect_right(self._seq_marks, (since + 1, float('inf'), float('inf'))) - 1
+        if i >= 0:
+            _, start, start_offset = self._seq_marks[i]
+        else:
+            for number in numbers:
+                if self._first_seqs[number] <= since + 1:
+                    start = number
+        for number in numbers[numbers.index(start):]:
+            end = self.active_size if number == self.active else None
+            offset = start_offset if number == start else _SEGMENT_HEADER.size
+            for _, _, record in self._scan(number, offset, end):
+                if record['seq'] > since:
+                    yield record
+
+    # compaction
+
+    def size(self) -> Tuple[int, int]:
+        """
+        Returns total size of log and size of live records in it.
+        """
+        total = sum(os.path.getsize(self._segment_path(n)) for n in self._segments)
+        live = sum(length for _, _, _, length in self._slots())
+        return total, live + _SEGMENT_HEADER.size
+
+    def compact(self, force: bool=False) -> bool:
+        """
+        Rewrites the latest records of existing tweets to new segment and
+        removes old segments, if log is at least `ST_LOG_COMPACT_MIN_SIZE`
+        bytes and `ST_LOG_COMPACT_RATIO` times larger than live records.
+
+        :param force: Compact regardless of log size.
+        :return: True if log was compacted.
+        """
+        total, live = self.size()
+        if not force and (total < self.compact_min_size or total < live * self.compact_ratio):
+            return False
+
+        records = []
+        for id_, segment, offset, length in self._slots():
+            raw = self._read_raw(segment, offset, length)
+            records.append((json.loads(raw[_RECORD_HEADER.size:])['seq'], id_, raw))
+        records.sort()
+
+        number = self.active + 1
+        path = self._segment_path(number)
+        first_seq = records[0][0] if records else self.next_seq
+        self._create_segment(number, first_seq, _COMPACTED, path=path + '.tmp')
+        slots = bytearray(len(self._index) - _INDEX_HEADER_SIZE)
+        with open(path + '.tmp', 'ab') as f:
+            offset = _SEGMENT_HEADER.size
+            for _, id_, raw in records:
+                f.write(raw)
+                _SLOT.pack_into(slots, id_ * _SLOT.size, number, offset, len(raw))
+                offset += len(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        # segment is ignored on recovery until index pointing to it is in place
+        os.rename(path + '.tmp', path)
+
+        old = sorted(self._segments)
+        self.first_segment = self.active = number
+        self.active_size = offset
+        self._write_index(self._index_path() + '.tmp', bytes(slots))
+        os.rename(self._index_path() + '.tmp', self._index_path())
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        self._index.close()
+        self._index_file.close()
+        self._index_file = open(self._index_path(), 'r+b')
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        for n in old:
+            self._segments.pop(n).close()
+            self._first_seqs.pop(n)
+            os.remove(self._segment_path(n))
+        self._open_segment(number)
+        # positions in removed segments are gone, compacted one is scanned whole
+        self._seq_marks = [(self.next_seq, number, offset)]
+        self._pending = 0
+        logger.info('Compacted log storage %s from %d to %d bytes.', self.path, total, offset)
+        return True
+
+
+class Operations(db.Operations):
+    @staticmethod
+    def insert_tweet(tweet: str, storage: Database):
+        return Operations.insert_tweets([(tweet, 'original', None)], storage)[0]
+
+    @staticmethod
+    def insert_tweets(tweets: List[NewTweet], storage: Database) -> List[TwResp]:
+        now = datetime.now()
+        new_tweets = [
+            Tweet(id=storage.next_id + i, tweet=content, type=type_,
+                  created_at=now, modified_at=now, reference=reference or '')
+            for i, (content, type_, reference) in enumerate(tweets)
+        ]
+        storage.append([_record('create', storage.next_seq + i, t)
+                        for i, t in enumerate(new_tweets)])
+        return new_tweets
+
+    @staticmethod
+    def import_tweets(tweets: List[TwResp], keep_ids: bool, storage: Database) -> int:
+        new_tweets = [
+            Tweet(id=id_ if keep_ids else storage.next_id + i, tweet=content, type=type_,
+                  created_at=created_at, modified_at=modified_at, reference=reference or '')
+            for i, (id_, content, type_, created_at, modified_at, reference) in enumerate(tweets)
+        ]
+        storage.append([_record('create', storage.next_seq + i, t)
+                        for i, t in enumerate(new_tweets)])
+        return len(new_tweets)
+
+    @staticmethod
+    def get_tweets_page(after_id: int, limit: int, storage: Database) -> List[TwResp]:
+        return [_tweet(storage.read(segment, offset, length))
+                for _, segment, offset, length in itertools.islice(storage._slots(after_id + 1), limit)]
+
+    @staticmethod
+    def get_all_tweets(columns: Columns, storage: Database):
+        return project_tweets(sorted(storage.all(), key=lambda t: t.created_at, reverse=True), columns)
+
+    @staticmethod
+    def get_tweet(id_: int, storage: Database):
+        return storage.get(id_)
+
+    @staticmethod
+    def delete_tweet(id_: int, storage: Database):
+        tweet = storage.get(id_)
+        if tweet is None:
+            return False
+        storage.append([_record('delete', storage.next_seq, tweet)])
+        return True
+
+    @staticmethod
+    def modify_tweet(id_: int, new_content: str, storage: Database) -> TwResp:
+        tweet = storage.get(id_)
+        if tweet is None:
+            return None
+        new_tweet = tweet._replace(tweet=new_content, modified_at=datetime.now())
+        storage.append([_record('modify', storage.next_seq, new_tweet)])
+        return new_tweet
+
+    @staticmethod
+    def count_tweets(type_: str, storage: Database) -> int:
+        if not type_:
+            return sum(storage.counts.values())
+        return storage.counts.get(type_, 0)
+
+    @staticmethod
+    def create_retweet(server: str, ref: str, storage: Database) -> TwResp:
+        return Operations.insert_tweets(
+            [(None, 'retweet', make_reference(server, ref))], storage
+        )[0]
+
+    @staticmethod
+    def get_changes(since: int, limit: int, storage: Database) -> List[ChangeResp]:
+        empty = (None,) * len(Tweet._fields)
+        res = []
+        for record in storage.changes(since):
+            tweet = storage.get(record['id']) if record['op'] != 'delete' else None
+            res.append((record['seq'], record['op'], _from_micros(record['at']), record['id'])
+                       + (tuple(tweet) if tweet else empty))
+            if len(res) >= limit:
+                break
+        return res
+
+    @staticmethod
+    def last_change_seq(storage: Database) -> int:
+        return storage.next_seq - 1
+
+    @staticmethod
+    def search_tweets(content: Optional[str],
+                      from_created: Optional[datetime],
+                      to_created: Optional[datetime],
+                      from_modified: Optional[datetime],
+                      to_modified: Optional[datetime],
+                      retweet: Optional[bool], columns: Columns,
+                      storage: Database) -> Iterable[TwResp]:
+        found = filter_tweets(Operations.get_all_tweets(None, storage), content, from_created,
+                              to_created, from_modified, to_modified, retweet)
+        return project_tweets(found, columns)
+
+    @staticmethod
+    def get_tagged_tweets(kind: str, tag: str, limit: int, storage: Database) -> List[TwResp]:
+        tagged = storage.tags.get((kind, tag), {})
+        return [storage.get(id_) for id_ in heapq.nlargest(limit, tagged, key=tagged.get)]
+
+    # index of tags has the same shape as in memory backend
+    count_tags = staticmethod(memory.Operations.count_tags)
+
+    @staticmethod
+    def ensure_partitions(months_ahead: int, storage: Database) -> int:
+        return 0
+
+    @staticmethod
+    def compact(storage: Database) -> bool:
+        return storage.compact()
+
+    # subscriptions and mirror of peer tweets are kept in memory
+    add_subscription = staticmethod(memory.Operations.add_subscription)
+    get_subscriptions = staticmethod(memory.Operations.get_subscriptions)
+    delete_subscription = staticmethod(memory.Operations.delete_subscription)
+    upsert_peer_tweets = staticmethod(memory.Operations.upsert_peer_tweets)
+    apply_peer_changes = staticmethod(memory.Operations.apply_peer_changes)
+    get_peer_sync = staticmethod(memory.Operations.get_peer_sync)
+    search_peer_tweets = staticmethod(memory.Operations.search_peer_tweets)
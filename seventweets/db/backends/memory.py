@@ -1,28 +1,52 @@
+import heapq
 import logging
 import itertools
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from collections import namedtuple
-from typing import Iterable, Optional, List, Dict
+from typing import Iterable, Optional, List, Dict, Tuple
 
-from seventweets import db
+from seventweets import db, events, deadline
 
 from seventweets.db import (
-    TwResp, TWEET_COLUMN_ORDER
+    TwResp, TWEET_COLUMN_ORDER, NewTweet, ChangeResp, Columns, make_reference, filter_tweets,
+    project_tweets, extract_tags, SubscriptionResp
 )
 
 logger = logging.getLogger(__name__)
 
 Tweet = namedtuple('Tweet', TWEET_COLUMN_ORDER)
+Change = namedtuple('Change', 'seq, op, changed_at, tweet_id')
+PeerTweet = namedtuple('PeerTweet', 'peer, ' + TWEET_COLUMN_ORDER)
 
 
 class Database:
     """
     In-memory storage for :class `Operations`.
+
+    Storage is shared by all instances inside of single process, so data
+    survives between requests (but not process restart).
     """
+    _instance = None
+    _instance_lock = threading.Lock()
 
-    def __init__(self):
-        self.tweets = list()
-        self.counter = itertools.count()
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                instance = super().__new__(cls)
+                instance.tweets = list()
+                instance.changes = list()
+                instance.peer_tweets = dict()
+                instance.peer_sync = dict()
+                # (kind, tag) -> {tweet id: created_at}
+                instance.tags = dict()
+                instance.subscriptions = dict()
+                instance.subscription_counter = itertools.count(1)
+                instance.counter = itertools.count(1)
+                instance.change_counter = itertools.count(1)
+                instance.lock = threading.RLock()
+                cls._instance = instance
+            return cls._instance
 
     def test_connection(self):
         pass
@@ -30,6 +54,23 @@ class Database:
     def close(self):
         pass
 
+    def record_change(self, tweet_id: int, op: str):
+        self.changes.append(
+            Change(next(self.change_counter), op, datetime.now(), tweet_id)
+        )
+
+    def tag(self, tweet: TwResp):
+        for tag in extract_tags(tweet.tweet):
+            self.tags.setdefault(tag, {})[tweet.id] = tweet.created_at
+
+    def untag(self, tweet: TwResp):
+        for tag in extract_tags(tweet.tweet):
+            tagged = self.tags.get(tag)
+            if tagged is not None:
+                tagged.pop(tweet.id, None)
+                if not tagged:
+                    del self.tags[tag]
+
     def do(self, fn):
         """
         Executes provided fn and gives it a storage to work with.
@@ -38,23 +79,72 @@ class Database:
             It has to accept one arguments, the :class: `Database` instance.
         :return: Whatever `fn` returns.
         """
-        return fn(self)
+        deadline.check()
+        with self.lock:
+            return fn(self)
+
+
+class Listener:
+    """
+    Receives notifications about changes made in this process.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.seen_version = events.changes.version
+
+    def wait(self, timeout: float) -> bool:
+        changed = events.changes.wait(self.seen_version, timeout)
+        self.seen_version = events.changes.version
+        return changed
+
+    def close(self):
+        pass
 
 
 class Operations(db.Operations):
     @staticmethod
     def insert_tweet(tweet: str, storage: Database):
+        return Operations.insert_tweets([(tweet, 'original', None)], storage)[0]
+
+    @staticmethod
+    def insert_tweets(tweets: List[NewTweet], storage: Database) -> List[TwResp]:
         now = datetime.now()
-        new_tweet = Tweet(
-            id=next(storage.counter), tweet=tweet, type='original',
-            created_at=now, modified_at=now, reference=''
-        )
-        storage.tweets.append(new_tweet)
-        return new_tweet
+        new_tweets = [
+            Tweet(id=next(storage.counter), tweet=content, type=type_,
+                  created_at=now, modified_at=now, reference=reference or '')
+            for content, type_, reference in tweets
+        ]
+        storage.tweets.extend(new_tweets)
+        for new_tweet in new_tweets:
+            storage.tag(new_tweet)
+            storage.record_change(new_tweet.id, 'create')
+        return new_tweets
+
+    @staticmethod
+    def import_tweets(tweets: List[TwResp], keep_ids: bool, storage: Database) -> int:
+        new_tweets = [
+            Tweet(id=id_ if keep_ids else next(storage.counter), tweet=content, type=type_,
+                  created_at=created_at, modified_at=modified_at, reference=reference or '')
+            for id_, content, type_, created_at, modified_at, reference in tweets
+        ]
+        storage.tweets.extend(new_tweets)
+        for new_tweet in new_tweets:
+            storage.tag(new_tweet)
+            storage.record_change(new_tweet.id, 'create')
+        if keep_ids and new_tweets:
+            last_id = max(t.id for t in new_tweets)
+            storage.counter = itertools.count(max(last_id + 1, next(storage.counter)))
+        return len(new_tweets)
+
+    @staticmethod
+    def get_tweets_page(after_id: int, limit: int, storage: Database) -> List[TwResp]:
+        return heapq.nsmallest(limit, (t for t in storage.tweets if t.id > after_id),
+                               key=lambda t: t.id)
 
     @staticmethod
-    def get_all_tweets(storage: Database):
-        return storage.tweets
+    def get_all_tweets(columns: Columns, storage: Database):
+        return project_tweets(sorted(storage.tweets, key=lambda t: t.created_at, reverse=True), columns)
 
     @staticmethod
     def get_tweet(id_: int, storage: Database):
@@ -62,24 +152,145 @@ class Operations(db.Operations):
             if tweet.id == id_:
                 return tweet
         else:
-            raise KeyError(f'Tweet with id={id_} not found.')
+            return None
 
     @staticmethod
     def delete_tweet(id_: int, storage: Database):
-        try:
-            storage.tweets.remove(Operations.get_tweet(id_, storage))
-            return True
-        except KeyError:
+        tweet = Operations.get_tweet(id_, storage)
+        if tweet is None:
             return False
+        storage.tweets.remove(tweet)
+        storage.untag(tweet)
+        storage.record_change(id_, 'delete')
+        return True
 
     @staticmethod
     def modify_tweet(id_: int, new_content: str, storage: Database) -> TwResp:
         tweet = Operations.get_tweet(id_, storage)
-        assert tweet.type == 'original'
-        new_tweet = Tweet(
-            id=tweet.id, tweet=new_content, type=tweet.type,
-            created_at=tweet.created_at, modified_at=tweet.modified_at
-        )
-        storage.tweets.remove(tweet)
-        storage.tweets.append(new_tweet)
+        if tweet is None:
+            return None
+        new_tweet = tweet._replace(tweet=new_content, modified_at=datetime.now())
+        storage.tweets[storage.tweets.index(tweet)] = new_tweet
+        storage.untag(tweet)
+        storage.tag(new_tweet)
+        storage.record_change(id_, 'modify')
         return new_tweet
+
+    @staticmethod
+    def count_tweets(type_: str, storage: Database) -> int:
+        return sum(1 for t in storage.tweets if not type_ or t.type == type_)
+
+    @staticmethod
+    def create_retweet(server: str, ref: str, storage: Database) -> TwResp:
+        return Operations.insert_tweets(
+            [(None, 'retweet', make_reference(server, ref))], storage
+        )[0]
+
+    @staticmethod
+    def get_changes(since: int, limit: int, storage: Database) -> List[ChangeResp]:
+        by_id: Dict[int, Tweet] = {t.id: t for t in storage.tweets}
+        empty = (None,) * len(Tweet._fields)
+        res = []
+        for change in storage.changes:
+            if change.seq <= since:
+                continue
+            tweet = by_id.get(change.tweet_id) if change.op != 'delete' else None
+            res.append(tuple(change) + (tuple(tweet) if tweet else empty))
+            if len(res) >= limit:
+                break
+        return res
+
+    @staticmethod
+    def last_change_seq(storage: Database) -> int:
+        return storage.changes[-1].seq if storage.changes else 0
+
+    @staticmethod
+    def search_tweets(content: Optional[str],
+                      from_created: Optional[datetime],
+                      to_created: Optional[datetime],
+                      from_modified: Optional[datetime],
+                      to_modified: Optional[datetime],
+                      retweet: Optional[bool], columns: Columns,
+                      storage: Database) -> Iterable[TwResp]:
+        found = filter_tweets(Operations.get_all_tweets(None, storage), content, from_created,
+                              to_created, from_modified, to_modified, retweet)
+        return project_tweets(found, columns)
+
+    @staticmethod
+    def get_tagged_tweets(kind: str, tag: str, limit: int, storage: Database) -> List[TwResp]:
+        tagged = storage.tags.get((kind, tag), {})
+        ids = heapq.nlargest(limit, tagged, key=tagged.get)
+        by_id = {t.id: t for t in storage.tweets if t.id in tagged}
+        return [by_id[id_] for id_ in ids]
+
+    @staticmethod
+    def count_tags(kind: str, window: int, limit: int, storage: Database) -> List[Tuple[str, int]]:
+        since = datetime.now() - timedelta(seconds=window)
+        counts = []
+        for (tag_kind, tag), tagged in storage.tags.items():
+            if tag_kind != kind:
+                continue
+            count = sum(1 for created_at in tagged.values() if created_at > since)
+            if count:
+                counts.append((tag, count))
+        return heapq.nsmallest(limit, counts, key=lambda c: (-c[1], c[0]))
+
+    @staticmethod
+    def ensure_partitions(months_ahead: int, storage: Database) -> int:
+        return 0
+
+    @staticmethod
+    def compact(storage: Database) -> bool:
+        return False
+
+    @staticmethod
+    def add_subscription(callback: str, storage: Database) -> SubscriptionResp:
+        for subscription in storage.subscriptions.values():
+            if subscription[1] == callback:
+                return subscription
+        id_ = next(storage.subscription_counter)
+        storage.subscriptions[id_] = (id_, callback, datetime.now())
+        return storage.subscriptions[id_]
+
+    @staticmethod
+    def get_subscriptions(storage: Database) -> List[SubscriptionResp]:
+        return list(storage.subscriptions.values())
+
+    @staticmethod
+    def delete_subscription(id_: int, storage: Database) -> bool:
+        return storage.subscriptions.pop(id_, None) is not None
+
+    @staticmethod
+    def upsert_peer_tweets(peer: str, tweets: List[TwResp], synced_at: datetime,
+                           storage: Database):
+        for t in tweets:
+            storage.peer_tweets[(peer, t[0])] = PeerTweet(peer, *t)
+        watermark = max((t[4] for t in tweets), default=None)
+        previous = storage.peer_sync.get(peer)
+        if previous is not None and previous[1] is not None:
+            watermark = max(watermark or previous[1], previous[1])
+        seq = previous[3] if previous is not None else None
+        storage.peer_sync[peer] = (peer, watermark, synced_at, seq)
+
+    @staticmethod
+    def apply_peer_changes(peer: str, tweets: List[TwResp], deleted: List[int], seq: int,
+                           synced_at: datetime, storage: Database):
+        Operations.upsert_peer_tweets(peer, tweets, synced_at, storage)
+        for id_ in deleted:
+            storage.peer_tweets.pop((peer, id_), None)
+        storage.peer_sync[peer] = storage.peer_sync[peer][:3] + (seq,)
+
+    @staticmethod
+    def get_peer_sync(storage: Database):
+        return list(storage.peer_sync.values())
+
+    @staticmethod
+    def search_peer_tweets(content: Optional[str],
+                           from_created: Optional[datetime],
+                           to_created: Optional[datetime],
+                           from_modified: Optional[datetime],
+                           to_modified: Optional[datetime],
+                           retweet: Optional[bool], storage: Database) -> Iterable[Tuple]:
+        tweets = sorted(storage.peer_tweets.values(), key=lambda t: t.created_at, reverse=True)
+        return filter_tweets(tweets, content, from_created, to_created,
+                             from_modified, to_modified, retweet)
@@ -1,19 +1,42 @@
+import io
+import os
+import time
 import logging
+import select
+import threading
 import pg8000
 
+from collections import deque
 from datetime import datetime
-from typing import Optional, Iterable, List, Union, Callable
+from functools import partial
+from typing import Optional, Iterable, List, Union, Callable, Tuple, Dict, BinaryIO
 
 from flask import current_app
-from seventweets import db
+from seventweets import db, deadline
+from seventweets.exception import ServiceUnavailable, DeadlineExceeded
+from seventweets.db import routing
 from seventweets.db import (
-    TwResp, _T, TWEET_COLUMN_ORDER
+    TwResp, _T, TWEET_COLUMN_ORDER, NewTweet, ChangeResp, Columns, make_reference, select_columns,
+    extract_tags, SubscriptionResp
 )
 
 
 logger = logging.getLogger(__name__)
 DbCallback = Callable[[pg8000.Cursor], _T]
 
+# SQLSTATE of statement canceled by statement_timeout
+QUERY_CANCELED = '57014'
+
+
+def _sqlstate(e: Exception) -> Optional[str]:
+    """
+    Returns SQLSTATE of server error. Older pg8000 passes fields of error
+    response as arguments, newer as dict.
+    """
+    if e.args and isinstance(e.args[0], dict):
+        return e.args[0].get('C')
+    return e.args[1] if len(e.args) > 1 else None
+
 
 class Database(pg8000.Connection):
     """
@@ -22,17 +45,24 @@ class Database(pg8000.Connection):
     performing commit and rollback when appropriate.
     """
 
-    def __init__(self):
-        super(Database, self).__init__(
-            user=current_app.config['ST_DB_USER'],
-            host=current_app.config['ST_DB_HOST'],
-            unix_sock=None,
-            port=int(current_app.config['ST_DB_PORT']),
-            database=current_app.config['ST_DB_NAME'],
-            password=current_app.config['ST_DB_PASS'],
-            ssl=False,
-            timeout=None
-        )
+    def __init__(self, replica: Optional[routing.Replica]=None):
+        """
+        :param replica: Replica to connect to instead of primary.
+        """
+        self.replica = replica
+        self.broken = False
+        self._guard = threading.Lock()
+        if replica is not None:
+            params = replica.params
+        else:
+            params = dict(
+                user=current_app.config['ST_DB_USER'],
+                host=current_app.config['ST_DB_HOST'],
+                port=int(current_app.config['ST_DB_PORT']),
+                database=current_app.config['ST_DB_NAME'],
+                password=current_app.config['ST_DB_PASS'],
+            )
+        super(Database, self).__init__(unix_sock=None, ssl=False, timeout=None, **params)
 
     def test_connection(self):
         """
@@ -61,34 +91,350 @@ class Database(pg8000.Connection):
 
         After each operation, commit is performed if no exception is raised.
         If exception is raised - transaction is rolled back.
+
+        In request with deadline, statements of transaction are canceled when
+        it passes, and `DeadlineExceeded` is raised.
         :param fn: Function to execute. It has to accept one argument, cursor that it will use to
         communicate with database.
         :return: Whatever `fn` returns
         """
+        # connection is not safe for concurrent use, fail loudly instead of
+        # interleaving protocol messages of two callers
+        if not self._guard.acquire(blocking=False):
+            raise RuntimeError('Database connection is used by two callers at the same time.')
         cursor = self.cursor()
+        start = time.perf_counter()
         try:
+            left = deadline.check()
+            if left is not None:
+                # local to transaction, reset by commit or rollback
+                cursor.execute("SELECT set_config('statement_timeout', %s, true);",
+                               (str(max(1, int(left * 1000))),))
             res = fn(cursor)
             self.commit()
+            if self.replica is not None:
+                self.replica.observe(time.perf_counter() - start)
             return res
-        except Exception:
+        except (pg8000.InterfaceError, pg8000.OperationalError, OSError):
+            self.broken = True
+            raise
+        except Exception as e:
             self.rollback()
+            if _sqlstate(e) == QUERY_CANCELED:
+                raise DeadlineExceeded('Request deadline exceeded while querying database.') from e
             raise
         finally:
             cursor.close()
+            self._guard.release()
+
+
+class Pool:
+    """
+    Connections to single database owned by one worker process.
+
+    `do` borrows connection for the duration of single call, so connection is
+    never used by two threads or greenlets at the same time, and returns it
+    to pool afterwards. Up to `size` idle connections are kept open and at
+    most `max_connections` are open at once, callers over the limit wait for
+    up to `timeout` seconds.
+    """
+
+    def __init__(self, factory: Callable[[], Database], size: int, max_connections: int,
+                 timeout: float, on_connect_error: Callable[[Exception], 'Pool']=None):
+        """
+        :param factory: Opens new connection.
+        :param size: Max number of idle connections.
+        :param max_connections: Max number of open connections, 0 is unlimited.
+        :param timeout: Seconds to wait for free connection.
+        :param on_connect_error: Called when connection can not be opened,
+            returns pool to use instead. Error is raised if not provided.
+        """
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.on_connect_error = on_connect_error
+        self.pid = os.getpid()
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections) if max_connections else None
+        self.opened = 0
+        self.in_use = 0
+        self.max_in_use = 0
+
+    def _acquire(self) -> Database:
+        left = deadline.check()
+        timeout = self.timeout if left is None else min(self.timeout, left)
+        if self._slots is not None and not self._slots.acquire(timeout=timeout):
+            raise ServiceUnavailable('All database connections are in use, try again later.')
+        with self._lock:
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            if self._idle:
+                return self._idle.pop()
+        try:
+            connection = self.factory()
+        except Exception:
+            self._release(None)
+            raise
+        with self._lock:
+            self.opened += 1
+        return connection
+
+    def _release(self, connection: Optional[Database]):
+        with self._lock:
+            self.in_use -= 1
+            if connection is not None and not connection.broken and len(self._idle) < self.size:
+                self._idle.append(connection)
+                connection = None
+        if self._slots is not None:
+            self._slots.release()
+        if connection is not None:
+            connection.cleanup()
+
+    def do(self, fn: DbCallback) -> _T:
+        """
+        Executes provided fn on connection borrowed from pool, same as
+        `Database.do`.
+        """
+        try:
+            connection = self._acquire()
+        except (pg8000.InterfaceError, OSError) as e:
+            if self.on_connect_error is None:
+                raise
+            return self.on_connect_error(e).do(fn)
+        try:
+            return connection.do(fn)
+        finally:
+            self._release(connection)
+
+    def test_connection(self):
+        try:
+            self.do(lambda cur: cur.execute('SELECT 1'))
+        except Exception:
+            logger.critical('Unable to execute query on database.')
+            raise
+
+    def close(self):
+        """
+        Closes idle connections.
+        """
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for connection in idle:
+            connection.cleanup()
+
+
+# pools of this process, by replica name (None for primary)
+_pools: Dict[Optional[str], Pool] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(replica: Optional[routing.Replica]=None) -> Pool:
+    key = replica.name if replica is not None else None
+    with _pools_lock:
+        pool = _pools.get(key)
+        # connections opened before fork can not be shared with parent
+        if pool is None or pool.pid != os.getpid():
+            config = current_app.config
+            on_connect_error = None
+            if replica is not None:
+                def on_connect_error(e):
+                    logger.warning('Unable to connect to replica: %s', e)
+                    routing.replica_failed(replica)
+                    return _pool()
+            pool = Pool(
+                factory=partial(Database, replica),
+                size=int(config['ST_DB_POOL_SIZE']),
+                max_connections=int(config['ST_DB_POOL_MAX']),
+                timeout=float(config['ST_DB_POOL_TIMEOUT']),
+                on_connect_error=on_connect_error,
+            )
+            _pools[key] = pool
+        return pool
+
+
+def get_db() -> Pool:
+    """
+    Returns pool of connections to primary database.
+    """
+    return _pool()
+
+
+def get_read_db() -> Pool:
+    """
+    Returns pool for read only operations, of replica if replicas are
+    configured and client did not write recently, otherwise of primary.
+    """
+    return _pool(routing.choose_replica())
+
+
+def pool_stats() -> Dict[str, dict]:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {
+        key or 'primary': {'opened': p.opened, 'in_use': p.in_use,
+                           'max_in_use': p.max_in_use, 'idle': len(p._idle)}
+        for key, p in pools.items() if p.pid == os.getpid()
+    }
+
+
+class Listener:
+    """
+    Receives Postgres notifications on dedicated connection.
+
+    pg8000 only reads notifications while executing query, so listener waits
+    for socket to become readable and then executes trivial query, which makes
+    pg8000 consume pending notifications.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.db = Database()
+        self.db.autocommit = True
+        self._execute(f'LISTEN {channel};')
+
+    def _execute(self, query: str):
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(query)
+        finally:
+            cursor.close()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits for notification on channel.
+
+        :param timeout: Max time to wait in seconds.
+        :return: True if notification was received, False on timeout.
+        """
+        sock = getattr(self.db, '_usock', None)
+        if sock is not None:
+            select.select([sock], [], [], timeout)
+        else:
+            time.sleep(timeout)
+        self._execute('SELECT 1;')
+        notifications = getattr(self.db, 'notifications', None)
+        if notifications is None:
+            notifications = self.db.notifies
+        received = len(notifications) > 0
+        notifications.clear()
+        return received
+
+    def close(self):
+        self.db.cleanup()
+
+
+def change_horizon(cursor: pg8000.Cursor) -> int:
+    """
+    Returns sequence number of change log below which every change is either
+    committed or rolled back, so readers never pass change committed later.
+    Writing transactions hold shared advisory lock keyed by sequence number
+    lower than any they get (see migration 010) until they finish.
+
+    Position of sequence is read first, in its own statement, so transaction
+    getting sequence number before it is either listed in `pg_locks` or
+    already finished when locks are read.
+    """
+    cursor.execute('''
+        SELECT last_value + CASE WHEN is_called THEN 1 ELSE 0 END FROM tweet_changes_seq_seq;
+    ''')
+    horizon = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT min((classid::bigint << 31) | objid::bigint)
+        FROM pg_locks
+        WHERE locktype = 'advisory' AND objsubid = 2
+            AND database = (SELECT oid FROM pg_database WHERE datname = current_database());
+    ''')
+    in_flight = cursor.fetchone()[0]
+    return horizon if in_flight is None else min(horizon, in_flight)
+
+
+def _copy_value(value) -> str:
+    """
+    Formats value for `COPY` text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyIn(io.RawIOBase):
+    """
+    Readable stream of rows in `COPY` text format. Rows are encoded as they
+    are read, so they do not have to be held in memory at once.
+    """
+
+    def __init__(self, rows: Iterable[tuple]):
+        self._rows = iter(rows)
+        self._buffer = b''
+        self.rows = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self._buffer) < len(b):
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += ('\t'.join(_copy_value(v) for v in row) + '\n').encode('utf-8')
+            self.rows += 1
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class CopyOut:
+    """
+    Writable stream receiving output of `COPY ... TO STDOUT`. Postgres sends
+    every row in separate message, so each write is single row.
+    """
+
+    def __init__(self, out: BinaryIO, header: bool, unescape: bool,
+                 progress: Optional[Callable[[int], None]], every: int):
+        """
+        :param out: Stream to write rows to.
+        :param header: If first write is header line, which is not counted.
+        :param unescape: If backslashes doubled by `COPY` text format should be restored.
+        :param progress: Called with number of rows written so far.
+        :param every: Number of rows between calls of `progress`.
+        """
+        self.out = out
+        self.header = header
+        self.unescape = unescape
+        self.progress = progress
+        self.every = every
+        self.rows = 0
+
+    def write(self, data: bytes):
+        if self.unescape:
+            data = bytes(data).replace(b'\\\\', b'\\')
+        self.out.write(data)
+        if self.header:
+            self.header = False
+            return
+        self.rows += 1
+        if self.progress is not None and self.rows % self.every == 0:
+            self.progress(self.rows)
 
 
 class Operations(db.Operations):
 
     @staticmethod
-    def get_all_tweets(cursor: pg8000.Cursor) -> Iterable[TwResp]:
+    def get_all_tweets(columns: Columns, cursor: pg8000.Cursor) -> Iterable[TwResp]:
         """
         Returns all tweet from database.
 
+        :param columns: Columns to read, all columns in `TWEET_COLUMN_ORDER` if None.
         :param cursor: Database cursor.
         :return: All tweets from database.
         """
         cursor.execute(f'''
-            SELECT {TWEET_COLUMN_ORDER} 
+            SELECT {select_columns(columns)}
             FROM tweets
             ORDER BY created_at DESC;
         ''')
@@ -122,7 +468,110 @@ class Operations(db.Operations):
             INSERT INTO tweets (tweet) VALUES (%s)
             RETURNING {TWEET_COLUMN_ORDER};
         ''', (tweet,))
-        return cursor.fetchone()
+        row = cursor.fetchone()
+        _insert_tags([row], cursor)
+        return row
+
+    @staticmethod
+    def insert_tweets(tweets: List[NewTweet], cursor: pg8000.Cursor) -> List[TwResp]:
+        """
+        Inserts multiple tweets with single statement.
+
+        Rows are inserted in provided order, so serial IDs are ascending in
+        that order. `RETURNING` does not guarantee order, so returned rows
+        are sorted by ID.
+        :param tweets: List of (tweet, type, reference) tuples to insert.
+        :param cursor: Database cursor.
+        :return: Created tweets, in the same order as provided.
+        """
+        values = ', '.join(['(%s, %s, %s, %s)'] * len(tweets))
+        params = []
+        for i, (content, type_, reference) in enumerate(tweets):
+            params.extend((i, content, type_, reference))
+        cursor.execute(f'''
+            INSERT INTO tweets (tweet, type, reference)
+            SELECT v.tweet, v.type, v.reference
+            FROM (VALUES {values}) AS v (ord, tweet, type, reference)
+            ORDER BY v.ord
+            RETURNING {TWEET_COLUMN_ORDER};
+        ''', tuple(params))
+        rows = sorted(cursor.fetchall(), key=lambda row: row[0])
+        _insert_tags(rows, cursor)
+        return rows
+
+    @staticmethod
+    def import_tweets(tweets: List[TwResp], keep_ids: bool, cursor: pg8000.Cursor) -> int:
+        """
+        Inserts tweets with `COPY`, keeping their times, type and reference.
+        When IDs are kept, ID sequence is moved past the highest ID, otherwise
+        new IDs are taken from sequence before copying, so tags of tweets can
+        be copied too. Kept ID that already exists is rejected by database,
+        see `tweet_ids` in migration 006.
+
+        :param tweets: Tweets as tuples of columns in `TWEET_COLUMN_ORDER`.
+        :param keep_ids: If IDs of tweets should be kept.
+        :param cursor: Database cursor.
+        :return: Number of inserted tweets.
+        """
+        if not keep_ids:
+            cursor.execute("SELECT nextval('tweets_id_seq') FROM generate_series(1, %s);", (len(tweets),))
+            tweets = [(new_id,) + tuple(t[1:]) for (new_id,), t in zip(cursor.fetchall(), tweets)]
+        stream = CopyIn(tweets)
+        cursor.execute(f'COPY tweets ({TWEET_COLUMN_ORDER}) FROM STDIN;', stream=stream)
+        tags = CopyIn((t[0], kind, tag, t[3]) for t in tweets for kind, tag in extract_tags(t[1]))
+        cursor.execute('COPY tweet_tags (tweet_id, kind, tag, created_at) FROM STDIN;', stream=tags)
+        if keep_ids:
+            cursor.execute('''
+                SELECT setval('tweets_id_seq', max(id))
+                FROM tweets
+                HAVING max(id) IS NOT NULL;
+            ''')
+        return stream.rows
+
+    @staticmethod
+    def copy_tweets_out(fmt: str, out: BinaryIO, progress: Optional[Callable[[int], None]],
+                        every: int, cursor: pg8000.Cursor) -> int:
+        """
+        Writes all tweets ordered by ID to `out` with `COPY`, either as JSON
+        Lines built by Postgres or as CSV with header.
+
+        :param fmt: Either 'jsonl' or 'csv'.
+        :param out: Binary stream to write to.
+        :param progress: Called with number of written tweets every `every` tweets.
+        :param every: Number of tweets between calls of `progress`.
+        :param cursor: Database cursor.
+        :return: Number of written tweets.
+        """
+        if fmt == 'jsonl':
+            fields = ', '.join(f"'{c}', {c}" for c in TWEET_COLUMN_ORDER.split(', '))
+            query = f'SELECT json_build_object({fields}) FROM tweets ORDER BY id'
+            options = ''
+        else:
+            query = f'SELECT {TWEET_COLUMN_ORDER} FROM tweets ORDER BY id'
+            options = ' WITH (FORMAT csv, HEADER)'
+        # JSON is sent in text format, which doubles backslashes
+        stream = CopyOut(out, header=fmt == 'csv', unescape=fmt == 'jsonl',
+                         progress=progress, every=every)
+        cursor.execute(f'COPY ({query}) TO STDOUT{options};', stream=stream)
+        return stream.rows
+
+    @staticmethod
+    def get_tweets_page(after_id: int, limit: int, cursor: pg8000.Cursor) -> List[TwResp]:
+        """
+        Returns tweets with ID greater than `after_id`, ordered by ID.
+
+        :param after_id: ID of the last tweet of previous page, 0 for first page.
+        :param limit: Max number of tweets to return.
+        :param cursor: Database cursor.
+        """
+        cursor.execute(f'''
+            SELECT {TWEET_COLUMN_ORDER}
+            FROM tweets
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s;
+        ''', (after_id, limit))
+        return cursor.fetchall()
 
     @staticmethod
     def modify_tweet(id_: int, new_content: str, cursor: pg8000.Cursor) -> TwResp:
@@ -139,7 +588,11 @@ class Operations(db.Operations):
             WHERE id = (%s)
             RETURNING {TWEET_COLUMN_ORDER};
         ''', (new_content, datetime.utcnow(), id_))
-        return cursor.fetchone()
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute('DELETE FROM tweet_tags WHERE tweet_id=%s;', (id_,))
+            _insert_tags([row], cursor)
+        return row
 
     @staticmethod
     def delete_tweet(id_: int, cursor: pg8000.Cursor) -> bool:
@@ -153,7 +606,10 @@ class Operations(db.Operations):
             DELETE FROM tweets
             WHERE id=%s
         ''', (id_,))
-        return cursor.rowcount > 0
+        deleted = cursor.rowcount > 0
+        if deleted:
+            cursor.execute('DELETE FROM tweet_tags WHERE tweet_id=%s;', (id_,))
+        return deleted
 
     @staticmethod
     def count_tweets(type_: str, cursor: pg8000.Cursor):
@@ -188,16 +644,50 @@ class Operations(db.Operations):
             INSERT INTO tweets (type, reference)
             VALUES (%s, %s)
             RETURNING {TWEET_COLUMN_ORDER};
-        ''', ('retweet', f'{server}#{ref}'))
+        ''', ('retweet', make_reference(server, ref)))
         return cursor.fetchone()
 
+    @staticmethod
+    def get_changes(since: int, limit: int, cursor: pg8000.Cursor) -> List[ChangeResp]:
+        """
+        Returns changes recorded in change log after provided sequence number.
+
+        :param since: Sequence number of last change caller has seen.
+        :param limit: Max number of changes to return.
+        :param cursor: Database cursor.
+        :return: List of changes with current state of changed tweet.
+        """
+        horizon = change_horizon(cursor)
+        tweet_columns = ', '.join(f't.{c.strip()}' for c in TWEET_COLUMN_ORDER.split(','))
+        cursor.execute(f'''
+            SELECT c.seq, c.op, c.changed_at, c.tweet_id, {tweet_columns}
+            FROM tweet_changes c
+            LEFT JOIN tweets t ON t.id = c.tweet_id AND c.op <> 'delete'
+            WHERE c.seq > %s AND c.seq < %s
+            ORDER BY c.seq
+            LIMIT %s;
+        ''', (since, horizon, limit))
+        return cursor.fetchall()
+
+    @staticmethod
+    def last_change_seq(cursor: pg8000.Cursor) -> int:
+        """
+        Returns sequence number of the latest change, 0 if there are no changes.
+
+        :param cursor: Database cursor.
+        """
+        cursor.execute('SELECT COALESCE(max(seq), 0) FROM tweet_changes WHERE seq < %s;',
+                       (change_horizon(cursor),))
+        return cursor.fetchone()[0]
+
     @staticmethod
     def search_tweets(content: Optional[str],
                       from_created: Optional[datetime],
                       to_created: Optional[datetime],
                       from_modified: Optional[datetime],
                       to_modified: Optional[datetime],
-                      retweet: Optional[bool], cursor: pg8000.Cursor) -> Iterable[TwResp]:
+                      retweet: Optional[bool], columns: Columns,
+                      cursor: pg8000.Cursor) -> Iterable[TwResp]:
         """
         :param content: Content to search in tweet.
         :param from_created: Start time for tweet creation.
@@ -205,37 +695,266 @@ class Operations(db.Operations):
         :param from_modified: Start time for tweet modification.
         :param to_modified: End time for tweet modification.
         :param retweet: Flag indication if retweet or original tweets should be searched.
+        :param columns: Columns to read, all columns in `TWEET_COLUMN_ORDER` if None.
         :param cursor: Database cursor.
         """
-        where: List[str] = []
-        params: List[Union[str, datetime]] = []
-        if content is not None:
-            where.append('tweet ILIKE %s')
-            params.append(f'%{content}%')
-        if from_created is not None:
-            where.append('created_at > %s')
-            params.append(from_created)
-        if to_created is not None:
-            where.append('created_at < %s')
-            params.append(to_created)
-        if from_modified is not None:
-            where.append('modified_at > %s')
-            params.append(from_modified)
-        if to_modified is not None:
-            where.append('modified_at < %s')
-            params.append(to_modified)
-        if retweet is not None:
-            where.append('type=%s')
-            params.append('retweet')
-
-        where_clause = 'WHERE ' + ' AND '.join(where) if len(where) > 0 else ''
-
+        where_clause, params = _search_conditions(
+            content, from_created, to_created, from_modified, to_modified, retweet
+        )
         cursor.execute(f'''
-            SELECT {TWEET_COLUMN_ORDER}
+            SELECT {select_columns(columns)}
             FROM tweets 
             {where_clause}
             ORDER BY created_at DESC;
-        ''', tuple(params))
+        ''', params)
+        return cursor.fetchall()
+
+    @staticmethod
+    def get_tagged_tweets(kind: str, tag: str, limit: int, cursor: pg8000.Cursor) -> List[TwResp]:
+        """
+        Returns tweets with hashtag or mention, newest first, using index of
+        tags.
+
+        :param kind: Either `HASHTAG` or `MENTION`.
+        :param tag: Lower cased tag without leading `#` or `@`.
+        :param limit: Max number of tweets to return.
+        :param cursor: Database cursor.
+        """
+        tweet_columns = ', '.join(f't.{c.strip()}' for c in TWEET_COLUMN_ORDER.split(','))
+        cursor.execute(f'''
+            SELECT {tweet_columns}
+            FROM tweet_tags g
+            JOIN tweets t ON t.id = g.tweet_id AND t.created_at = g.created_at
+            WHERE g.kind=%s AND g.tag=%s
+            ORDER BY g.created_at DESC
+            LIMIT %s;
+        ''', (kind, tag, limit))
+        return cursor.fetchall()
+
+    @staticmethod
+    def count_tags(kind: str, window: int, limit: int, cursor: pg8000.Cursor) -> List[Tuple[str, int]]:
+        """
+        Returns the most used tags of tweets created in the last `window`
+        seconds.
+
+        :param kind: Either `HASHTAG` or `MENTION`.
+        :param window: Length of time window in seconds.
+        :param limit: Max number of tags to return.
+        :param cursor: Database cursor.
+        :return: List of (tag, count) tuples.
+        """
+        cursor.execute('''
+            SELECT tag, count(*) AS used
+            FROM tweet_tags
+            WHERE kind=%s AND created_at > now()::timestamp - make_interval(secs => %s)
+            GROUP BY tag
+            ORDER BY used DESC, tag
+            LIMIT %s;
+        ''', (kind, window, limit))
+        return cursor.fetchall()
+
+    @staticmethod
+    def ensure_partitions(months_ahead: int, cursor: pg8000.Cursor) -> int:
+        """
+        Creates monthly partitions of tweets table for upcoming months. Does
+        nothing until tweets are partitioned by migration 006.
+
+        :param months_ahead: Number of months after current one to prepare.
+        :param cursor: Database cursor.
+        :return: Number of created partitions.
+        """
+        cursor.execute('''
+            SELECT to_regprocedure('create_tweet_partitions(timestamp, integer)') IS NOT NULL
+                AND EXISTS (
+                    SELECT 1 FROM pg_partitioned_table
+                    WHERE partrelid = COALESCE(to_regclass('tweets_partitioned'), to_regclass('tweets'))
+                );
+        ''')
+        if not cursor.fetchone()[0]:
+            return 0
+        cursor.execute('SELECT create_tweet_partitions(now()::timestamp, %s);', (months_ahead,))
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def compact(cursor: pg8000.Cursor) -> bool:
+        # space is reclaimed by autovacuum
+        return False
+
+    @staticmethod
+    def add_subscription(callback: str, cursor: pg8000.Cursor) -> SubscriptionResp:
+        """
+        Subscribes callback address to changes of tweets, returns existing
+        subscription if address is already subscribed.
+
+        :param callback: URL changes are sent to.
+        :param cursor: Database cursor.
+        """
+        cursor.execute('''
+            INSERT INTO subscriptions (callback) VALUES (%s)
+            ON CONFLICT (callback) DO UPDATE SET callback=EXCLUDED.callback
+            RETURNING id, callback, created_at;
+        ''', (callback,))
+        return cursor.fetchone()
+
+    @staticmethod
+    def get_subscriptions(cursor: pg8000.Cursor) -> List[SubscriptionResp]:
+        cursor.execute('SELECT id, callback, created_at FROM subscriptions ORDER BY id;')
+        return cursor.fetchall()
+
+    @staticmethod
+    def delete_subscription(id_: int, cursor: pg8000.Cursor) -> bool:
+        cursor.execute('DELETE FROM subscriptions WHERE id=%s;', (id_,))
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def upsert_peer_tweets(peer: str, tweets: List[TwResp], synced_at: datetime,
+                           cursor: pg8000.Cursor):
+        """
+        Stores tweets pulled from peer node and moves peer watermark to the
+        latest modification time seen.
+
+        :param peer: Address of peer node.
+        :param tweets: Tweets of peer node.
+        :param synced_at: Time when tweets were pulled.
+        :param cursor: Database cursor.
+        """
+        for start in range(0, len(tweets), 500):
+            chunk = tweets[start:start + 500]
+            values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(chunk))
+            params = []
+            for t in chunk:
+                params.append(peer)
+                params.extend(t)
+            cursor.execute(f'''
+                INSERT INTO peer_tweets (peer, {TWEET_COLUMN_ORDER})
+                VALUES {values}
+                ON CONFLICT (peer, id) DO UPDATE SET
+                    tweet=EXCLUDED.tweet,
+                    type=EXCLUDED.type,
+                    created_at=EXCLUDED.created_at,
+                    modified_at=EXCLUDED.modified_at,
+                    reference=EXCLUDED.reference;
+            ''', tuple(params))
+
+        watermark = max((t[4] for t in tweets), default=None)
+        cursor.execute('''
+            INSERT INTO peer_sync (peer, watermark, synced_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (peer) DO UPDATE SET
+                watermark=GREATEST(peer_sync.watermark, EXCLUDED.watermark),
+                synced_at=EXCLUDED.synced_at;
+        ''', (peer, watermark, synced_at))
+
+    @staticmethod
+    def apply_peer_changes(peer: str, tweets: List[TwResp], deleted: List[int], seq: int,
+                           synced_at: datetime, cursor: pg8000.Cursor):
+        """
+        Applies changes pulled from change feed of peer node to mirror and
+        records sequence number of the last one.
+
+        :param peer: Address of peer node.
+        :param tweets: Created or modified tweets of peer node.
+        :param deleted: IDs of deleted tweets of peer node.
+        :param seq: Sequence number of the last applied change.
+        :param synced_at: Time when changes were pulled.
+        :param cursor: Database cursor.
+        """
+        Operations.upsert_peer_tweets(peer, tweets, synced_at, cursor)
+        if deleted:
+            cursor.execute('''
+                DELETE FROM peer_tweets WHERE peer=%s AND id = ANY(%s);
+            ''', (peer, list(deleted)))
+        cursor.execute('''
+            UPDATE peer_sync SET seq=%s WHERE peer=%s;
+        ''', (seq, peer))
+
+    @staticmethod
+    def get_peer_sync(cursor: pg8000.Cursor) -> List[Tuple[str, Optional[datetime], datetime, Optional[int]]]:
+        """
+        Returns sync state of all mirrored peers.
+
+        :param cursor: Database cursor.
+        :return: List of (peer, watermark, synced_at, seq) tuples.
+        """
+        cursor.execute('''
+            SELECT peer, watermark, synced_at, seq FROM peer_sync;
+        ''')
+        return cursor.fetchall()
+
+    @staticmethod
+    def search_peer_tweets(content: Optional[str],
+                           from_created: Optional[datetime],
+                           to_created: Optional[datetime],
+                           from_modified: Optional[datetime],
+                           to_modified: Optional[datetime],
+                           retweet: Optional[bool], cursor: pg8000.Cursor) -> Iterable[Tuple]:
+        """
+        Performs search on tweets mirrored from peer nodes. Parameters are
+        the same as for `search_tweets`.
+
+        :return: List of rows with peer address followed by tweet columns.
+        """
+        where_clause, params = _search_conditions(
+            content, from_created, to_created, from_modified, to_modified, retweet
+        )
+        cursor.execute(f'''
+            SELECT peer, {TWEET_COLUMN_ORDER}
+            FROM peer_tweets
+            {where_clause}
+            ORDER BY created_at DESC;
+        ''', params)
         return cursor.fetchall()
 
 
+def _insert_tags(tweets: List[TwResp], cursor: pg8000.Cursor):
+    """
+    Stores hashtags and mentions of newly created or modified tweets.
+    """
+    params = []
+    for t in tweets:
+        for kind, tag in extract_tags(t[1]):
+            params.extend((t[0], kind, tag, t[3]))
+    if not params:
+        return
+    values = ', '.join(['(%s, %s, %s, %s)'] * (len(params) // 4))
+    cursor.execute(f'''
+        INSERT INTO tweet_tags (tweet_id, kind, tag, created_at)
+        VALUES {values};
+    ''', tuple(params))
+
+
+def _search_conditions(content: Optional[str],
+                       from_created: Optional[datetime],
+                       to_created: Optional[datetime],
+                       from_modified: Optional[datetime],
+                       to_modified: Optional[datetime],
+                       retweet: Optional[bool]) -> Tuple[str, tuple]:
+    """
+    Builds WHERE clause and its parameters for tweet search.
+
+    Date parameters are explicitly cast to `timestamp`, same type as partition
+    key, so planner can prune partitions of tweets table.
+    """
+    where: List[str] = []
+    params: List[Union[str, datetime]] = []
+    if content is not None:
+        where.append('tweet ILIKE %s')
+        params.append(f'%{content}%')
+    if from_created is not None:
+        where.append('created_at > %s::timestamp')
+        params.append(from_created)
+    if to_created is not None:
+        where.append('created_at < %s::timestamp')
+        params.append(to_created)
+    if from_modified is not None:
+        where.append('modified_at > %s::timestamp')
+        params.append(from_modified)
+    if to_modified is not None:
+        where.append('modified_at < %s::timestamp')
+        params.append(to_modified)
+    if retweet is not None:
+        where.append('type=%s')
+        params.append('retweet')
+
+    where_clause = 'WHERE ' + ' AND '.join(where) if len(where) > 0 else ''
+    return where_clause, tuple(params)
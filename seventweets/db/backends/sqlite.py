@@ -0,0 +1,661 @@
+"""
+SQLite storage for :class `Operations`, for single node deployments that
+should not depend on Postgres.
+
+Database is opened in WAL journal mode, so readers do not block writer and
+multiple worker processes can share the same file. Every thread uses its own
+connection. Tweet content is indexed with FTS5 trigram tokenizer (SQLite
+3.34+), which matches substrings case insensitively, same as `ILIKE` search
+of pg backend, but without scanning the whole table.
+
+Schema is kept in this module and is created on first connection. Its version
+is stored in `PRAGMA user_version` and `MigrationManager` delegates to
+`Database.bootstrap` for this backend.
+
+Transactions are started as deferred, so readers never wait for writers.
+Writer that started from stale snapshot can not wait for lock and fails with
+"database is locked", so such transaction is rolled back and retried.
+"""
+import os
+import time
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Iterable, List, Tuple, Callable
+
+from flask import current_app
+
+from seventweets import db, events, deadline
+from seventweets.exception import DeadlineExceeded
+from seventweets.db import (
+    TwResp, _T, TWEET_COLUMN_ORDER, NewTweet, ChangeResp, Columns, make_reference, select_columns,
+    extract_tags, SubscriptionResp
+)
+
+logger = logging.getLogger(__name__)
+DbCallback = Callable[[sqlite3.Cursor], _T]
+
+
+def _insert_tags(tweets: Iterable[tuple], cursor: sqlite3.Cursor):
+    """
+    Stores hashtags and mentions of tweets given as (id, tweet, created_at)
+    tuples, with creation time already formatted.
+    """
+    cursor.executemany('''
+        INSERT INTO tweet_tags (tweet_id, kind, tag, created_at)
+        VALUES (?, ?, ?, ?);
+    ''', [(id_, kind, tag, created_at)
+          for id_, content, created_at in tweets for kind, tag in extract_tags(content)])
+
+
+def _backfill_tags(cursor: sqlite3.Cursor):
+    cursor.execute('SELECT id, tweet, created_at FROM tweets WHERE tweet IS NOT NULL;')
+    _insert_tags(cursor.fetchall(), cursor)
+
+
+# number of virtual machine instructions between deadline checks of statement
+PROGRESS_STEPS = 10000
+
+# (version, name, statements) of schema steps, applied in order, statement
+# can also be function which is called with cursor
+SCHEMA = [
+    (1, 'tweets', [
+        '''
+        CREATE TABLE tweets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tweet TEXT,
+            type TEXT NOT NULL DEFAULT 'original' CHECK(type IN ('original', 'retweet')),
+            created_at TIMESTAMP NOT NULL,
+            modified_at TIMESTAMP NOT NULL,
+            reference TEXT
+        );
+        ''',
+        'CREATE INDEX tweets_created_at ON tweets (created_at);',
+        'CREATE INDEX tweets_modified_at ON tweets (modified_at);',
+        '''
+        CREATE VIRTUAL TABLE tweets_fts USING fts5(
+            tweet, content='tweets', content_rowid='id', tokenize='trigram'
+        );
+        ''',
+        '''
+        CREATE TRIGGER tweets_fts_insert AFTER INSERT ON tweets BEGIN
+            INSERT INTO tweets_fts (rowid, tweet) VALUES (NEW.id, NEW.tweet);
+        END;
+        ''',
+        '''
+        CREATE TRIGGER tweets_fts_delete AFTER DELETE ON tweets BEGIN
+            INSERT INTO tweets_fts (tweets_fts, rowid, tweet) VALUES ('delete', OLD.id, OLD.tweet);
+        END;
+        ''',
+        '''
+        CREATE TRIGGER tweets_fts_update AFTER UPDATE OF tweet ON tweets BEGIN
+            INSERT INTO tweets_fts (tweets_fts, rowid, tweet) VALUES ('delete', OLD.id, OLD.tweet);
+            INSERT INTO tweets_fts (rowid, tweet) VALUES (NEW.id, NEW.tweet);
+        END;
+        ''',
+    ]),
+    (2, 'change log', [
+        '''
+        CREATE TABLE tweet_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tweet_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK(op IN ('create', 'modify', 'delete')),
+            changed_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        );
+        ''',
+        '''
+        CREATE TRIGGER tweets_change_insert AFTER INSERT ON tweets BEGIN
+            INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'create');
+        END;
+        ''',
+        '''
+        CREATE TRIGGER tweets_change_update AFTER UPDATE ON tweets BEGIN
+            INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'modify');
+        END;
+        ''',
+        '''
+        CREATE TRIGGER tweets_change_delete AFTER DELETE ON tweets BEGIN
+            INSERT INTO tweet_changes (tweet_id, op) VALUES (OLD.id, 'delete');
+        END;
+        ''',
+    ]),
+    (3, 'peer mirror', [
+        '''
+        CREATE TABLE peer_tweets (
+            peer TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            tweet TEXT,
+            type TEXT,
+            created_at TIMESTAMP,
+            modified_at TIMESTAMP,
+            reference TEXT,
+            PRIMARY KEY (peer, id)
+        );
+        ''',
+        'CREATE INDEX peer_tweets_created_at ON peer_tweets (created_at);',
+        '''
+        CREATE TABLE peer_sync (
+            peer TEXT PRIMARY KEY,
+            watermark TIMESTAMP,
+            synced_at TIMESTAMP NOT NULL
+        );
+        ''',
+    ]),
+    (4, 'tweet tags', [
+        '''
+        CREATE TABLE tweet_tags (
+            tweet_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK(kind IN ('hashtag', 'mention')),
+            tag TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (tweet_id, kind, tag)
+        ) WITHOUT ROWID;
+        ''',
+        'CREATE INDEX tweet_tags_tag ON tweet_tags (kind, tag, created_at);',
+        'CREATE INDEX tweet_tags_created_at ON tweet_tags (kind, created_at);',
+        _backfill_tags,
+    ]),
+    (5, 'subscriptions', [
+        '''
+        CREATE TABLE subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            callback TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP NOT NULL
+        );
+        ''',
+    ]),
+    (6, 'peer sync seq', [
+        'ALTER TABLE peer_sync ADD COLUMN seq INTEGER;',
+    ]),
+]
+
+
+def _ts(dt: Optional[datetime]) -> Optional[str]:
+    """
+    Formats datetime as text which sorts in the same order as datetimes.
+    """
+    return dt.isoformat(' ', timespec='microseconds') if dt is not None else None
+
+
+def _dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _tweet_row(row: Optional[tuple]) -> Optional[TwResp]:
+    if row is None:
+        return None
+    return row[:3] + (_dt(row[3]), _dt(row[4])) + row[5:]
+
+
+def _projected_row(row: tuple, columns: Columns) -> tuple:
+    if columns is None:
+        return _tweet_row(row)
+    return tuple(_dt(v) if c in ('created_at', 'modified_at') else v for c, v in zip(columns, row))
+
+
+class Database:
+    """
+    SQLite database shared by all threads of the process, with connection
+    per thread.
+
+    Like `pg.Database`, it executes operations with cursor and commits or
+    rolls back when appropriate.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __new__(cls):
+        path = current_app.config['ST_SQLITE_PATH']
+        with cls._instances_lock:
+            instance = cls._instances.get(path)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance.path = path
+                instance.timeout = float(current_app.config['ST_SQLITE_BUSY_TIMEOUT'])
+                instance.synchronous = current_app.config['ST_SQLITE_SYNCHRONOUS']
+                instance._local = threading.local()
+                instance.bootstrap()
+                cls._instances[path] = instance
+            return instance
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # transactions are managed explicitly in `do`
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute(f'PRAGMA synchronous={self.synchronous};')
+            self._local.connection = connection
+        return connection
+
+    def test_connection(self):
+        try:
+            self.do(lambda cur: cur.execute('SELECT 1'))
+        except Exception:
+            logger.critical('Unable to execute query on database.')
+            raise
+
+    def close(self):
+        """
+        Closes connection of current thread.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def do(self, fn: DbCallback, begin: str='BEGIN') -> _T:
+        """
+        Executes provided fn in transaction and gives it cursor to work with.
+
+        :param fn: Function to execute. It has to accept one argument, cursor
+            that it will use to communicate with database.
+        :param begin: Statement starting transaction.
+        :return: Whatever `fn` returns
+        :raises DeadlineExceeded: If deadline of request passes, statements
+            running at that time are interrupted.
+        """
+        left = deadline.check()
+        now = time.monotonic()
+        busy_until = now + (self.timeout if left is None else min(self.timeout, left))
+        connection = self.connection
+        if left is not None:
+            end = now + left
+            connection.set_progress_handler(lambda: time.monotonic() > end, PROGRESS_STEPS)
+        delay = 0.001
+        try:
+            while True:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(begin)
+                    res = fn(cursor)
+                    cursor.execute('COMMIT')
+                    return res
+                except sqlite3.OperationalError as e:
+                    if connection.in_transaction:
+                        cursor.execute('ROLLBACK')
+                    if left is not None and 'interrupted' in str(e):
+                        raise DeadlineExceeded('Request deadline exceeded while querying database.') from e
+                    if 'locked' not in str(e) or time.monotonic() + delay > busy_until:
+                        raise
+                except Exception:
+                    if connection.in_transaction:
+                        cursor.execute('ROLLBACK')
+                    raise
+                finally:
+                    cursor.close()
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+        finally:
+            if left is not None:
+                connection.set_progress_handler(None, 0)
+
+    def schema_version(self) -> int:
+        return self.connection.execute('PRAGMA user_version;').fetchone()[0]
+
+    def bootstrap(self) -> List[Tuple[int, str, float]]:
+        """
+        Applies schema steps newer than version stored in database, all in
+        single transaction which holds write lock, so processes starting at
+        the same time do not apply them twice.
+
+        :return: List of applied steps as (version, name, duration in seconds) tuples.
+        """
+        def apply(cursor):
+            applied = []
+            version = cursor.execute('PRAGMA user_version;').fetchone()[0]
+            for step_version, name, statements in SCHEMA:
+                if step_version <= version:
+                    continue
+                logger.info('Applying SQLite schema step %s (%s).', step_version, name)
+                start = time.perf_counter()
+                for statement in statements:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version={step_version};')
+                applied.append((step_version, name, time.perf_counter() - start))
+            return applied
+
+        # journal mode is persistent, setting it on every connection would
+        # take exclusive lock while other threads are writing
+        self.connection.execute('PRAGMA journal_mode=WAL;')
+        if self.schema_version() >= SCHEMA[-1][0]:
+            return []
+        return self.do(apply, begin='BEGIN IMMEDIATE')
+
+
+class Listener:
+    """
+    SQLite has no notifications, so listener polls change log for changes
+    made by other processes. Changes made in this process wake it up
+    immediately.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.seen_version = events.changes.version
+        self.last_seq = Database().do(Operations.last_change_seq)
+
+    def wait(self, timeout: float) -> bool:
+        changed = events.changes.wait(self.seen_version, timeout)
+        self.seen_version = events.changes.version
+        seq = Database().do(Operations.last_change_seq)
+        changed = changed or seq != self.last_seq
+        self.last_seq = seq
+        return changed
+
+    def close(self):
+        Database().close()
+
+
+class Operations(db.Operations):
+
+    @staticmethod
+    def get_all_tweets(columns: Columns, cursor: sqlite3.Cursor) -> Iterable[TwResp]:
+        cursor.execute(f'''
+            SELECT {select_columns(columns)}
+            FROM tweets
+            ORDER BY created_at DESC;
+        ''')
+        return [_projected_row(row, columns) for row in cursor.fetchall()]
+
+    @staticmethod
+    def get_tweet(id_: int, cursor: sqlite3.Cursor) -> TwResp:
+        cursor.execute(f'''
+            SELECT {TWEET_COLUMN_ORDER}
+            FROM tweets
+            WHERE id=?;
+        ''', (id_,))
+        return _tweet_row(cursor.fetchone())
+
+    @staticmethod
+    def insert_tweet(tweet: str, cursor: sqlite3.Cursor) -> TwResp:
+        return Operations.insert_tweets([(tweet, 'original', None)], cursor)[0]
+
+    @staticmethod
+    def insert_tweets(tweets: List[NewTweet], cursor: sqlite3.Cursor) -> List[TwResp]:
+        """
+        Inserts multiple tweets in single transaction. All of them have
+        the same creation time.
+
+        :param tweets: List of (tweet, type, reference) tuples to insert.
+        :param cursor: Database cursor.
+        :return: Created tweets, in the same order as provided.
+        """
+        now = datetime.utcnow()
+        created = []
+        for content, type_, reference in tweets:
+            cursor.execute('''
+                INSERT INTO tweets (tweet, type, created_at, modified_at, reference)
+                VALUES (?, ?, ?, ?, ?);
+            ''', (content, type_, _ts(now), _ts(now), reference))
+            created.append((cursor.lastrowid, content, type_, now, now, reference))
+        _insert_tags([(t[0], t[1], _ts(now)) for t in created], cursor)
+        return created
+
+    @staticmethod
+    def import_tweets(tweets: List[TwResp], keep_ids: bool, cursor: sqlite3.Cursor) -> int:
+        """
+        Inserts tweets keeping their times, type and reference. SQLite picks
+        IDs after the highest one, so kept IDs need no further care.
+
+        :param tweets: Tweets as tuples of columns in `TWEET_COLUMN_ORDER`.
+        :param keep_ids: If IDs of tweets should be kept.
+        :param cursor: Database cursor.
+        :return: Number of inserted tweets.
+        """
+        tagged = []
+        for id_, content, type_, created_at, modified_at, reference in tweets:
+            cursor.execute(f'''
+                INSERT INTO tweets ({TWEET_COLUMN_ORDER})
+                VALUES (?, ?, ?, ?, ?, ?);
+            ''', (id_ if keep_ids else None, content, type_, _ts(created_at), _ts(modified_at), reference))
+            tagged.append((cursor.lastrowid, content, _ts(created_at)))
+        _insert_tags(tagged, cursor)
+        return len(tweets)
+
+    @staticmethod
+    def get_tweets_page(after_id: int, limit: int, cursor: sqlite3.Cursor) -> List[TwResp]:
+        cursor.execute(f'''
+            SELECT {TWEET_COLUMN_ORDER}
+            FROM tweets
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?;
+        ''', (after_id, limit))
+        return [_tweet_row(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def modify_tweet(id_: int, new_content: str, cursor: sqlite3.Cursor) -> TwResp:
+        cursor.execute('''
+            UPDATE tweets SET tweet=?, modified_at=?
+            WHERE id=?;
+        ''', (new_content, _ts(datetime.utcnow()), id_))
+        if cursor.rowcount == 0:
+            return None
+        tweet = Operations.get_tweet(id_, cursor)
+        cursor.execute('DELETE FROM tweet_tags WHERE tweet_id=?;', (id_,))
+        _insert_tags([(tweet[0], tweet[1], _ts(tweet[3]))], cursor)
+        return tweet
+
+    @staticmethod
+    def delete_tweet(id_: int, cursor: sqlite3.Cursor) -> bool:
+        cursor.execute('DELETE FROM tweets WHERE id=?;', (id_,))
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute('DELETE FROM tweet_tags WHERE tweet_id=?;', (id_,))
+        return True
+
+    @staticmethod
+    def count_tweets(type_: str, cursor: sqlite3.Cursor) -> int:
+        if type_:
+            cursor.execute('SELECT count(*) FROM tweets WHERE type=?;', (type_,))
+        else:
+            cursor.execute('SELECT count(*) FROM tweets;')
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def create_retweet(server: str, ref: str, cursor: sqlite3.Cursor) -> TwResp:
+        return Operations.insert_tweets(
+            [(None, 'retweet', make_reference(server, ref))], cursor
+        )[0]
+
+    @staticmethod
+    def get_changes(since: int, limit: int, cursor: sqlite3.Cursor) -> List[ChangeResp]:
+        tweet_columns = ', '.join(f't.{c.strip()}' for c in TWEET_COLUMN_ORDER.split(','))
+        cursor.execute(f'''
+            SELECT c.seq, c.op, c.changed_at, c.tweet_id, {tweet_columns}
+            FROM tweet_changes c
+            LEFT JOIN tweets t ON t.id = c.tweet_id AND c.op <> 'delete'
+            WHERE c.seq > ?
+            ORDER BY c.seq
+            LIMIT ?;
+        ''', (since, limit))
+        return [row[:2] + (_dt(row[2]), row[3]) + (_tweet_row(row[4:]) if row[4] is not None else row[4:])
+                for row in cursor.fetchall()]
+
+    @staticmethod
+    def last_change_seq(cursor: sqlite3.Cursor) -> int:
+        cursor.execute('SELECT COALESCE(max(seq), 0) FROM tweet_changes;')
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def search_tweets(content: Optional[str],
+                      from_created: Optional[datetime],
+                      to_created: Optional[datetime],
+                      from_modified: Optional[datetime],
+                      to_modified: Optional[datetime],
+                      retweet: Optional[bool], columns: Columns,
+                      cursor: sqlite3.Cursor) -> Iterable[TwResp]:
+        """
+        Searches tweets, content is looked up in full text index.
+        """
+        where_clause, params = _search_conditions(
+            content, from_created, to_created, from_modified, to_modified, retweet,
+            fts_table='tweets_fts'
+        )
+        cursor.execute(f'''
+            SELECT {select_columns(columns)}
+            FROM tweets
+            {where_clause}
+            ORDER BY created_at DESC;
+        ''', params)
+        return [_projected_row(row, columns) for row in cursor.fetchall()]
+
+    @staticmethod
+    def get_tagged_tweets(kind: str, tag: str, limit: int, cursor: sqlite3.Cursor) -> List[TwResp]:
+        tweet_columns = ', '.join(f't.{c.strip()}' for c in TWEET_COLUMN_ORDER.split(','))
+        cursor.execute(f'''
+            SELECT {tweet_columns}
+            FROM tweet_tags g
+            JOIN tweets t ON t.id = g.tweet_id
+            WHERE g.kind=? AND g.tag=?
+            ORDER BY g.created_at DESC
+            LIMIT ?;
+        ''', (kind, tag, limit))
+        return [_tweet_row(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def count_tags(kind: str, window: int, limit: int, cursor: sqlite3.Cursor) -> List[Tuple[str, int]]:
+        cursor.execute('''
+            SELECT tag, count(*) AS used
+            FROM tweet_tags
+            WHERE kind=? AND created_at > ?
+            GROUP BY tag
+            ORDER BY used DESC, tag
+            LIMIT ?;
+        ''', (kind, _ts(datetime.utcnow() - timedelta(seconds=window)), limit))
+        return cursor.fetchall()
+
+    @staticmethod
+    def ensure_partitions(months_ahead: int, cursor: sqlite3.Cursor) -> int:
+        return 0
+
+    @staticmethod
+    def compact(cursor: sqlite3.Cursor) -> bool:
+        # freed pages are reused by SQLite
+        return False
+
+    @staticmethod
+    def add_subscription(callback: str, cursor: sqlite3.Cursor) -> SubscriptionResp:
+        cursor.execute('''
+            INSERT INTO subscriptions (callback, created_at) VALUES (?, ?)
+            ON CONFLICT (callback) DO NOTHING;
+        ''', (callback, _ts(datetime.utcnow())))
+        cursor.execute('SELECT id, callback, created_at FROM subscriptions WHERE callback=?;', (callback,))
+        id_, callback, created_at = cursor.fetchone()
+        return id_, callback, _dt(created_at)
+
+    @staticmethod
+    def get_subscriptions(cursor: sqlite3.Cursor) -> List[SubscriptionResp]:
+        cursor.execute('SELECT id, callback, created_at FROM subscriptions ORDER BY id;')
+        return [(id_, callback, _dt(created_at)) for id_, callback, created_at in cursor.fetchall()]
+
+    @staticmethod
+    def delete_subscription(id_: int, cursor: sqlite3.Cursor) -> bool:
+        cursor.execute('DELETE FROM subscriptions WHERE id=?;', (id_,))
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def upsert_peer_tweets(peer: str, tweets: List[TwResp], synced_at: datetime,
+                           cursor: sqlite3.Cursor):
+        cursor.executemany(f'''
+            INSERT INTO peer_tweets (peer, {TWEET_COLUMN_ORDER})
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (peer, id) DO UPDATE SET
+                tweet=excluded.tweet,
+                type=excluded.type,
+                created_at=excluded.created_at,
+                modified_at=excluded.modified_at,
+                reference=excluded.reference;
+        ''', [(peer, t[0], t[1], t[2], _ts(t[3]), _ts(t[4]), t[5]) for t in tweets])
+
+        watermark = max((t[4] for t in tweets), default=None)
+        cursor.execute('''
+            INSERT INTO peer_sync (peer, watermark, synced_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (peer) DO UPDATE SET
+                watermark=max(COALESCE(peer_sync.watermark, excluded.watermark),
+                              COALESCE(excluded.watermark, peer_sync.watermark)),
+                synced_at=excluded.synced_at;
+        ''', (peer, _ts(watermark), _ts(synced_at)))
+
+    @staticmethod
+    def apply_peer_changes(peer: str, tweets: List[TwResp], deleted: List[int], seq: int,
+                           synced_at: datetime, cursor: sqlite3.Cursor):
+        Operations.upsert_peer_tweets(peer, tweets, synced_at, cursor)
+        cursor.executemany('DELETE FROM peer_tweets WHERE peer=? AND id=?;',
+                           [(peer, id_) for id_ in deleted])
+        cursor.execute('UPDATE peer_sync SET seq=? WHERE peer=?;', (seq, peer))
+
+    @staticmethod
+    def get_peer_sync(cursor: sqlite3.Cursor) -> List[Tuple[str, Optional[datetime], datetime, Optional[int]]]:
+        cursor.execute('SELECT peer, watermark, synced_at, seq FROM peer_sync;')
+        return [(peer, _dt(watermark), _dt(synced_at), seq)
+                for peer, watermark, synced_at, seq in cursor.fetchall()]
+
+    @staticmethod
+    def search_peer_tweets(content: Optional[str],
+                           from_created: Optional[datetime],
+                           to_created: Optional[datetime],
+                           from_modified: Optional[datetime],
+                           to_modified: Optional[datetime],
+                           retweet: Optional[bool], cursor: sqlite3.Cursor) -> Iterable[Tuple]:
+        where_clause, params = _search_conditions(
+            content, from_created, to_created, from_modified, to_modified, retweet
+        )
+        cursor.execute(f'''
+            SELECT peer, {TWEET_COLUMN_ORDER}
+            FROM peer_tweets
+            {where_clause}
+            ORDER BY created_at DESC;
+        ''', params)
+        return [row[:1] + _tweet_row(row[1:]) for row in cursor.fetchall()]
+
+
+def _search_conditions(content: Optional[str],
+                       from_created: Optional[datetime],
+                       to_created: Optional[datetime],
+                       from_modified: Optional[datetime],
+                       to_modified: Optional[datetime],
+                       retweet: Optional[bool],
+                       fts_table: Optional[str]=None) -> Tuple[str, tuple]:
+    """
+    Builds WHERE clause and its parameters for tweet search.
+
+    If `fts_table` is provided, content is matched with full text index.
+    Trigram index can not match content shorter than three characters, so
+    `LIKE` is used for it.
+    """
+    where: List[str] = []
+    params: List[str] = []
+    if content is not None:
+        if fts_table is not None and len(content) >= 3:
+            where.append(f'id IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ?)')
+            params.append('"' + content.replace('"', '""') + '"')
+        else:
+            where.append('tweet LIKE ?')
+            params.append(f'%{content}%')
+    if from_created is not None:
+        where.append('created_at > ?')
+        params.append(_ts(from_created))
+    if to_created is not None:
+        where.append('created_at < ?')
+        params.append(_ts(to_created))
+    if from_modified is not None:
+        where.append('modified_at > ?')
+        params.append(_ts(from_modified))
+    if to_modified is not None:
+        where.append('modified_at < ?')
+        params.append(_ts(to_modified))
+    if retweet is not None:
+        where.append('type=?')
+        params.append('retweet')
+
+    where_clause = 'WHERE ' + ' AND '.join(where) if len(where) > 0 else ''
+    return where_clause, tuple(params)
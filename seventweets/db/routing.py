@@ -0,0 +1,217 @@
+"""
+Routing of read only operations to database replicas.
+
+Replicas are configured with `ST_DB_REPLICAS`, comma separated list of
+`[user[:password]@]host[:port][/database]` entries, missing parts are taken
+from primary configuration. Replica is chosen round-robin or by the lowest
+observed latency (`ST_DB_REPLICA_STRATEGY`). Replica that can not be
+connected to is skipped for `ST_DB_REPLICA_RETRY` seconds and reads go to
+primary if no replica is available.
+
+Replicas lag behind primary, so client that just wrote something reads from
+primary for `ST_DB_STICKY_SECONDS` seconds. Client is recognized by cookie,
+which works across worker processes, and by client key (valid API token or
+address) remembered by worker, for clients that do not keep cookies.
+"""
+import time
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict
+from urllib.parse import urlsplit, unquote
+
+from flask import current_app, request, g, has_request_context
+
+from seventweets.admission import client_key
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'st_primary_until'
+ROUND_ROBIN = 'round_robin'
+LEAST_LATENCY = 'least_latency'
+
+# weight of the latest observation in moving average of replica latency
+LATENCY_ALPHA = 0.2
+# max number of recent writers remembered by worker
+MAX_WRITERS = 10000
+
+
+class Replica:
+    """
+    Connection parameters and health of single replica.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str, database: str):
+        self.params = dict(host=host, port=port, user=user, password=password, database=database)
+        self.latency = None
+        self.down_until = 0
+
+    @property
+    def name(self) -> str:
+        return f'{self.params["host"]}:{self.params["port"]}'
+
+    def observe(self, seconds: float):
+        """
+        Records duration of operation executed on replica.
+        """
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_ALPHA * (seconds - self.latency)
+
+
+class ReadRouter:
+    """
+    Chooses replica for read and keeps track of clients that recently wrote.
+    """
+
+    def __init__(self, replicas: List[Replica], strategy: str, sticky_seconds: float,
+                 retry_after: float):
+        """
+        :param replicas: Replicas to route reads to.
+        :param strategy: Either `ROUND_ROBIN` or `LEAST_LATENCY`.
+        :param sticky_seconds: How long client reads from primary after write.
+        :param retry_after: How long replica is skipped after it failed.
+        """
+        if strategy not in (ROUND_ROBIN, LEAST_LATENCY):
+            raise ValueError(f'Invalid replica strategy: {strategy}.')
+        self.replicas = replicas
+        self.strategy = strategy
+        self.sticky_seconds = sticky_seconds
+        self.retry_after = retry_after
+        self._counter = itertools.count()
+        self._writers: Dict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def choose(self) -> Optional[Replica]:
+        """
+        Returns replica to read from, None if all replicas are down.
+        """
+        now = time.monotonic()
+        available = [r for r in self.replicas if r.down_until <= now]
+        if not available:
+            return None
+        if self.strategy == LEAST_LATENCY:
+            # replicas without observations are tried first
+            return min(available, key=lambda r: -1 if r.latency is None else r.latency)
+        return available[next(self._counter) % len(available)]
+
+    def mark_down(self, replica: Replica):
+        logger.warning('Replica %s is not available, skipping it for %ss.',
+                       replica.name, self.retry_after)
+        replica.down_until = time.monotonic() + self.retry_after
+
+    def mark_write(self, client: str) -> float:
+        """
+        Remembers that client wrote.
+
+        :return: Unix time until which client should read from primary.
+        """
+        until = time.time() + self.sticky_seconds
+        with self._lock:
+            self._writers.pop(client, None)
+            self._writers[client] = until
+            if len(self._writers) > MAX_WRITERS:
+                self._writers.popitem(last=False)
+        return until
+
+    def is_sticky(self, client: str, cookie: Optional[str]) -> bool:
+        """
+        Checks if client wrote recently and has to read from primary.
+        """
+        now = time.time()
+        try:
+            if cookie is not None and float(cookie) > now:
+                return True
+        except ValueError:
+            pass
+        with self._lock:
+            return self._writers.get(client, 0) > now
+
+
+def parse_replicas(value: str, config) -> List[Replica]:
+    """
+    Parses `ST_DB_REPLICAS` value, using primary configuration for parts
+    missing in entries.
+    """
+    replicas = []
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        url = urlsplit(entry if '://' in entry else f'//{entry}')
+        replicas.append(Replica(
+            host=url.hostname,
+            port=url.port or int(config['ST_DB_PORT']),
+            user=unquote(url.username) if url.username else config['ST_DB_USER'],
+            password=unquote(url.password) if url.password else config['ST_DB_PASS'],
+            database=url.path.lstrip('/') or config['ST_DB_NAME'],
+        ))
+    return replicas
+
+
+def create_router(config) -> Optional[ReadRouter]:
+    """
+    Creates router from application config, None if there are no replicas.
+    """
+    replicas = parse_replicas(config['ST_DB_REPLICAS'], config)
+    if not replicas:
+        return None
+    return ReadRouter(
+        replicas,
+        strategy=config['ST_DB_REPLICA_STRATEGY'],
+        sticky_seconds=float(config['ST_DB_STICKY_SECONDS']),
+        retry_after=float(config['ST_DB_REPLICA_RETRY']),
+    )
+
+
+def mark_write():
+    """
+    Marks client of current request as recent writer, so its following reads
+    are served by primary.
+    """
+    router = current_app.extensions.get('read_router')
+    if router is None or not has_request_context():
+        return
+    g.primary_until = router.mark_write(client_key())
+
+
+def reads_primary() -> bool:
+    """
+    Checks if read only operations of current request are served by primary,
+    because there are no replicas or client wrote recently. Reads that may
+    go to replica can return data older than writes of this process, so
+    they must not be cached.
+    """
+    router = current_app.extensions.get('read_router')
+    if router is None:
+        return True
+    return has_request_context() and router.is_sticky(client_key(), request.cookies.get(STICKY_COOKIE))
+
+
+def choose_replica() -> Optional[Replica]:
+    """
+    Returns replica which read only operation of current request should use,
+    None if it has to use primary.
+    """
+    if reads_primary():
+        return None
+    return current_app.extensions['read_router'].choose()
+
+
+def replica_failed(replica: Replica):
+    current_app.extensions['read_router'].mark_down(replica)
+
+
+def set_sticky_cookie(response):
+    """
+    Sets cookie making following reads of client go to primary, if client
+    wrote in current request.
+    """
+    until = g.get('primary_until')
+    if until is not None:
+        router = current_app.extensions['read_router']
+        response.set_cookie(STICKY_COOKIE, f'{until:.3f}', max_age=int(router.sticky_seconds) + 1,
+                            httponly=True)
+    return response
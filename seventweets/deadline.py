@@ -0,0 +1,104 @@
+"""
+Deadlines of requests.
+
+Every request admitted by `admission.admit` gets deadline, after which its
+client is not expected to wait for response anymore. Deadline is
+`ST_DEADLINE_<ENDPOINT>` seconds, by endpoint class of `admit`, and client can
+set it with `X-Request-Timeout` header (seconds), up to `ST_DEADLINE_MAX`.
+
+Remaining time is propagated to work done for request, so it is abandoned
+when deadline passes instead of holding database connection and worker:
+Postgres statements get `statement_timeout`, SQLite statements are
+interrupted, requests to other nodes are sent with timeout capped by it and
+with remaining time in `X-Request-Timeout` header. Exceeded deadline is
+raised as `DeadlineExceeded` and sent as 504 response.
+
+Work done outside of request (background jobs, CLI commands) has no deadline,
+neither has work shared by several requests (see `seventweets.coalesce`), each
+of which waits for it only until its own deadline.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from flask import g, request, current_app, has_app_context
+
+from seventweets.exception import BadRequest, DeadlineExceeded
+
+HEADER = 'X-Request-Timeout'
+
+
+def start(endpoint: str):
+    """
+    Sets deadline of current request.
+
+    :param endpoint: Name of endpoint class, used to look up `ST_DEADLINE_<ENDPOINT>`.
+    :raises BadRequest: If `X-Request-Timeout` header is not positive number.
+    """
+    seconds = float(current_app.config.get(f'ST_DEADLINE_{endpoint.upper()}') or 0)
+    header = request.headers.get(HEADER)
+    if header is not None:
+        try:
+            seconds = float(header)
+        except ValueError:
+            seconds = 0
+        if not seconds > 0:
+            raise BadRequest(f'Invalid {HEADER} header: {header}, expected positive number of seconds.')
+        seconds = min(seconds, float(current_app.config['ST_DEADLINE_MAX']))
+    g.deadline = time.monotonic() + seconds if seconds > 0 else None
+
+
+def remaining() -> Optional[float]:
+    """
+    Returns seconds left until deadline of current request, None if there
+    is no deadline.
+    """
+    if not has_app_context():
+        return None
+    deadline = g.get('deadline')
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check() -> Optional[float]:
+    """
+    Returns seconds left until deadline of current request, None if there
+    is no deadline.
+
+    :raises DeadlineExceeded: If deadline has passed.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('Request deadline exceeded.')
+    return left
+
+
+@contextmanager
+def detached():
+    """
+    Runs block without deadline of current request. Used for work done on
+    behalf of other requests as well, which must not be cut short by the
+    deadline of request that happens to run it.
+    """
+    if not has_app_context():
+        yield
+        return
+    saved = g.get('deadline')
+    g.deadline = None
+    try:
+        yield
+    finally:
+        g.deadline = saved
+
+
+def wait(event: threading.Event):
+    """
+    Waits for event, but not after deadline of current request.
+
+    :raises DeadlineExceeded: If deadline passes before event is set.
+    """
+    left = remaining()
+    if not event.wait(None if left is None else max(0.0, left)):
+        raise DeadlineExceeded('Request deadline exceeded.')
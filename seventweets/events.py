@@ -0,0 +1,41 @@
+"""
+In-process notification about changes of tweets.
+
+Writes done through `seventweets.tweet` notify waiters in the same process
+immediately, so long-polling requests are woken up without querying
+database in a loop.
+"""
+import threading
+
+
+class ChangeNotifier:
+    """
+    Counter of changes guarded by condition variable. Waiters remember value
+    of counter they have seen and wait until it changes.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        """
+        Records that something has changed and wakes up all waiters.
+        """
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+
+    def wait(self, seen_version: int, timeout: float) -> bool:
+        """
+        Waits until version is different from `seen_version` or timeout expires.
+
+        :param seen_version: Version caller has already seen.
+        :param timeout: Max time to wait in seconds.
+        :return: True if change happened, False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version != seen_version, timeout)
+
+
+changes = ChangeNotifier()
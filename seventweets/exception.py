@@ -1,5 +1,7 @@
 import abc
+import math
 import logging
+import requests
 from flask import jsonify
 from functools import wraps
 
@@ -17,10 +19,62 @@ class BadRequest(HttpException):
     CODE = 400
 
 
+class Unauthorized(HttpException):
+    CODE = 401
+
+
 class NotFound(HttpException):
     CODE = 404
 
 
+class Conflict(HttpException):
+    CODE = 409
+
+
+class RetryLater(HttpException):
+    """
+    Base for errors telling client to retry request after `retry_after` seconds.
+    """
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TooManyRequests(RetryLater):
+    CODE = 429
+
+
+class ServiceUnavailable(RetryLater):
+    CODE = 503
+
+
+class DeadlineExceeded(HttpException):
+    """
+    Deadline of request passed before it was handled, see `seventweets.deadline`.
+    """
+    CODE = 504
+
+
+class CircuitOpen(requests.ConnectionError):
+    """
+    Request to other node was not sent, because its circuit breaker is open
+    (see `seventweets.client`), for `retry_after` more seconds.
+    """
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _error_response(message, code, retry_after=None):
+    response = jsonify({
+        'message': message,
+        'code': code
+    })
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response, code
+
+
 def error_handler(f):
     """
     Handlers exceptions caught in http layer (server.py)
@@ -32,17 +86,17 @@ def error_handler(f):
         try:
             return f(*args, **kwargs)
         except HttpException as e:
-            body = {
-                'message': str(e),
-                'code': e.CODE
-            }
-            logger.warning(body['message'])
-            return jsonify(body), e.CODE
+            logger.warning(str(e))
+            return _error_response(str(e), e.CODE, e.retry_after if isinstance(e, RetryLater) else None)
+        except CircuitOpen as e:
+            # other node is failing, client should not retry before it may be back
+            logger.warning(str(e))
+            return _error_response(str(e), ServiceUnavailable.CODE, e.retry_after)
+        except (TimeoutError, requests.Timeout) as e:
+            # timeouts of sockets and of requests to other nodes not covered by request deadline
+            logger.warning(f'Timed out: {e}')
+            return _error_response(f'Timed out: {e}', DeadlineExceeded.CODE)
         except Exception as e:
-            body = {
-                'message': str(e),
-                'code': 500
-            }
-            logger.exception(body['message'])
-            return jsonify(body), 500
+            logger.exception(str(e))
+            return _error_response(str(e), 500)
     return wrapper
@@ -0,0 +1,137 @@
+import os
+import logging
+from functools import wraps
+from flask import Blueprint, Response, request, current_app
+from seventweets import profiling
+from seventweets.admission import has_valid_token
+from seventweets.exception import error_handler, Unauthorized, BadRequest
+from seventweets.wire import respond
+from seventweets.utils import serves_concurrently
+from seventweets.handlers.utils import ensure_bool, ensure_int
+
+admin = Blueprint('admin', __name__)
+logger = logging.getLogger(__name__)
+
+# max seconds profile request waits for session to finish
+MAX_WAIT = 300
+
+
+def require_token(f):
+    """
+    Allows only requests providing `ST_API_TOKEN`. It has to be applied under
+    `error_handler`, so rejections are turned into responses.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not has_valid_token():
+            raise Unauthorized('Valid API token is required.')
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def _profiler() -> profiling.Profiler:
+    return current_app.extensions['profiler']
+
+
+@admin.route('/profile', methods=['POST'])
+@error_handler
+@require_token
+def start_profile():
+    """
+    Starts profiling of the next `requests` requests or of requests in the
+    next `seconds` seconds handled by this worker. If `wait` is true, response
+    is sent when profiling is finished. Sync worker would not handle any
+    request while waiting, so it responds right away with 202.
+    """
+    max_requests = ensure_int(request.args.get('requests', None) or None, default=0, min_value=0)
+    seconds = ensure_int(request.args.get('seconds', None) or None, default=0, min_value=0,
+                         max_value=MAX_WAIT)
+    session = _profiler().start(max_requests, seconds)
+    wait = ensure_bool(request.args.get('wait', None) or None)
+    if wait and serves_concurrently(current_app.config):
+        session = _profiler().wait(seconds or MAX_WAIT)
+    state = session.state()
+    state['note'] = (f'Session profiles only requests handled by worker {state["pid"]}, '
+                     f'other workers of node are not profiled.')
+    return respond(state, 200 if session.finished.is_set() else 202)
+
+
+@admin.route('/profile', methods=['GET'])
+@error_handler
+@require_token
+def get_profile():
+    """
+    Returns profile of the latest session as plain text, either pstats table
+    (`format=pstats`, sorted by `sort` and limited to `limit` functions) or
+    sampled stacks in collapsed format (`format=collapsed`).
+    """
+    fmt = request.args.get('format', None) or 'pstats'
+    if fmt not in ('pstats', 'collapsed'):
+        raise BadRequest(f'Invalid format: {fmt}, expected pstats or collapsed.')
+    sort = request.args.get('sort', None) or 'cumulative'
+    limit = ensure_int(request.args.get('limit', None) or None, default=50, min_value=1)
+    profiler = _profiler()
+    report = profiler.report(fmt, sort, limit)
+    state = profiler.current().state()
+    return Response(report, mimetype='text/plain', headers={
+        'X-Profile-State': state['state'],
+        'X-Profile-Requests': str(state['requests']),
+        'X-Profile-Pid': str(state['pid']),
+    })
+
+
+@admin.route('/profile', methods=['DELETE'])
+@error_handler
+@require_token
+def stop_profile():
+    """
+    Stops profiling session, profile collected so far is kept.
+    """
+    return respond(_profiler().stop().state())
+
+
+@admin.route('/memory/start', methods=['POST'])
+@error_handler
+@require_token
+def start_memory_tracing():
+    """
+    Starts tracing memory allocations, keeping `frames` frames of traceback.
+    """
+    frames = ensure_int(request.args.get('frames', None) or None, default=1, min_value=1, max_value=100)
+    _profiler().start_tracing(frames)
+    return respond({'tracing': True, 'frames': frames})
+
+
+@admin.route('/memory/stop', methods=['POST'])
+@error_handler
+@require_token
+def stop_memory_tracing():
+    _profiler().stop_tracing()
+    return respond({'tracing': False})
+
+
+@admin.route('/memory', methods=['GET'])
+@error_handler
+@require_token
+def memory_snapshot():
+    """
+    Takes snapshot of traced memory and returns top allocations and their
+    difference to the previous snapshot. Allocations are grouped by `key`
+    (lineno, filename or traceback), `include` filters them by filename
+    pattern.
+    """
+    key = request.args.get('key', None) or 'lineno'
+    limit = ensure_int(request.args.get('limit', None) or None, default=20, min_value=1)
+    include = request.args.get('include', None) or None
+    return respond(_profiler().snapshot(key, limit, include))
+
+
+@admin.route('/objects', methods=['GET'])
+@error_handler
+@require_token
+def objects():
+    """
+    Returns numbers of live objects of this worker by type.
+    """
+    limit = ensure_int(request.args.get('limit', None) or None, default=30, min_value=1)
+    return respond({'pid': os.getpid(), 'objects': profiling.object_counts(limit)})
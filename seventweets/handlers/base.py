@@ -1,16 +1,19 @@
-from flask import Blueprint, current_app, jsonify
+from flask import Blueprint, current_app
 from seventweets.exception import error_handler
+from seventweets.admission import admit, HIGH
 from seventweets import tweet
+from seventweets.wire import respond
 
 base = Blueprint('base', __name__)
 
 
 @base.route('/')
 @error_handler
+@admit('health', HIGH)
 def index():
     original = tweet.count('original')
     retweets = tweet.count('retweet')
-    return jsonify({
+    return respond({
         'name': current_app.config['ST_OWN_NAME'],
         'address': current_app.config['ST_OWN_ADDRESS'],
         'state': {
@@ -19,3 +22,22 @@ def index():
             'total': original + retweets
         }
     })
+
+
+@base.route('/stats')
+@error_handler
+@admit('health', HIGH)
+def stats():
+    """
+    Returns runtime statistics of this worker.
+    """
+    search_cache = current_app.extensions.get('search_cache')
+    shared_cache = current_app.extensions.get('shared_cache')
+    pusher = current_app.extensions.get('pusher')
+    return respond({
+        'search_cache': search_cache.stats() if search_cache is not None else None,
+        'shared_cache': shared_cache.stats() if shared_cache is not None else None,
+        'jobs': current_app.extensions['executor'].stats(),
+        'push': pusher.stats() if pusher is not None else None,
+        'http': current_app.extensions['http_client'].stats(),
+    })
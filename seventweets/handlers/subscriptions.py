@@ -0,0 +1,92 @@
+import logging
+from functools import wraps, partial
+from flask import Blueprint, current_app
+from seventweets import push
+from seventweets.db import get_db, get_ops
+from seventweets.exception import error_handler, BadRequest, NotFound, Conflict
+from seventweets.admission import admit, NORMAL, LOW
+from seventweets.wire import respond, request_body
+from seventweets.handlers.admin import require_token
+from seventweets.utils import as_bool
+
+subscriptions = Blueprint('subscriptions', __name__)
+logger = logging.getLogger(__name__)
+
+
+def token_if_configured(f):
+    """
+    Requires `ST_API_TOKEN` if it is set. Subscription makes node send
+    requests to arbitrary address, so nodes with token let only clients
+    knowing it to manage subscriptions. Token is always set when push is
+    enabled, `create_app` refuses to start without it.
+    """
+    protected = require_token(f)
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if current_app.config['ST_API_TOKEN']:
+            return protected(*args, **kwargs)
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def _to_dict(subscription):
+    id_, callback, created_at = subscription
+    return {'id': id_, 'callback': callback, 'created_at': created_at}
+
+
+@subscriptions.route('/', methods=['POST'])
+@error_handler
+@admit('write', NORMAL)
+@token_if_configured
+def subscribe():
+    """
+    Subscribes callback address to changes of tweets of this node. Changes
+    are sent to it in batches by POST requests, see `seventweets.push`.
+    Callback has to be on public address and number of subscriptions is
+    limited by `ST_PUSH_MAX_SUBSCRIPTIONS`, since every write is sent to all
+    of them.
+    """
+    body = request_body()
+    callback = body.get('callback') if isinstance(body, dict) else None
+    if not isinstance(callback, str):
+        raise BadRequest('Invalid body: no "callback" key in body.')
+    try:
+        push.check_callback(callback, as_bool(current_app.config['ST_PUSH_ALLOW_PRIVATE']))
+    except ValueError as e:
+        raise BadRequest(f'Invalid callback: {callback}, {e}.')
+    existing = get_db().do(get_ops().get_subscriptions)
+    max_subscriptions = int(current_app.config['ST_PUSH_MAX_SUBSCRIPTIONS'])
+    if len(existing) >= max_subscriptions and all(c != callback for _, c, _ in existing):
+        raise Conflict(f'Limit of {max_subscriptions} subscriptions is reached.')
+    subscription = get_db().do(partial(get_ops().add_subscription, callback))
+    logger.info('Subscribed %s to changes of tweets.', callback)
+    return respond(_to_dict(subscription), 201)
+
+
+@subscriptions.route('/', methods=['GET'])
+@error_handler
+@admit('list', LOW)
+@token_if_configured
+def get_all():
+    """
+    Returns all subscriptions.
+    """
+    return respond([_to_dict(s) for s in get_db().do(get_ops().get_subscriptions)])
+
+
+@subscriptions.route('/<int:subscription_id>', methods=['DELETE'])
+@error_handler
+@admit('write', NORMAL)
+@token_if_configured
+def unsubscribe(subscription_id):
+    """
+    Removes subscription, changes are no longer sent to its callback.
+    :param subscription_id: ID of subscription to remove.
+    """
+    if not get_db().do(partial(get_ops().delete_subscription, subscription_id)):
+        raise NotFound(f'Subscription with id: {subscription_id} not found.')
+    pusher = current_app.extensions.get('pusher')
+    if pusher is not None:
+        pusher.forget(subscription_id)
+    return '', 204
@@ -1,8 +1,16 @@
+import json
+import math
 import logging
-from flask import Blueprint, request, jsonify
-from seventweets import tweet
-from seventweets.exception import error_handler, BadRequest
-from seventweets.handlers.utils import ensure_bool, ensure_dt
+from functools import partial
+from flask import Blueprint, Response, request, current_app, stream_with_context
+from seventweets import tweet, mirror, stream, deadline
+from seventweets.exception import error_handler, BadRequest, ServiceUnavailable
+from seventweets.admission import admit, HIGH, NORMAL, LOW
+from seventweets.wire import respond, request_body
+from seventweets.utils import serves_concurrently, per_worker
+from seventweets.handlers.utils import (
+    ensure_bool, ensure_dt, ensure_int, ensure_fields, ensure_tag, ensure_tag_kind
+)
 
 tweets = Blueprint('tweets', __name__)
 logger = logging.getLogger(__name__)
@@ -10,50 +18,68 @@ logger = logging.getLogger(__name__)
 
 @tweets.route('/', methods=['GET'])
 @error_handler
+@admit('list', LOW)
 def get_all():
-    return jsonify([t.to_dict() for t in tweet.get_all()])
+    """
+    Returns all tweets. If `created_from` or `created_to` is provided, only
+    tweets created in that range are returned, which only reads partitions
+    of tweets table for that range. If `fields` (comma separated columns) is
+    provided, only those fields of tweets are read and returned.
+    """
+    created_from = ensure_dt(request.args.get('created_from', None) or None)
+    created_to = ensure_dt(request.args.get('created_to', None) or None)
+    fields = ensure_fields(request.args.get('fields', None) or None)
+    if created_from is None and created_to is None:
+        results = tweet.get_all(fields)
+    else:
+        results = tweet.search(created_from=created_from, created_to=created_to, fields=fields)
+    return respond([t.to_dict(fields) for t in results])
 
 
 @tweets.route('/<int:tweet_id>', methods=['GET'])
 @error_handler
+@admit('read', HIGH)
 def get_tweet(tweet_id):
     """
     Returns single tweet by ID.
     :param tweet_id: ID of tweet to get.
     """
-    return jsonify(tweet.by_id(tweet_id).to_dict())
+    return respond(tweet.by_id(tweet_id).to_dict())
 
 
 @tweets.route('/create', methods=['POST'])
 @error_handler
+@admit('write', NORMAL)
 def create_tweet():
     """
     Creates new tweet and returns JSON representation.
     """
-    body = request.get_json(force=True)
+    body = request_body()
     if 'tweet' not in body:
         raise BadRequest('Invalid body: no "tweets" key in body.')
     content = body['tweet']
     new_tweet = tweet.create(content)
-    return jsonify(new_tweet.to_dict()), 201
+    return respond(new_tweet.to_dict(), 201)
 
 
 @tweets.route('/<int:tweet_id>', methods=['PUT'])
 @error_handler
+@admit('write', NORMAL)
 def modify(tweet_id):
     """
     Modifies tweet with provided ID
     :param tweet_id: ID of tweet to get.
     """
-    body = request.get_json(force=True)
+    body = request_body()
     if 'tweet' not in body:
         BadRequest('Invalid body: no "tweet" key in body.')
     content = body['tweet']
-    return jsonify(tweet.modify(tweet_id, content).to_dict())
+    return respond(tweet.modify(tweet_id, content).to_dict())
 
 
 @tweets.route('/<int:tweet_id>', methods=['DELETE'])
 @error_handler
+@admit('write', NORMAL)
 def delete(tweet_id):
     tweet.delete(tweet_id)
     return '', 204
@@ -61,21 +87,25 @@ def delete(tweet_id):
 
 @tweets.route('/retweet', methods=['POST'])
 @error_handler
+@admit('write', NORMAL)
 def retweet():
     """
     Creates retweet on this server that references tweet on provided server.
     """
-    body = request.get_json(force=True);
+    body = request_body()
     if 'server' not in body or 'id' not in body:
         raise BadRequest('Missing wither "server" or "id" from body.')
-    return jsonify(tweet.retweet(body['server'], body['id']).to_dict())
+    return respond(tweet.retweet(body['server'], body['id']).to_dict())
 
 
 @tweets.route('/search', methods=['GET'])
 @error_handler
+@admit('search', LOW)
 def search_single():
     """
-    Performs search in database for tweets in this node only.
+    Performs search in database for tweets in this node only. If `fields`
+    (comma separated columns) is provided, only those fields of tweets of
+    this node are read and returned.
     """
     content = request.args.get('content', None) or None
     created_from = ensure_dt(request.args.get('created_from', None) or None)
@@ -84,6 +114,107 @@ def search_single():
     modified_to = ensure_dt(request.args.get('modified_to', None) or None)
     retweets = ensure_bool(request.args.get('retweets', None) or None)
     all = ensure_bool(request.args.get('all', None) or None)
+    fields = ensure_fields(request.args.get('fields', None) or None)
+
+    results = tweet.search(content, created_from, created_to, modified_from, modified_to, retweets, all,
+                           fields)
+    response = respond([t.to_dict(fields) for t in results])
+    if all and mirror.enabled():
+        # age in seconds of mirrored data of each peer, None if never synced
+        freshness = mirror.freshness()
+        max_staleness = float(current_app.config['ST_MIRROR_MAX_STALENESS'])
+        stale = [p for p, age in freshness.items() if age is None or age > max_staleness]
+        response.headers['X-Peer-Freshness'] = json.dumps(freshness)
+        if stale:
+            response.headers['X-Peer-Stale'] = ', '.join(stale)
+    return response
+
+
+@tweets.route('/tags', methods=['GET'])
+@error_handler
+@admit('search', LOW)
+def trending_tags():
+    """
+    Returns the most used tags of tweets created in the last `window`
+    seconds (default hour). `kind` is either 'hashtag' (default) or
+    'mention'.
+    """
+    kind = ensure_tag_kind(request.args.get('kind', None) or None)
+    window = ensure_int(request.args.get('window', None) or None, default=3600, min_value=1,
+                        max_value=30 * 24 * 3600)
+    limit = ensure_int(request.args.get('limit', None) or None, default=10, min_value=1, max_value=100)
+    return respond([{'tag': tag, 'kind': kind, 'count': count}
+                    for tag, count in tweet.trending(kind, window, limit)])
+
 
-    results = tweet.search(content, created_from, created_to, modified_from, modified_to, retweets, all)
-    return jsonify([t.to_dict() for t in results])
+@tweets.route('/tags/<tag>', methods=['GET'])
+@error_handler
+@admit('list', LOW)
+def tagged(tag):
+    """
+    Returns tweets with hashtag or mention, newest first. Tag is `@user` for
+    mention and `tag` or `%23tag` for hashtag.
+    :param tag: Tag to find tweets with.
+    """
+    kind, tag = ensure_tag(tag)
+    limit = ensure_int(request.args.get('limit', None) or None, default=100, min_value=1, max_value=1000)
+    return respond([t.to_dict() for t in tweet.by_tag(kind, tag, limit)])
+
+
+@tweets.route('/changes', methods=['GET'])
+@error_handler
+@admit('changes', LOW)
+def changes():
+    """
+    Returns changes of tweets after provided sequence number, so other nodes
+    can sync incrementally. If `wait` (seconds) is provided and there are no
+    changes, request is held until change happens or wait time passes.
+    Waiting is capped to leave a second of request deadline for reading
+    changes, and is not done by sync workers, which would be blocked by it.
+    """
+    since = ensure_int(request.args.get('since', None) or None, default=0, min_value=0)
+    limit = ensure_int(request.args.get('limit', None) or None, default=100, min_value=1, max_value=1000)
+    max_wait = int(current_app.config['ST_CHANGES_MAX_WAIT'])
+    if not serves_concurrently(current_app.config):
+        max_wait = 0
+    wait = ensure_int(request.args.get('wait', None) or None, default=0, min_value=0, max_value=max_wait)
+    left = deadline.remaining()
+    if left is not None:
+        wait = min(wait, max(0, left - 1))
+
+    results = tweet.changes(since, limit, wait)
+    return respond({
+        'changes': [c.to_dict() for c in results],
+        'last_seq': results[-1].seq if results else since,
+    })
+
+
+@tweets.route('/stream', methods=['GET'])
+@error_handler
+@admit('stream', LOW)
+def stream_changes():
+    """
+    Streams create, modify and delete events as Server-Sent Events. Client
+    can resume stream by providing `Last-Event-ID` header (or `since` query
+    parameter) with ID of last event it has received.
+    Open stream holds worker thread or greenlet, so streams are refused by
+    sync workers and their number is limited by `ST_STREAM_MAX_CLIENTS`.
+    """
+    config = current_app.config
+    if not serves_concurrently(config):
+        raise ServiceUnavailable('Streaming requires gthread or gevent workers.', retry_after=60)
+    last_event_id = request.headers.get('Last-Event-ID', None) or request.args.get('since', None) or None
+    last_event_id = ensure_int(last_event_id, min_value=0)
+    subscription = stream.broker.subscribe(
+        current_app._get_current_object(),
+        maxsize=int(config['ST_STREAM_QUEUE_SIZE']),
+        limit=math.ceil(per_worker(config['ST_STREAM_MAX_CLIENTS'], config)),
+    )
+    events = stream.events(subscription, last_event_id, heartbeat=float(config['ST_STREAM_HEARTBEAT']))
+    response = Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # generator closed before it started does not run its cleanup
+    response.call_on_close(partial(stream.broker.unsubscribe, subscription))
+    return response
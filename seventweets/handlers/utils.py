@@ -1,4 +1,6 @@
+import re
 from datetime import datetime
+from seventweets.db import TWEET_COLUMNS, TAG_KINDS, HASHTAG
 from seventweets.exception import BadRequest
 
 
@@ -39,3 +41,85 @@ def ensure_bool(val):
     if val is None:
         return None
     return val.lower() == 'true'
+
+
+def ensure_int(val, default=None, min_value=None, max_value=None):
+    """
+    Converts query argument to integer.
+
+    If None is provided, default is returned. Value is clamped to provided
+    bounds.
+    :param val: Value to convert to int.
+    :param default: Value returned if `val` is None.
+    :param min_value: Min allowed value.
+    :param max_value: Max allowed value.
+    :return: int: value from provided value.
+    :raises: BadRequest: If provided value could not be converted to int.
+    """
+    if val is None:
+        return default
+
+    try:
+        int_val = int(val)
+    except ValueError:
+        raise BadRequest(f'Expected integer, got {val}')
+
+    if min_value is not None:
+        int_val = max(int_val, min_value)
+    if max_value is not None:
+        int_val = min(int_val, max_value)
+    return int_val
+
+
+def ensure_fields(val):
+    """
+    Converts comma separated list of tweet fields to tuple of column names.
+
+    If None is provided, it will be returned. Duplicates are removed, order of
+    fields is kept.
+    :param val: Value to convert to fields.
+    :return: tuple: names of requested columns.
+    :raises: BadRequest: If field is not one of tweet columns.
+    """
+    if val is None:
+        return None
+
+    fields = tuple(dict.fromkeys(f.strip() for f in val.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in TWEET_COLUMNS]
+    if unknown or not fields:
+        raise BadRequest(f'Invalid fields: {val}, expected comma separated list of: '
+                         f'{", ".join(TWEET_COLUMNS)}.')
+    return fields
+
+
+def ensure_tag(val):
+    """
+    Converts tag from URL to (kind, tag) tuple.
+
+    Tag starting with `@` is mention, any other is hashtag, with optional
+    leading `#` (sent as `%23`). Tag is lower cased, as tags are indexed.
+    :param val: Value to convert to tag.
+    :return: tuple: kind and tag without leading `#` or `@`.
+    :raises: BadRequest: If tag contains other than word characters.
+    """
+    prefix = val[:1] if val[:1] in TAG_KINDS else '#'
+    tag = val[1:] if val[:1] in TAG_KINDS else val
+    if not re.fullmatch(r'\w+', tag):
+        raise BadRequest(f'Invalid tag: {val}, expected hashtag or @mention.')
+    return TAG_KINDS[prefix], tag.lower()
+
+
+def ensure_tag_kind(val):
+    """
+    Converts query argument to kind of tags.
+
+    If None is provided, hashtag kind is returned.
+    :param val: Either 'hashtag' or 'mention'.
+    :return: str: kind of tags.
+    :raises: BadRequest: If value is not a kind of tags.
+    """
+    if val is None:
+        return HASHTAG
+    if val not in TAG_KINDS.values():
+        raise BadRequest(f'Invalid kind: {val}, expected one of: {", ".join(TAG_KINDS.values())}.')
+    return val
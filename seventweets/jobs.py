@@ -0,0 +1,310 @@
+"""
+Background execution of deferred and periodic work.
+
+`Executor` runs jobs in pool of worker threads of the process, each job with
+app context, so slow side effects of requests do not add to response time.
+Queue is bounded and job submitted while it is full is rejected, so backlog
+of side effects can not grow without limit when they can not keep up.
+
+Failed jobs are retried with exponential backoff. Periodic jobs are run
+again `interval` seconds after previous run finished, so runs never overlap.
+Delayed jobs (retries and periodic) are kept in heap and moved to queue by
+scheduler thread when they are due.
+
+Threads are started on first submitted job, so CLI commands creating app do
+not start them. On shutdown (`worker_exit` hook of gunicorn or interpreter
+exit) shutdown hooks are run first, so components can submit work they still
+hold, then new jobs are rejected and queued ones are finished, at most for
+`ST_JOB_DRAIN_TIMEOUT` seconds.
+"""
+import time
+import heapq
+import queue
+import logging
+import itertools
+import threading
+from collections import deque
+from functools import partial
+from typing import Callable, Optional, List
+
+from flask import current_app
+
+from seventweets.utils import percentiles_ms
+
+logger = logging.getLogger(__name__)
+
+# number of recent jobs latency percentiles are computed from
+LATENCY_SAMPLES = 1000
+
+
+class Job:
+    """
+    Single unit of work, with its retry state.
+    """
+
+    def __init__(self, name: str, fn: Callable[[], None], retries: int,
+                 interval: Optional[float]=None):
+        """
+        :param name: Name of job in logs.
+        :param fn: Function executing job.
+        :param retries: Max number of retries after failure.
+        :param interval: Seconds between runs of periodic job, None if job runs once.
+        """
+        self.name = name
+        self.fn = fn
+        self.retries = retries
+        self.interval = interval
+        self.attempt = 0
+        self.queued_at = 0.0
+
+
+class Executor:
+    """
+    Pool of threads executing jobs from bounded queue.
+    """
+
+    def __init__(self, app, workers: int, queue_size: int, retries: int, backoff: float,
+                 max_backoff: float):
+        """
+        :param app: Flask application, used to create app context for jobs.
+        :param workers: Number of worker threads.
+        :param queue_size: Max number of jobs waiting for worker.
+        :param retries: Default max number of retries of failed job.
+        :param backoff: Seconds before first retry, doubled with every next one.
+        :param max_backoff: Max seconds between retries.
+        """
+        self.app = app
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(queue_size)
+        self._delayed = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._scheduler: Optional[threading.Thread] = None
+        self._closing = False
+        self._shutdown_hooks: List[Callable[[], None]] = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.running = 0
+        self._waits = deque(maxlen=LATENCY_SAMPLES)
+        self._durations = deque(maxlen=LATENCY_SAMPLES)
+
+    def _start(self):
+        with self._lock:
+            if self._scheduler is not None:
+                return
+            self._threads = [threading.Thread(target=self._work, name=f'seventweets-job-{i}', daemon=True)
+                             for i in range(self.workers)]
+            self._scheduler = threading.Thread(target=self._schedule, name='seventweets-scheduler',
+                                               daemon=True)
+            for thread in self._threads + [self._scheduler]:
+                thread.start()
+
+    def submit(self, fn: Callable, *args, name: str=None, retries: int=None, delay: float=0) -> bool:
+        """
+        Submits job executing `fn(*args)`.
+
+        :param name: Name of job in logs, name of `fn` by default.
+        :param retries: Max number of retries, `ST_JOB_RETRIES` by default.
+        :param delay: Seconds to wait before job is queued.
+        :return: False if job was rejected, because queue is full or
+            executor is shutting down.
+        """
+        job = Job(name or getattr(fn, '__name__', repr(fn)), partial(fn, *args),
+                  self.retries if retries is None else retries)
+        if delay > 0:
+            return self._defer(job, delay)
+        return self._enqueue(job)
+
+    def schedule(self, name: str, fn: Callable[[], None], interval: float, delay: float=0):
+        """
+        Runs `fn` every `interval` seconds, first time after `delay` seconds.
+        Failed run is not retried, it is just logged.
+        """
+        self._defer(Job(name, fn, retries=0, interval=interval), delay)
+
+    def on_shutdown(self, fn: Callable[[], None]):
+        """
+        Registers `fn` to be run with app context when shutdown starts, while
+        jobs are still accepted, so jobs it submits are finished by drain.
+        """
+        self._shutdown_hooks.append(fn)
+
+    def _enqueue(self, job: Job) -> bool:
+        if self._closing:
+            logger.warning('Executor is shutting down, rejecting job %s.', job.name)
+            return False
+        self._start()
+        job.queued_at = time.monotonic()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.warning('Job queue is full, rejecting job %s.', job.name)
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _defer(self, job: Job, delay: float) -> bool:
+        if self._closing:
+            return False
+        self._start()
+        with self._cond:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), job))
+            self._cond.notify()
+        return True
+
+    def _schedule(self):
+        """
+        Moves delayed jobs to queue when they are due.
+        """
+        while True:
+            with self._cond:
+                while not self._closing:
+                    now = time.monotonic()
+                    if self._delayed and self._delayed[0][0] <= now:
+                        break
+                    self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+                if self._closing:
+                    return
+                _, _, job = heapq.heappop(self._delayed)
+            if not self._enqueue(job) and job.interval is not None:
+                # periodic job is not lost when queue is full, it runs next time
+                self._defer(job, job.interval)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            start = time.monotonic()
+            with self._lock:
+                self.running += 1
+                self._waits.append(start - job.queued_at)
+            try:
+                with self.app.app_context():
+                    job.fn()
+            except Exception:
+                self._failed(job)
+            else:
+                with self._lock:
+                    self.completed += 1
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self._durations.append(time.monotonic() - start)
+            if job.interval is not None:
+                self._defer(job, job.interval)
+
+    def _failed(self, job: Job):
+        if job.attempt >= job.retries:
+            with self._lock:
+                self.failed += 1
+            logger.exception('Job %s failed.', job.name)
+            return
+        delay = min(self.backoff * 2 ** job.attempt, self.max_backoff)
+        job.attempt += 1
+        with self._lock:
+            self.retried += 1
+        logger.warning('Job %s failed, retrying in %.1fs (%d of %d).', job.name, delay,
+                       job.attempt, job.retries, exc_info=True)
+        self._defer(job, delay)
+
+    def shutdown(self, timeout: float):
+        """
+        Runs shutdown hooks, rejects new jobs and waits until queued jobs are
+        finished, at most `timeout` seconds. Pending retries and periodic jobs
+        are dropped.
+        """
+        if self._closing:
+            return
+        for hook in self._shutdown_hooks:
+            try:
+                with self.app.app_context():
+                    hook()
+            except Exception:
+                logger.exception('Shutdown hook %s failed.', getattr(hook, '__name__', repr(hook)))
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            dropped = sum(1 for _, _, job in self._delayed if job.interval is None)
+            self._delayed.clear()
+            self._cond.notify_all()
+        with self._lock:
+            workers = list(self._threads)
+        if not workers:
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            # workers exit on sentinel, after all jobs queued before it
+            for _ in workers:
+                self._queue.put(None, timeout=max(0, deadline - time.monotonic()))
+        except queue.Full:
+            pass
+        for thread in workers:
+            thread.join(max(0, deadline - time.monotonic()))
+        unfinished = sum(1 for t in workers if t.is_alive())
+        if unfinished or dropped:
+            logger.warning('Executor shut down with %d busy workers and %d dropped retries.',
+                           unfinished, dropped)
+
+    def stats(self) -> dict:
+        """
+        Returns queue depth, job counters and percentiles of time jobs waited
+        in queue and of their duration, in milliseconds.
+        """
+        with self._lock:
+            waits = sorted(self._waits)
+            durations = sorted(self._durations)
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'delayed': len(self._delayed),
+                'running': self.running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'rejected': self.rejected,
+                'wait_ms': percentiles_ms(waits),
+                'duration_ms': percentiles_ms(durations),
+            }
+
+
+def create_executor(app) -> Executor:
+    """
+    Creates executor from application config.
+    """
+    return Executor(
+        app,
+        workers=int(app.config['ST_JOB_WORKERS']),
+        queue_size=int(app.config['ST_JOB_QUEUE_SIZE']),
+        retries=int(app.config['ST_JOB_RETRIES']),
+        backoff=float(app.config['ST_JOB_BACKOFF']),
+        max_backoff=float(app.config['ST_JOB_MAX_BACKOFF']),
+    )
+
+
+def submit(fn: Callable, *args, name: str=None, retries: int=None, delay: float=0) -> bool:
+    """
+    Submits job executing `fn(*args)` to executor of current app. See
+    `Executor.submit`.
+    """
+    return current_app.extensions['executor'].submit(fn, *args, name=name, retries=retries, delay=delay)
+
+
+def schedule(name: str, fn: Callable[[], None], interval: float, delay: float=0):
+    """
+    Runs `fn` periodically on executor of current app. See `Executor.schedule`.
+    """
+    current_app.extensions['executor'].schedule(name, fn, interval, delay)
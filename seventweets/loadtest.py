@@ -0,0 +1,302 @@
+"""
+Load generator driving node with mixed workload of creates, modifications,
+deletes, point reads, lists, searches and retweets.
+
+Requests are sent either over HTTP to running node or directly to in-process
+app. With target rate, requests are scheduled at fixed intervals and latency
+is measured from scheduled time, so time request waited because all workers
+were busy is included (no coordinated omission).
+
+Requests rejected by admission control (429 and 503) are reported apart from
+errors, since shedding load is expected behaviour of overloaded node.
+"""
+import time
+import math
+import random
+import json as jsonlib
+import threading
+from typing import Dict, List, Optional, Tuple, Callable
+
+import requests
+
+OPERATIONS = ('create', 'modify', 'delete', 'read', 'list', 'search', 'retweet')
+OK = 'ok'
+REJECTED = 'rejected'
+ERROR = 'error'
+DEFAULT_MIX = 'create=10,modify=5,delete=2,read=40,list=5,search=30,retweet=8'
+
+WORDS = ('hello', 'world', 'python', 'flask', 'tweet', 'node', 'search', 'load',
+         'test', 'seven', 'cache', 'stream', 'peer', 'mirror', 'data')
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """
+    Parses workload mix given as comma separated `operation=weight` pairs.
+
+    :raises ValueError: If operation is unknown or weight is not a number.
+    """
+    mix = {}
+    for part in value.split(','):
+        if not part.strip():
+            continue
+        op, _, weight = part.partition('=')
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise ValueError(f'Unknown operation: {op}, expected one of {OPERATIONS}.')
+        mix[op] = float(weight)
+    if not any(w > 0 for w in mix.values()):
+        raise ValueError('At least one operation must have positive weight.')
+    return mix
+
+
+class HttpTransport:
+    """
+    Sends requests to running node. Every worker has its own transport, so
+    HTTP connections are reused.
+    """
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method: str, path: str, json=None, params=None) -> Tuple[int, object]:
+        resp = self.session.request(method, self.base_url + path, json=json, params=params,
+                                    timeout=self.timeout)
+        try:
+            return resp.status_code, resp.json()
+        except ValueError:
+            return resp.status_code, None
+
+
+class AppTransport:
+    """
+    Sends requests directly to in-process app.
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, json=None, params=None) -> Tuple[int, object]:
+        # Flask 0.12 test client neither accepts `json=` nor decodes responses
+        data = jsonlib.dumps(json) if json is not None else None
+        resp = self.client.open(path, method=method, data=data, content_type='application/json',
+                                query_string=params)
+        try:
+            return resp.status_code, jsonlib.loads(resp.data)
+        except ValueError:
+            return resp.status_code, None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Returns q-th percentile (0-100) of sorted values, using nearest rank.
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))
+    return values[rank]
+
+
+class Stats:
+    """
+    Latencies and outcomes per operation.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.errors: Dict[str, int] = {op: 0 for op in OPERATIONS}
+        self.rejected: Dict[str, int] = {op: 0 for op in OPERATIONS}
+        self._lock = threading.Lock()
+
+    def record(self, op: str, seconds: float, outcome: str):
+        with self._lock:
+            self.latencies[op].append(seconds)
+            if outcome == ERROR:
+                self.errors[op] += 1
+            elif outcome == REJECTED:
+                self.rejected[op] += 1
+
+    def report(self, elapsed: float) -> List[Tuple]:
+        """
+        Returns rows of (operation, count, error rate, rejected rate, requests
+        per second, p50, p90, p99, max) with latencies in milliseconds. Last
+        row is total.
+        """
+        rows = []
+        every = []
+        for op in OPERATIONS:
+            latencies = sorted(self.latencies[op])
+            every.extend(latencies)
+            if latencies:
+                rows.append(self._row(op, latencies, self.errors[op], self.rejected[op], elapsed))
+        every.sort()
+        rows.append(self._row('total', every, sum(self.errors.values()),
+                              sum(self.rejected.values()), elapsed))
+        return rows
+
+    @staticmethod
+    def _row(name, latencies, errors, rejected, elapsed):
+        count = len(latencies)
+        return (name, count, errors / count if count else 0.0, rejected / count if count else 0.0,
+                count / elapsed if elapsed else 0.0,
+                percentile(latencies, 50) * 1000, percentile(latencies, 90) * 1000,
+                percentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0) * 1000)
+
+
+class LoadTest:
+    """
+    Runs workload with `concurrency` workers until `duration` seconds pass or
+    `max_requests` requests are sent.
+    """
+
+    def __init__(self, transport_factory: Callable[[], object], mix: Dict[str, float],
+                 concurrency: int, rate: float=0, duration: float=10, max_requests: int=0):
+        """
+        :param transport_factory: Creates transport for single worker.
+        :param mix: Operation to relative weight.
+        :param concurrency: Number of workers sending requests.
+        :param rate: Target requests per second of all workers, 0 is as fast as possible.
+        :param duration: Max duration in seconds, 0 is unlimited.
+        :param max_requests: Max number of requests, 0 is unlimited.
+        """
+        if not duration and not max_requests:
+            raise ValueError('Either duration or number of requests has to be limited.')
+        self.transport_factory = transport_factory
+        self.operations = list(mix)
+        self.weights = [mix[op] for op in self.operations]
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.max_requests = max_requests
+        self.stats = Stats()
+        self._ids: List[int] = []
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def _next(self, start: float) -> Optional[float]:
+        """
+        Reserves next request, returns time it is scheduled at or None when
+        load test is over.
+        """
+        with self._lock:
+            if self.max_requests and self._sent >= self.max_requests:
+                return None
+            n = self._sent
+            self._sent += 1
+        scheduled = start + n / self.rate if self.rate else time.perf_counter()
+        if self.duration and scheduled - start >= self.duration:
+            return None
+        return scheduled
+
+    def _pick_id(self, remove: bool=False) -> Optional[int]:
+        with self._lock:
+            if not self._ids:
+                return None
+            i = random.randrange(len(self._ids))
+            if remove:
+                self._ids[i], self._ids[-1] = self._ids[-1], self._ids[i]
+                return self._ids.pop()
+            return self._ids[i]
+
+    def _request(self, transport, op: str) -> Tuple[str, str]:
+        """
+        Sends request of operation, falling back to create if operation needs
+        existing tweet and none is known.
+
+        :return: Operation that was executed and its outcome.
+        """
+        id_ = None
+        if op in ('modify', 'delete', 'read'):
+            id_ = self._pick_id(remove=op == 'delete')
+            if id_ is None:
+                op = 'create'
+
+        if op == 'create':
+            status, body = transport.request('POST', '/tweets/create', json={'tweet': _text()})
+            if status == 201 and isinstance(body, dict):
+                with self._lock:
+                    self._ids.append(body['id'])
+        elif op == 'modify':
+            status, _ = transport.request('PUT', f'/tweets/{id_}', json={'tweet': _text()})
+        elif op == 'delete':
+            status, _ = transport.request('DELETE', f'/tweets/{id_}')
+        elif op == 'read':
+            status, _ = transport.request('GET', f'/tweets/{id_}')
+        elif op == 'list':
+            status, _ = transport.request('GET', '/tweets/')
+        elif op == 'search':
+            status, _ = transport.request('GET', '/tweets/search', params=_search_params())
+        else:
+            status, _ = transport.request('POST', '/tweets/retweet',
+                                          json={'server': 'loadtest', 'id': random.randint(1, 10 ** 6)})
+        if 200 <= status < 300:
+            return op, OK
+        return op, REJECTED if status in (429, 503) else ERROR
+
+    def _worker(self, start: float):
+        transport = self.transport_factory()
+        while True:
+            scheduled = self._next(start)
+            if scheduled is None:
+                return
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            op = random.choices(self.operations, self.weights)[0]
+            try:
+                op, outcome = self._request(transport, op)
+            except Exception:
+                outcome = ERROR
+            self.stats.record(op, time.perf_counter() - scheduled, outcome)
+
+    def seed(self):
+        """
+        Loads IDs of existing tweets, so reads and modifications have
+        something to work with from the start.
+        """
+        status, body = self.transport_factory().request('GET', '/tweets/')
+        if status == 200 and isinstance(body, list):
+            self._ids = [t['id'] for t in body]
+
+    def run(self) -> float:
+        """
+        Runs load test.
+
+        :return: Elapsed time in seconds.
+        """
+        self.seed()
+        start = time.perf_counter()
+        workers = [threading.Thread(target=self._worker, args=(start,), daemon=True)
+                   for _ in range(self.concurrency)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return time.perf_counter() - start
+
+
+def _text() -> str:
+    return ' '.join(random.choice(WORDS) for _ in range(random.randint(2, 12)))[:140]
+
+
+def _search_params() -> Dict[str, object]:
+    params = {}
+    if random.random() < 0.7:
+        params['content'] = random.choice(WORDS)
+    if random.random() < 0.3:
+        window = random.choice((60, 600, 3600, 24 * 3600))
+        params['created_from'] = int(time.time()) - window
+    if random.random() < 0.1:
+        params['retweets'] = 'true'
+    return params
+
+
+def format_report(rows: List[Tuple], elapsed: float) -> str:
+    lines = [f'{"operation":<10}{"count":>8}{"errors":>9}{"rejected":>10}{"req/s":>9}'
+             f'{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}{"max ms":>9}']
+    for name, count, error_rate, rejected_rate, rate, p50, p90, p99, max_ in rows:
+        lines.append(f'{name:<10}{count:>8}{error_rate:>9.1%}{rejected_rate:>10.1%}{rate:>9.1f}'
+                     f'{p50:>9.1f}{p90:>9.1f}{p99:>9.1f}{max_:>9.1f}')
+    lines.append(f'elapsed {elapsed:.2f}s')
+    return '\n'.join(lines)
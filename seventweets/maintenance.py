@@ -0,0 +1,49 @@
+"""
+Periodic maintenance of database, like creating partitions of tweets table
+for upcoming months before tweets for them arrive and compacting storage.
+"""
+import logging
+
+from flask import current_app
+from functools import partial
+
+from seventweets.db import get_db, get_ops
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_partitions() -> int:
+    """
+    Creates missing partitions for `ST_PARTITION_MONTHS_AHEAD` months ahead.
+
+    :return: Number of created partitions.
+    """
+    months_ahead = int(current_app.config['ST_PARTITION_MONTHS_AHEAD'])
+    created = get_db().do(partial(get_ops().ensure_partitions, months_ahead))
+    if created:
+        logger.info('Created %d partitions of tweets table.', created)
+    return created
+
+
+def compact() -> bool:
+    """
+    Compacts storage if backend needs it and there is enough to reclaim.
+
+    :return: True if storage was compacted.
+    """
+    return get_db().do(get_ops().compact)
+
+
+def run():
+    ensure_partitions()
+    compact()
+
+
+def start(app):
+    """
+    Schedules maintenance on background executor every
+    `ST_MAINTENANCE_INTERVAL` seconds, first run is right away.
+
+    :param app: Flask application with executor.
+    """
+    app.extensions['executor'].schedule('maintenance', run, float(app.config['ST_MAINTENANCE_INTERVAL']))
@@ -2,12 +2,21 @@ import os
 import re
 import logging
 import io
+import time
+import zlib
+from contextlib import contextmanager
 from importlib import import_module
+from typing import List, Tuple
 
-from seventweets.db import get_db
+import pg8000
+
+from seventweets.db import get_connection, default_backend
 
 logger = logging.getLogger(__name__)
 
+# migration modules, imported once per process
+_collected_migrations = None
+
 MIGRATION_TEMPLATE = '''
 
 """
@@ -15,14 +24,39 @@ MIGRATION_TEMPLATE = '''
 """
 id = {id}
 
+# Set to False for steps that can not be executed inside of transaction, like
+# `CREATE INDEX CONCURRENTLY`. Such migration is executed in autocommit mode,
+# so it should be safe to run again if it fails half way (`IF NOT EXISTS`).
+transactional = True
+
+# Number of rows `backfill` processes in single transaction and pause in
+# seconds between two batches.
+batch_size = 1000
+backfill_pause = 0
+
 
 def upgrade(cursor):
     pass
 
-    
+
 def downgrade(cursor):
     pass
 
+
+# Uncomment to process existing rows in chunks after `upgrade` is applied.
+# Every call is executed in its own transaction and should process at most
+# `limit` rows with key greater than `after` (None on first call). It returns
+# key of last processed row, or None when there is nothing left to process.
+# Progress is stored, so interrupted backfill continues where it stopped.
+#
+# def backfill(cursor, after, limit):
+#     cursor.execute(\'\'\'
+#         UPDATE tweets SET ... WHERE id IN (
+#             SELECT id FROM tweets WHERE id > %s ORDER BY id LIMIT %s
+#         ) RETURNING id;
+#     \'\'\', (after or 0, limit))
+#     ids = [row[0] for row in cursor.fetchall()]
+#     return max(ids) if ids else None
 '''
 
 
@@ -34,43 +68,78 @@ class MigrationManager:
     All migrations have to have `id` module level field that indicate its
     order, `upgrade` and `downgrade` functions that accept `pg8000.Cursor`
     as parameter.
+
+    Migrations are applied while holding Postgres advisory lock, so multiple
+    workers or nodes started at the same time against the same database will
+    not apply same migration twice. All pending migrations and version
+    bookkeeping are applied in single transaction, except for
+    non-transactional migrations, whose version is committed right after them.
+
+    Migration can optionally define:
+        - `transactional = False` - it is executed in autocommit mode, outside
+          of transaction, which is needed for `CREATE INDEX CONCURRENTLY`.
+        - `backfill(cursor, after, limit)` - chunked data migration executed
+          after `upgrade`, one transaction per batch of `batch_size` rows with
+          `backfill_pause` seconds between batches. Progress is persisted so
+          interrupted backfill is resumed on next upgrade.
+
+    Embedded backends (SQLite) keep their schema in backend module. If
+    database has `bootstrap` method, upgrade is delegated to it and downgrade
+    is not supported.
     """
     UP = 'up'
     DOWN = 'down'
 
-    def __init__(self, version_table='_migrations'):
+    def __init__(self, version_table='_migrations', backend=default_backend):
         """
         :param version_table: Name of table to hold current migration status.
+        :param backend: Database backend to migrate, `ST_DB_BACKEND` by default.
         """
         self.version_table = version_table
-        self.db = get_db()
-        self.ensure_infrastructure()
+        self.backfill_table = f'{version_table}_backfill'
+        self.lock_key = zlib.crc32(version_table.encode('utf-8'))
+        self.db = get_connection(backend)
         self.migrations = self.collect_migrations()
-        logger.info('Found %d migrations. Last applied id is %s.', len(self.migrations), self.current_version())
 
-    def ensure_infrastructure(self):
+    def ensure_infrastructure(self, cursor):
         """
-        Make sure that table for tracking migration existing in database.
+        Make sure that tables for tracking migrations exist in database and
+        that version table contains exactly one row.
+
+        :param cursor: Database cursor.
         """
-        cur = self.db.cursor()
-        cur.execute(f'''
+        cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS {self.version_table}
             (
                 version integer
             );
         ''')
-        self.db.commit()
-        cur.close()
+        cursor.execute(f'''
+            INSERT INTO {self.version_table} (version)
+            SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM {self.version_table});
+        ''')
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.backfill_table}
+            (
+                migration integer PRIMARY KEY,
+                position bigint,
+                batches integer NOT NULL DEFAULT 0,
+                done boolean NOT NULL DEFAULT false
+            );
+        ''')
 
     @staticmethod
     def collect_migrations():
         """
         Collects and returns all migrations that could be found.
 
-        Migrations will be found if they inherit `Migrations` class. Also, note
-        that module where migrations are defined needs to be executed in order
-        for `__subclasses__` method to work.
+        Migration modules are imported only once per process, subsequent calls
+        return already collected migrations.
         """
+        global _collected_migrations
+        if _collected_migrations is not None:
+            return _collected_migrations
+
         migrations = []
         basedir = os.path.dirname(__file__)
         for fmodule in os.listdir(os.path.join(basedir, 'migrations')):
@@ -78,107 +147,261 @@ class MigrationManager:
                 continue
             mig = import_module(f'seventweets.migrations.{fmodule[:-3]}')
             if not hasattr(mig, 'id'):
-                logger.warning('Migrations %s without "id" field. Skipping.')
+                logger.warning('Migrations %s without "id" field. Skipping.', fmodule)
                 continue
             else:
                 migrations.append(mig)
-        return sorted(migrations, key=lambda migration: migration.id)
+        _collected_migrations = sorted(migrations, key=lambda migration: migration.id)
+        return _collected_migrations
 
-    def migrate(self, direction):
+    def migrate(self, direction) -> List[Tuple[int, str, float]]:
         """
         Executes migrations.
 
         In case of 'upgrade' migrations, all unapplied will be applied.
         In case of 'downgrade' migrations, only one will be applied.
         :param direction: Either `MigrationManager.UP` or `MigrationManager.DOWN`.
+        :return: List of applied migrations as (id, name, duration in seconds) tuples.
         """
         if direction not in [self.DOWN, self.UP]:
             raise ValueError(f'Invalid direction: {direction}.')
+        if hasattr(self.db, 'bootstrap'):
+            if direction == self.DOWN:
+                raise ValueError(f'Downgrade is not supported by {type(self.db).__module__} backend.')
+            return self.db.bootstrap()
         if direction == self.UP:
-            self._upgrade()
+            return self._upgrade()
         else:
-            self._downgrade()
+            return self._downgrade()
 
-    def _upgrade(self):
-        current_version = self.current_version()
+    def pending(self, current_version):
+        """
+        Returns migrations that are not applied for provided version.
+        """
+        return [m for m in self.migrations if m.id > current_version]
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds session level advisory lock while inside of context. Other
+        processes trying to migrate same database will wait for lock to be
+        released.
+        """
+        cursor = self.db.cursor()
+        try:
+            logger.debug('Acquiring migration lock %s.', self.lock_key)
+            cursor.execute('SELECT pg_advisory_lock(%s);', (self.lock_key,))
+            self.db.commit()
+            yield
+        finally:
+            try:
+                cursor.execute('SELECT pg_advisory_unlock(%s);', (self.lock_key,))
+                self.db.commit()
+            finally:
+                cursor.close()
 
-        for migration in self.migrations:
-            if migration.id > current_version:
-                cursor = self.db.cursor()
-                try:
+    def _upgrade(self):
+        # fast path, single query when database is already up to date
+        version, unfinished = self.status()
+        if not self.pending(version) and not unfinished:
+            logger.info('Database is up to date.')
+            return []
+
+        applied = []
+        with self.lock():
+            cursor = self.db.cursor()
+            try:
+                self.ensure_infrastructure(cursor)
+                # version might be changed by other process while we were waiting for lock
+                current_version = self._read_version(cursor)
+                for migration in self.pending(current_version):
                     logger.info('Applying upgrade migrations %s (%s)', migration.id, migration.__name__)
-                    migration.upgrade(cursor)
+                    start = time.perf_counter()
+                    if getattr(migration, 'transactional', True):
+                        migration.upgrade(cursor)
+                    else:
+                        # commit everything applied so far, so this migration
+                        # can run outside of transaction
+                        self.db.commit()
+                        self._run_non_transactional(migration.upgrade)
+                    self.set_version(migration.id, cursor)
+                    if hasattr(migration, 'backfill'):
+                        cursor.execute(f'''
+                            INSERT INTO {self.backfill_table} (migration) VALUES (%s)
+                            ON CONFLICT (migration) DO UPDATE
+                            SET position=NULL, batches=0, done=false;
+                        ''', (migration.id,))
+                    if not getattr(migration, 'transactional', True):
+                        # migration is committed already, so is its version, or
+                        # failure of the next one would make it run again
+                        self.db.commit()
+                    duration = time.perf_counter() - start
+                    logger.info('Migration %s applied in %.3fs.', migration.id, duration)
+                    applied.append((migration.id, migration.__name__, duration))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            finally:
+                cursor.close()
+
+            self._run_backfills()
+        return applied
+
+    def _downgrade(self):
+        with self.lock():
+            cursor = self.db.cursor()
+            try:
+                self.ensure_infrastructure(cursor)
+                current_version = self._read_version(cursor)
+                current_index = None
+                for i, migration in enumerate(self.migrations):
+                    if migration.id == current_version:
+                        current_index = i
+                if current_index is None:
+                    logger.info('Nothing to downgrade.')
                     self.db.commit()
-                except Exception:
-                    self.db.rollback()
-                    raise
+                    return []
+
+                migration = self.migrations[current_index]
+                logger.info('Applying downgrade migration %s (%s).', migration.id, migration.__name__)
+                start = time.perf_counter()
+                if getattr(migration, 'transactional', True):
+                    migration.downgrade(cursor)
+                else:
+                    self.db.commit()
+                    self._run_non_transactional(migration.downgrade)
+                cursor.execute(f'''
+                    DELETE FROM {self.backfill_table} WHERE migration=%s;
+                ''', (migration.id,))
+                if current_index == 0:
+                    self.set_version(0, cursor)
                 else:
-                    self.set_version(migration.id)
-                finally:
-                    cursor.close()
+                    self.set_version(self.migrations[current_index - 1].id, cursor)
+                self.db.commit()
+                duration = time.perf_counter() - start
+                logger.info('Migration %s reverted in %.3fs.', migration.id, duration)
+                return [(migration.id, migration.__name__, duration)]
+            except Exception:
+                self.db.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def _run_non_transactional(self, fn):
+        """
+        Executes migration step in autocommit mode.
 
-    def _downgrade(self):
-        current_version = self.current_version()
-        current_index = -1
-        for i, migration in enumerate(self.migrations):
-            if migration.id == current_version:
-                current_index = i
+        :param fn: Migration step, `upgrade` or `downgrade` function.
+        """
+        self.db.autocommit = True
+        cursor = self.db.cursor()
+        try:
+            fn(cursor)
+        finally:
+            cursor.close()
+            self.db.autocommit = False
+
+    def _run_backfills(self):
+        """
+        Executes all unfinished backfills, continuing from last stored position.
+        Each batch is committed together with its progress, so it is safe to
+        interrupt backfill at any moment.
+        """
+        by_id = {m.id: m for m in self.migrations}
         cursor = self.db.cursor()
         try:
-            migration = self.migrations[current_index]
-            logger.info('Applying downgrade migration %s (%s).', migration.id, migration.__name__)
-            migration.downgrade(cursor)
+            cursor.execute(f'''
+                SELECT migration, position, batches
+                FROM {self.backfill_table}
+                WHERE NOT done
+                ORDER BY migration;
+            ''')
+            unfinished = cursor.fetchall()
             self.db.commit()
-        except Exception:
-            self.db.rollback()
-            raise
-        else:
-            if current_index == 0:
-                self.set_version(0)
-            else:
-                prev_migration = self.migrations[current_index - 1]
-                self.set_version(prev_migration.id)
+
+            for migration_id, position, batches in unfinished:
+                migration = by_id.get(migration_id)
+                if migration is None or not hasattr(migration, 'backfill'):
+                    logger.warning('Backfill for unknown migration %s. Skipping.', migration_id)
+                    continue
+                batch_size = getattr(migration, 'batch_size', 1000)
+                pause = getattr(migration, 'backfill_pause', 0)
+                logger.info('Backfilling migration %s (%s) from position %s.',
+                            migration.id, migration.__name__, position)
+                start = time.perf_counter()
+                while True:
+                    try:
+                        position = migration.backfill(cursor, position, batch_size)
+                        batches += 1
+                        cursor.execute(f'''
+                            UPDATE {self.backfill_table}
+                            SET position=COALESCE(%s, position), batches=%s, done=%s
+                            WHERE migration=%s;
+                        ''', (position, batches, position is None, migration.id))
+                        self.db.commit()
+                    except Exception:
+                        self.db.rollback()
+                        raise
+                    if position is None:
+                        break
+                    logger.info('Backfill %s: batch %d done, position %s, %.1fs elapsed.',
+                                migration.id, batches, position, time.perf_counter() - start)
+                    if pause:
+                        time.sleep(pause)
+                logger.info('Backfill %s finished in %d batches, %.3fs.',
+                            migration.id, batches, time.perf_counter() - start)
         finally:
             cursor.close()
 
+    def status(self):
+        """
+        Returns currently applied migration and number of unfinished backfills
+        using single query.
+        """
+        if hasattr(self.db, 'bootstrap'):
+            return self.db.schema_version(), 0
+        cur = self.db.cursor()
+        try:
+            cur.execute(f'''
+                SELECT
+                    (SELECT version FROM {self.version_table} LIMIT 1),
+                    (SELECT count(*) FROM {self.backfill_table} WHERE NOT done);
+            ''')
+            version, unfinished = cur.fetchone()
+            self.db.commit()
+            return version or 0, unfinished
+        except pg8000.ProgrammingError:
+            # tracking tables do not exist yet, nothing is applied
+            self.db.rollback()
+            return 0, 0
+        finally:
+            cur.close()
+
     def current_version(self):
         """
         Returns currently applied migration from database.
         """
-        cur = self.db.cursor()
-        cur.execute(f'''
+        return self.status()[0]
+
+    def _read_version(self, cursor):
+        cursor.execute(f'''
             SELECT version FROM {self.version_table} LIMIT 1;
         ''')
-        cur_version = cur.fetchone()
-        if cur_version is None:
-            version = 0
-        else:
-            version = cur_version[0]
-
-        cur.close()
-        return version
+        cur_version = cursor.fetchone()
+        return 0 if cur_version is None else cur_version[0]
 
-    def set_version(self, version):
+    def set_version(self, version, cursor):
         """
-        Sets version to migration table in database.
+        Sets version to migration table in database. Commit is left to the
+        caller, so version is changed in the same transaction as migrations.
+
         :param version: Version to set.
+        :param cursor: Database cursor.
         """
-
-        cur = self.db.cursor()
-        cur.execute(f'''
-            SELECT count(*) FROM {self.version_table};
-        ''')
-        count = cur.fetchone()[0]
-        if count == 0:
-            cur.execute(f'''
-                INSERT INTO {self.version_table} (version) VALUES (%s)
-            ''', (version,))
-        else:
-            cur.execute(f'''
-                UPDATE {self.version_table} SET version=%s;
-            ''', (version,))
-        self.db.commit()
-        cur.close()
+        cursor.execute(f'''
+            UPDATE {self.version_table} SET version=%s;
+        ''', (version,))
 
     def create_migration(self, name):
         """
@@ -207,7 +430,7 @@ class MigrationManager:
         # just in case, check if file already exist since it might exist
         # without being proper migration (without `id` field), in which
         # case we would not catch it on collection
-        if os.path.exists(file_name):
+        if os.path.exists(file_path):
             raise ValueError(
                 'File %s already exist and it is not migration. Remove it, '
                 'since `seventweets.migraitons` should contain only migration '
@@ -219,11 +442,3 @@ class MigrationManager:
             mig_file.write(MIGRATION_TEMPLATE.format(id=next_id, name=name))
 
         logger.info('Migration %s generated', file_path)
-
-
-
-
-
-
-
-
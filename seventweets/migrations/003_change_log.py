@@ -0,0 +1,51 @@
+
+"""
+change log
+"""
+id = 3
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE tweet_changes (
+            seq BIGSERIAL PRIMARY KEY,
+            tweet_id INTEGER NOT NULL,
+            op VARCHAR(16) NOT NULL CHECK(op IN ('create', 'modify', 'delete')),
+            changed_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+    ''')
+    # Advisory transaction lock serializes writers from the moment change is
+    # recorded until commit, so sequence numbers become visible in order and
+    # readers polling with `seq > since` never skip change that commits late.
+    cursor.execute('''
+        CREATE FUNCTION record_tweet_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock(7001);
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (OLD.id, 'delete');
+                RETURN OLD;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'modify');
+            ELSE
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'create');
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER tweets_change_log
+        AFTER INSERT OR UPDATE OR DELETE ON tweets
+        FOR EACH ROW EXECUTE PROCEDURE record_tweet_change();
+    ''')
+    # changes for tweets that existed before change log
+    cursor.execute('''
+        INSERT INTO tweet_changes (tweet_id, op, changed_at)
+        SELECT id, 'create', modified_at FROM tweets ORDER BY modified_at, id;
+    ''')
+
+
+def downgrade(cursor):
+    cursor.execute('DROP TRIGGER tweets_change_log ON tweets;')
+    cursor.execute('DROP FUNCTION record_tweet_change();')
+    cursor.execute('DROP TABLE tweet_changes;')
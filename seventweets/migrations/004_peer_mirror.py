@@ -0,0 +1,35 @@
+
+"""
+peer mirror
+"""
+id = 4
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE peer_tweets (
+            peer TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            tweet VARCHAR(140),
+            type VARCHAR(32),
+            created_at TIMESTAMP NOT NULL,
+            modified_at TIMESTAMP NOT NULL,
+            reference TEXT,
+            PRIMARY KEY (peer, id)
+        );
+    ''')
+    cursor.execute('''
+        CREATE INDEX peer_tweets_created_at_idx ON peer_tweets (created_at);
+    ''')
+    cursor.execute('''
+        CREATE TABLE peer_sync (
+            peer TEXT PRIMARY KEY,
+            watermark TIMESTAMP,
+            synced_at TIMESTAMP NOT NULL
+        );
+    ''')
+
+
+def downgrade(cursor):
+    cursor.execute('DROP TABLE peer_sync;')
+    cursor.execute('DROP TABLE peer_tweets;')
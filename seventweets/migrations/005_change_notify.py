@@ -0,0 +1,54 @@
+
+"""
+change notify
+"""
+id = 5
+
+CHANNEL = 'tweet_changes'
+
+
+def upgrade(cursor):
+    # same as in 003, but also notifies listeners with sequence number of change
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION record_tweet_change() RETURNS trigger AS $$
+        DECLARE
+            change_seq BIGINT;
+        BEGIN
+            PERFORM pg_advisory_xact_lock(7001);
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (OLD.id, 'delete')
+                RETURNING seq INTO change_seq;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'modify')
+                RETURNING seq INTO change_seq;
+            ELSE
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'create')
+                RETURNING seq INTO change_seq;
+            END IF;
+            PERFORM pg_notify('{CHANNEL}', change_seq::text);
+            IF TG_OP = 'DELETE' THEN
+                RETURN OLD;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+
+
+def downgrade(cursor):
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION record_tweet_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock(7001);
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (OLD.id, 'delete');
+                RETURN OLD;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'modify');
+            ELSE
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'create');
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
@@ -0,0 +1,201 @@
+
+"""
+partition tweets
+
+Moves tweets into table partitioned by month of `created_at`, so date bounded
+queries only touch relevant partitions. Requires Postgres 11 or newer.
+Partitions for upcoming months are created by `create_tweet_partitions`
+function, which is called periodically by application.
+
+`upgrade` only creates empty `tweets_partitioned` table, application keeps
+using `tweets` while existing rows are copied by `backfill` in chunks, and
+writes made meanwhile are copied by trigger. The last backfill batch replaces
+`tweets` with partitioned table, holding lock only for renames.
+
+Primary key of partitioned table has to include partition key, so it is
+(id, created_at) and does not keep IDs unique on its own. IDs are kept
+unique by trigger storing them in `tweet_ids` table, so tweet with existing
+ID is rejected also when it is inserted with explicit ID (`import-tweets
+--keep-ids`, manual inserts).
+"""
+id = 6
+
+TWEET_COLUMNS = 'id, tweet, type, created_at, modified_at, reference'
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE tweets_partitioned (
+            id INTEGER NOT NULL DEFAULT nextval('tweets_id_seq'),
+            tweet VARCHAR(140),
+            created_at TIMESTAMP NOT NULL DEFAULT now(),
+            modified_at TIMESTAMP NOT NULL DEFAULT now(),
+            type VARCHAR(32) DEFAULT 'original' CHECK(type IN ('original', 'retweet')),
+            reference TEXT,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+    ''')
+    cursor.execute('CREATE INDEX tweets_created_at_idx ON tweets_partitioned (created_at);')
+    cursor.execute('CREATE TABLE tweets_default PARTITION OF tweets_partitioned DEFAULT;')
+
+    cursor.execute('CREATE TABLE tweet_ids (id INTEGER PRIMARY KEY);')
+    cursor.execute('''
+        CREATE FUNCTION track_tweet_id() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM tweet_ids WHERE id = OLD.id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO tweet_ids (id) VALUES (NEW.id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER tweets_unique_id
+        AFTER INSERT OR UPDATE OF id OR DELETE ON tweets_partitioned
+        FOR EACH ROW EXECUTE PROCEDURE track_tweet_id();
+    ''')
+
+    # creates monthly partitions from month of `start` until `months_ahead`
+    # months after current one, skipping existing ones
+    cursor.execute('''
+        CREATE FUNCTION create_tweet_partitions(start TIMESTAMP, months_ahead INTEGER)
+        RETURNS INTEGER AS $$
+        DECLARE
+            month TIMESTAMP := date_trunc('month', start);
+            last_month TIMESTAMP := date_trunc('month', now()) + make_interval(months => months_ahead);
+            partition_name TEXT;
+            -- until backfill swaps tables, partitioned one is tweets_partitioned
+            parent TEXT := COALESCE(to_regclass('tweets_partitioned')::text, 'tweets');
+            created INTEGER := 0;
+        BEGIN
+            WHILE month <= last_month LOOP
+                partition_name := 'tweets_' || to_char(month, 'YYYY_MM');
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE 'CREATE TABLE ' || quote_ident(partition_name)
+                        || ' PARTITION OF ' || parent || ' FOR VALUES FROM ('
+                        || quote_literal(month) || ') TO ('
+                        || quote_literal(month + interval '1 month') || ')';
+                    created := created + 1;
+                END IF;
+                month := month + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+    cursor.execute('''
+        SELECT create_tweet_partitions(COALESCE(min(created_at), now()), 3)
+        FROM tweets;
+    ''')
+
+    # copies writes to tweets made while backfill runs
+    cursor.execute(f'''
+        CREATE FUNCTION copy_tweet_to_partitioned() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (OLD.id, OLD.created_at) IS DISTINCT FROM (NEW.id, NEW.created_at) THEN
+                DELETE FROM tweets_partitioned WHERE id = OLD.id AND created_at = OLD.created_at;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO tweets_partitioned ({TWEET_COLUMNS})
+                VALUES (NEW.id, NEW.tweet, NEW.type, NEW.created_at, NEW.modified_at, NEW.reference)
+                ON CONFLICT (id, created_at) DO UPDATE SET
+                    tweet=EXCLUDED.tweet,
+                    type=EXCLUDED.type,
+                    modified_at=EXCLUDED.modified_at,
+                    reference=EXCLUDED.reference;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER tweets_copy_to_partitioned
+        AFTER INSERT OR UPDATE OR DELETE ON tweets
+        FOR EACH ROW EXECUTE PROCEDURE copy_tweet_to_partitioned();
+    ''')
+
+
+def backfill(cursor, after, limit):
+    # rows are locked, so they can not be changed or deleted between reading
+    # and copying them, after which the trigger copies their changes
+    cursor.execute(f'''
+        WITH batch AS (
+            SELECT {TWEET_COLUMNS} FROM tweets
+            WHERE id > %s ORDER BY id LIMIT %s
+            FOR SHARE
+        ), copied AS (
+            INSERT INTO tweets_partitioned ({TWEET_COLUMNS})
+            SELECT {TWEET_COLUMNS} FROM batch
+            ON CONFLICT (id, created_at) DO NOTHING
+        )
+        SELECT max(id) FROM batch;
+    ''', (after or 0, limit))
+    last = cursor.fetchone()[0]
+    if last is None:
+        _swap(cursor)
+    return last
+
+
+def _swap(cursor):
+    """
+    Replaces tweets with partitioned table, all rows are copied already.
+    """
+    cursor.execute('LOCK TABLE tweets IN ACCESS EXCLUSIVE MODE;')
+    cursor.execute('ALTER SEQUENCE tweets_id_seq OWNED BY tweets_partitioned.id;')
+    cursor.execute('DROP TABLE tweets;')
+    cursor.execute('DROP FUNCTION copy_tweet_to_partitioned();')
+    cursor.execute('ALTER TABLE tweets_partitioned RENAME TO tweets;')
+    cursor.execute('ALTER TABLE tweets RENAME CONSTRAINT tweets_partitioned_pkey TO tweets_pkey;')
+    cursor.execute('''
+        CREATE TRIGGER tweets_change_log
+        AFTER INSERT OR UPDATE OR DELETE ON tweets
+        FOR EACH ROW EXECUTE PROCEDURE record_tweet_change();
+    ''')
+
+
+def _drop_unique_ids(cursor):
+    cursor.execute('DROP TRIGGER tweets_unique_id ON tweets_partitioned;')
+    cursor.execute('DROP FUNCTION track_tweet_id();')
+    cursor.execute('DROP TABLE tweet_ids;')
+
+
+def downgrade(cursor):
+    cursor.execute("SELECT to_regclass('tweets_partitioned');")
+    if cursor.fetchone()[0] is not None:
+        # backfill did not finish, tweets is still the original table
+        cursor.execute('DROP TRIGGER tweets_copy_to_partitioned ON tweets;')
+        cursor.execute('DROP FUNCTION copy_tweet_to_partitioned();')
+        _drop_unique_ids(cursor)
+        cursor.execute('DROP TABLE tweets_partitioned;')
+        cursor.execute('DROP FUNCTION create_tweet_partitions(TIMESTAMP, INTEGER);')
+        return
+
+    cursor.execute('DROP TRIGGER tweets_change_log ON tweets;')
+    cursor.execute('ALTER TABLE tweets RENAME TO tweets_partitioned;')
+    cursor.execute('ALTER TABLE tweets_partitioned RENAME CONSTRAINT tweets_pkey TO tweets_partitioned_pkey;')
+    _drop_unique_ids(cursor)
+    cursor.execute('''
+        CREATE TABLE tweets (
+            id INTEGER PRIMARY KEY DEFAULT nextval('tweets_id_seq'),
+            tweet VARCHAR(140),
+            created_at TIMESTAMP NOT NULL DEFAULT now(),
+            modified_at TIMESTAMP NOT NULL DEFAULT now(),
+            type VARCHAR(32) DEFAULT 'original' CHECK(type IN ('original', 'retweet')),
+            reference TEXT
+        );
+    ''')
+    cursor.execute('ALTER SEQUENCE tweets_id_seq OWNED BY tweets.id;')
+    cursor.execute(f'''
+        INSERT INTO tweets ({TWEET_COLUMNS})
+        SELECT {TWEET_COLUMNS} FROM tweets_partitioned;
+    ''')
+    cursor.execute('DROP TABLE tweets_partitioned;')
+    cursor.execute('DROP FUNCTION create_tweet_partitions(TIMESTAMP, INTEGER);')
+    cursor.execute('''
+        CREATE TRIGGER tweets_change_log
+        AFTER INSERT OR UPDATE OR DELETE ON tweets
+        FOR EACH ROW EXECUTE PROCEDURE record_tweet_change();
+    ''')
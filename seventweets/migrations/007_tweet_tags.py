@@ -0,0 +1,52 @@
+"""
+tweet tags
+
+Hashtags and mentions of tweets, so tweets with tag and trending tags are
+found with index instead of scanning content of all tweets. Tags of new and
+modified tweets are written by `Operations` in the same transaction as tweet,
+tags of existing tweets are extracted by backfill.
+"""
+id = 7
+
+batch_size = 5000
+
+# same as `seventweets.db.TAG_PATTERN`
+TAG_PATTERN = r'(?<!\w)([#@])(\w+)'
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE tweet_tags (
+            tweet_id INTEGER NOT NULL,
+            kind VARCHAR(8) NOT NULL CHECK(kind IN ('hashtag', 'mention')),
+            tag VARCHAR(140) NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (tweet_id, kind, tag)
+        );
+    ''')
+    cursor.execute('CREATE INDEX tweet_tags_tag_idx ON tweet_tags (kind, tag, created_at);')
+    cursor.execute('CREATE INDEX tweet_tags_created_at_idx ON tweet_tags (kind, created_at);')
+
+
+def backfill(cursor, after, limit):
+    cursor.execute('''
+        SELECT max(id) FROM (
+            SELECT id FROM tweets WHERE id > %s ORDER BY id LIMIT %s
+        ) batch;
+    ''', (after or 0, limit))
+    last = cursor.fetchone()[0]
+    if last is None:
+        return None
+    cursor.execute('''
+        INSERT INTO tweet_tags (tweet_id, kind, tag, created_at)
+        SELECT DISTINCT t.id, CASE m[1] WHEN '#' THEN 'hashtag' ELSE 'mention' END,
+               lower(m[2]), t.created_at
+        FROM tweets t, regexp_matches(t.tweet, %s, 'g') AS m
+        WHERE t.id > %s AND t.id <= %s
+        ON CONFLICT DO NOTHING;
+    ''', (TAG_PATTERN, after or 0, last))
+    return last
+
+
+def downgrade(cursor):
+    cursor.execute('DROP TABLE tweet_tags;')
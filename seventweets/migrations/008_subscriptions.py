@@ -0,0 +1,21 @@
+"""
+subscriptions
+
+Callback addresses of nodes subscribed to changes of tweets, which are pushed
+to them by `seventweets.push`.
+"""
+id = 8
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE subscriptions (
+            id SERIAL PRIMARY KEY,
+            callback TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+    ''')
+
+
+def downgrade(cursor):
+    cursor.execute('DROP TABLE subscriptions;')
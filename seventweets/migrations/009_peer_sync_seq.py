@@ -0,0 +1,15 @@
+"""
+peer sync seq
+
+Sequence number of the last change of peer applied to mirror, so mirror is
+synced from change feed of peer, including deletions.
+"""
+id = 9
+
+
+def upgrade(cursor):
+    cursor.execute('ALTER TABLE peer_sync ADD COLUMN seq BIGINT;')
+
+
+def downgrade(cursor):
+    cursor.execute('ALTER TABLE peer_sync DROP COLUMN seq;')
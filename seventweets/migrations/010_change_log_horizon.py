@@ -0,0 +1,77 @@
+"""
+change log horizon
+
+Replaces global advisory lock of change log trigger, which serialized all
+writes to tweets until commit. Transaction writing changes holds shared
+advisory lock keyed by sequence number lower than any it gets, until commit.
+Readers of change log expose only sequence numbers below the lowest key held
+(see `pg.change_horizon`), so change committed late is never skipped, while
+writers do not wait for each other.
+
+Lock uses two key form, (key >> 31, key & 0x7fffffff), so it is listed in
+`pg_locks` with `objsubid = 2`, apart from single key locks like the one of
+migrations.
+"""
+id = 10
+
+CHANNEL = 'tweet_changes'
+
+
+def upgrade(cursor):
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION record_tweet_change() RETURNS trigger AS $$
+        DECLARE
+            change_seq BIGINT;
+            horizon BIGINT;
+        BEGIN
+            IF COALESCE(current_setting('seventweets.change_horizon', true), '') = '' THEN
+                -- sequence numbers this transaction gets are all above horizon
+                SELECT last_value INTO horizon FROM tweet_changes_seq_seq;
+                PERFORM pg_advisory_xact_lock_shared((horizon >> 31)::int, (horizon & 2147483647)::int);
+                PERFORM set_config('seventweets.change_horizon', horizon::text, true);
+            END IF;
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (OLD.id, 'delete')
+                RETURNING seq INTO change_seq;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'modify')
+                RETURNING seq INTO change_seq;
+            ELSE
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'create')
+                RETURNING seq INTO change_seq;
+            END IF;
+            PERFORM pg_notify('{CHANNEL}', change_seq::text);
+            IF TG_OP = 'DELETE' THEN
+                RETURN OLD;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+
+
+def downgrade(cursor):
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION record_tweet_change() RETURNS trigger AS $$
+        DECLARE
+            change_seq BIGINT;
+        BEGIN
+            PERFORM pg_advisory_xact_lock(7001);
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (OLD.id, 'delete')
+                RETURNING seq INTO change_seq;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'modify')
+                RETURNING seq INTO change_seq;
+            ELSE
+                INSERT INTO tweet_changes (tweet_id, op) VALUES (NEW.id, 'create')
+                RETURNING seq INTO change_seq;
+            END IF;
+            PERFORM pg_notify('{CHANNEL}', change_seq::text);
+            IF TG_OP = 'DELETE' THEN
+                RETURN OLD;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
@@ -0,0 +1,95 @@
+"""
+partition default rows
+
+Tweets created in month without partition go to `tweets_default`, after
+which creating partition of that month failed, since default partition
+would contain rows belonging to it. `create_tweet_partitions` now moves such
+rows to new partition before attaching it. Moved rows keep their change log
+entries and IDs, so triggers of default partition are disabled while rows
+are moved.
+
+Function also holds transaction level advisory lock, so concurrent callers
+(maintenance of several workers) do not race to create the same partition.
+"""
+id = 11
+
+LOCK_KEY = 7002
+
+
+def upgrade(cursor):
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION create_tweet_partitions(start TIMESTAMP, months_ahead INTEGER)
+        RETURNS INTEGER AS $$
+        DECLARE
+            month TIMESTAMP := date_trunc('month', start);
+            last_month TIMESTAMP := date_trunc('month', now()) + make_interval(months => months_ahead);
+            partition_name TEXT;
+            parent TEXT;
+            created INTEGER := 0;
+            moved BIGINT;
+        BEGIN
+            PERFORM pg_advisory_xact_lock({LOCK_KEY});
+            -- until backfill swaps tables, partitioned one is tweets_partitioned
+            parent := COALESCE(to_regclass('tweets_partitioned')::text, 'tweets');
+            WHILE month <= last_month LOOP
+                partition_name := 'tweets_' || to_char(month, 'YYYY_MM');
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE 'CREATE TABLE ' || quote_ident(partition_name) || ' (LIKE ' || parent
+                        || ' INCLUDING DEFAULTS INCLUDING CONSTRAINTS)';
+                    PERFORM 1 FROM tweets_default
+                    WHERE created_at >= month AND created_at < month + interval '1 month'
+                    LIMIT 1;
+                    IF FOUND THEN
+                        ALTER TABLE tweets_default DISABLE TRIGGER USER;
+                        EXECUTE format('
+                            WITH moved AS (
+                                DELETE FROM tweets_default
+                                WHERE created_at >= $1 AND created_at < $2
+                                RETURNING *
+                            )
+                            INSERT INTO %I SELECT * FROM moved
+                        ', partition_name) USING month, month + interval '1 month';
+                        GET DIAGNOSTICS moved = ROW_COUNT;
+                        ALTER TABLE tweets_default ENABLE TRIGGER USER;
+                        RAISE NOTICE 'Moved % rows from tweets_default to %.', moved, partition_name;
+                    END IF;
+                    EXECUTE 'ALTER TABLE ' || parent || ' ATTACH PARTITION ' || quote_ident(partition_name)
+                        || ' FOR VALUES FROM (' || quote_literal(month) || ') TO ('
+                        || quote_literal(month + interval '1 month') || ')';
+                    created := created + 1;
+                END IF;
+                month := month + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+
+
+def downgrade(cursor):
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION create_tweet_partitions(start TIMESTAMP, months_ahead INTEGER)
+        RETURNS INTEGER AS $$
+        DECLARE
+            month TIMESTAMP := date_trunc('month', start);
+            last_month TIMESTAMP := date_trunc('month', now()) + make_interval(months => months_ahead);
+            partition_name TEXT;
+            -- until backfill swaps tables, partitioned one is tweets_partitioned
+            parent TEXT := COALESCE(to_regclass('tweets_partitioned')::text, 'tweets');
+            created INTEGER := 0;
+        BEGIN
+            WHILE month <= last_month LOOP
+                partition_name := 'tweets_' || to_char(month, 'YYYY_MM');
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE 'CREATE TABLE ' || quote_ident(partition_name)
+                        || ' PARTITION OF ' || parent || ' FOR VALUES FROM ('
+                        || quote_literal(month) || ') TO ('
+                        || quote_literal(month + interval '1 month') || ')';
+                    created := created + 1;
+                END IF;
+                month := month + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
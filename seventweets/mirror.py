@@ -0,0 +1,214 @@
+"""
+Local mirror of tweets from peer nodes.
+
+When `ST_MIRROR_PEERS` is configured, node periodically pulls tweets from
+each peer into local storage, so searches over all nodes are served from
+local indexes without peers having to be online. Pulls are incremental, from
+change feed of peer (`/tweets/changes`): each peer has sequence number of the
+last change applied, and only changes after it are requested, so tweets
+deleted on peer are removed from mirror too. Changes are pulled in pages of
+`CHANGES_PAGE`, each page is applied in single transaction together with its
+sequence number, so sync interrupted in the middle resumes where it stopped.
+
+Peers without change feed are synced by pulling tweets modified after the
+latest modification time seen (watermark), which can not see deletions.
+
+Workers of node share storage, so periodic sync is done by single worker,
+which holds lock on storage (Postgres advisory lock, or lock file next to
+SQLite database). Lock is released when its holder exits, after which the
+next worker to run sync takes over. Memory and log storage are used by
+single process, so there is nothing to elect.
+"""
+import time
+import fcntl
+import logging
+from datetime import datetime
+from functools import partial
+from typing import List, Dict, Optional
+
+from flask import current_app
+
+from seventweets import tweet, wire
+from seventweets.client import get_client
+from seventweets.db import get_db, get_ops, get_connection, default_backend
+
+logger = logging.getLogger(__name__)
+
+# number of changes requested from peer at once, max allowed by change feed
+CHANGES_PAGE = 1000
+# key of Postgres advisory lock held by worker which syncs mirror
+LOCK_KEY = 7003
+
+# lock held by this process if it syncs mirror, connection or open file
+_lock = None
+
+
+def peers() -> List[str]:
+    """
+    Returns addresses of peers to mirror, from `ST_MIRROR_PEERS` config,
+    which is comma separated list of base URLs.
+    """
+    configured = current_app.config['ST_MIRROR_PEERS'] or ''
+    return [p.strip().rstrip('/') for p in configured.split(',') if p.strip()]
+
+
+def enabled() -> bool:
+    return len(peers()) > 0
+
+
+def _get(url: str, params: dict):
+    return get_client().get(url, params=params, headers={'Accept': wire.accept_header()},
+                            timeout=float(current_app.config['ST_MIRROR_TIMEOUT']))
+
+
+def _loads(resp):
+    if resp.headers.get('Content-Type', '').startswith(wire.MSGPACK_TYPES):
+        return wire.loads_msgpack(resp.content)
+    return resp.json()
+
+
+def sync_peer(peer: str, seq: Optional[int]=None, watermark: Optional[datetime]=None) -> int:
+    """
+    Pulls changes after sequence number from change feed of peer and applies
+    them to mirror. Falls back to `sync_peer_modified` if peer has no change
+    feed.
+
+    :param peer: Base address of peer node.
+    :param seq: Sequence number of the last change already applied, None if
+        peer was never synced from change feed.
+    :param watermark: Latest modification time already mirrored.
+    :return: Number of changes pulled.
+    """
+    since = seq or 0
+    synced_at = datetime.utcnow()
+    count = 0
+    while True:
+        resp = _get(f'{peer}/tweets/changes', {'since': since, 'limit': CHANGES_PAGE})
+        if resp.status_code == 404 and count == 0:
+            return sync_peer_modified(peer, watermark)
+        resp.raise_for_status()
+        data = _loads(resp)
+        changes = data['changes']
+        # change holds current state of tweet, so the last change of tweet
+        # in page decides if it is stored or removed
+        tweets, deleted = {}, set()
+        for change in changes:
+            if change['op'] == 'delete' or change['tweet'] is None:
+                tweets.pop(change['id'], None)
+                deleted.add(change['id'])
+            else:
+                deleted.discard(change['id'])
+                tweets[change['id']] = tweet.Tweet.from_dict(change['tweet']).to_row()
+        since = data['last_seq']
+        get_db().do(partial(get_ops().apply_peer_changes, peer, list(tweets.values()),
+                            sorted(deleted), since, synced_at))
+        count += len(changes)
+        if len(changes) < CHANGES_PAGE:
+            return count
+
+
+def sync_peer_modified(peer: str, watermark: Optional[datetime]=None) -> int:
+    """
+    Pulls tweets modified after watermark from peer and stores them in mirror.
+    Used for peers without change feed, tweets deleted on them stay in mirror.
+
+    Peers expose modification time with one second precision, so one second
+    before watermark is requested. Overlapping tweets are simply overwritten.
+
+    :param peer: Base address of peer node.
+    :param watermark: Latest modification time already mirrored.
+    :return: Number of tweets pulled.
+    """
+    params = {}
+    if watermark is not None:
+        params['modified_from'] = int(watermark.timestamp()) - 1
+    synced_at = datetime.utcnow()
+    resp = _get(f'{peer}/tweets/search', params)
+    resp.raise_for_status()
+    rows = [tweet.Tweet.from_dict(t).to_row() for t in _loads(resp)]
+    get_db().do(partial(get_ops().upsert_peer_tweets, peer, rows, synced_at))
+    return len(rows)
+
+
+def sync_all():
+    """
+    Pulls new tweets from all configured peers. Failure of one peer does not
+    affect others, its data just stays stale until next successful sync.
+    """
+    state = {p: (seq, w) for p, w, _, seq in get_db().do(get_ops().get_peer_sync)}
+    for peer in peers():
+        start = time.perf_counter()
+        try:
+            count = sync_peer(peer, *state.get(peer, (None, None)))
+            logger.info('Mirrored %d changes from %s in %.3fs.', count, peer, time.perf_counter() - start)
+        except Exception:
+            logger.warning('Failed to mirror tweets from %s.', peer, exc_info=True)
+
+
+def freshness() -> Dict[str, Optional[float]]:
+    """
+    Returns age in seconds of mirrored data for each configured peer.
+    Peers that were never synced have age of None.
+    """
+    now = datetime.utcnow()
+    synced = {p: s for p, _, s, _ in get_db().do(get_ops().get_peer_sync)}
+    return {
+        peer: (now - synced[peer]).total_seconds() if peer in synced else None
+        for peer in peers()
+    }
+
+
+def _try_lock(cursor) -> bool:
+    cursor.execute('SELECT pg_try_advisory_lock(%s);', (LOCK_KEY,))
+    return cursor.fetchone()[0]
+
+
+def is_leader() -> bool:
+    """
+    Checks if this worker syncs mirror, taking the lock if it is free.
+    """
+    global _lock
+    if default_backend in ('memory', 'log'):
+        return True
+    if default_backend == 'sqlite':
+        if _lock is None:
+            f = open(current_app.config['ST_SQLITE_PATH'] + '.mirror-lock', 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            _lock = f
+        return True
+
+    # session level lock lives as long as its connection
+    if _lock is not None:
+        try:
+            _lock.do(lambda cursor: cursor.execute('SELECT 1;'))
+            return True
+        except Exception:
+            logger.warning('Lost connection holding mirror lock.', exc_info=True)
+            _lock.cleanup()
+            _lock = None
+    connection = get_connection('pg')
+    if connection.do(_try_lock):
+        _lock = connection
+        return True
+    connection.cleanup()
+    return False
+
+
+def _sync_if_leader():
+    if is_leader():
+        sync_all()
+
+
+def start(app):
+    """
+    Schedules sync of mirror on background executor every
+    `ST_MIRROR_INTERVAL` seconds, first sync is right away. Only the worker
+    holding lock of mirror (see `is_leader`) syncs it.
+
+    :param app: Flask application with executor.
+    """
+    app.extensions['executor'].schedule('mirror', _sync_if_leader, float(app.config['ST_MIRROR_INTERVAL']))
@@ -0,0 +1,296 @@
+"""
+On-demand profiling of live worker.
+
+`Profiler` profiles requests with cProfile while profiling session is active.
+Session is started through admin endpoint and ends after given number of
+requests or seconds. Only one request is profiled at a time, since
+interpreter supports single active profiler, so requests arriving meanwhile
+are served normally and are not counted. Call stacks of profiled request are
+also sampled in background thread, which gives collapsed stacks for flame
+graphs.
+
+Memory is inspected with tracemalloc snapshots, each compared to the previous
+one, and with counts of live objects by type.
+
+Everything is per worker process. Endpoints and request hooks exist only if
+`ST_PROFILING` is enabled, so there is no overhead otherwise.
+"""
+import io
+import gc
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Optional, List
+
+from flask import request
+
+from seventweets.exception import Conflict, NotFound, BadRequest
+
+SORT_KEYS = ('cumulative', 'tottime', 'calls', 'ncalls', 'time')
+SNAPSHOT_KEYS = ('lineno', 'filename', 'traceback')
+# frames deeper than this are cut off from sampled stacks
+MAX_STACK_DEPTH = 128
+
+
+class Sampler:
+    """
+    Samples call stack of single thread at fixed interval.
+    """
+
+    def __init__(self, ident: int, interval: float):
+        self.ident = ident
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='seventweets-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+class Session:
+    """
+    Profile of requests collected since session was started.
+    """
+
+    def __init__(self, max_requests: int, seconds: float):
+        """
+        :param max_requests: Number of requests to profile, 0 is unlimited.
+        :param seconds: Duration of session, 0 is unlimited.
+        """
+        self.max_requests = max_requests
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.requests = 0
+        self.stats: Optional[pstats.Stats] = None
+        self.samples = Counter()
+        self.finished = threading.Event()
+
+    def expired(self) -> bool:
+        return bool(self.seconds) and time.monotonic() - self.started >= self.seconds
+
+    def add(self, profile: cProfile.Profile, samples: Counter):
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+        self.samples.update(samples)
+        self.requests += 1
+        if self.max_requests and self.requests >= self.max_requests:
+            self.finished.set()
+
+    def state(self) -> dict:
+        return {
+            'state': 'finished' if self.finished.is_set() else 'running',
+            'requests': self.requests,
+            'max_requests': self.max_requests,
+            'seconds': self.seconds,
+            'elapsed': time.monotonic() - self.started,
+            'pid': os.getpid(),
+        }
+
+
+class Profiler:
+    """
+    Profiling sessions and memory snapshots of single worker process.
+    """
+
+    def __init__(self, sample_interval: float):
+        """
+        :param sample_interval: Seconds between samples of call stack.
+        """
+        self.sample_interval = sample_interval
+        self.session: Optional[Session] = None
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self._local = threading.local()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def start(self, max_requests: int, seconds: float) -> Session:
+        """
+        Starts profiling session.
+
+        :raises Conflict: If session is already running.
+        """
+        if not max_requests and not seconds:
+            raise BadRequest('Either number of requests or seconds has to be provided.')
+        with self._lock:
+            if self.session is not None and not self._finish_expired(self.session):
+                raise Conflict('Profiling session is already running.')
+            self.session = Session(max_requests, seconds)
+            return self.session
+
+    def stop(self) -> Session:
+        session = self.current()
+        session.finished.set()
+        return session
+
+    def current(self) -> Session:
+        """
+        Returns the latest session.
+
+        :raises NotFound: If profiling was never started.
+        """
+        session = self.session
+        if session is None:
+            raise NotFound('No profiling session was started.')
+        self._finish_expired(session)
+        return session
+
+    def wait(self, timeout: float) -> Session:
+        """
+        Waits until the latest session finishes, at most `timeout` seconds.
+        """
+        session = self.current()
+        if session.seconds:
+            timeout = min(timeout, max(0, session.seconds - (time.monotonic() - session.started)))
+        session.finished.wait(timeout)
+        self._finish_expired(session)
+        return session
+
+    @staticmethod
+    def _finish_expired(session: Session) -> bool:
+        """
+        Finishes session if its time ran out, returns if session is finished.
+        """
+        if session.expired():
+            session.finished.set()
+        return session.finished.is_set()
+
+    def before_request(self):
+        session = self.session
+        if session is None or session.finished.is_set() or request.blueprint == 'admin':
+            return
+        if self._finish_expired(session):
+            return
+        if not self._busy.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        sampler = Sampler(threading.get_ident(), self.sample_interval)
+        self._local.current = (session, profile, sampler)
+        sampler.start()
+        profile.enable()
+
+    def teardown_request(self, exc=None):
+        current = getattr(self._local, 'current', None)
+        if current is None:
+            return
+        self._local.current = None
+        session, profile, sampler = current
+        profile.disable()
+        sampler.stop()
+        self._busy.release()
+        with self._lock:
+            if not session.finished.is_set():
+                session.add(profile, sampler.samples)
+
+    def report(self, fmt: str, sort: str='cumulative', limit: int=50) -> str:
+        """
+        Returns profile of the latest session.
+
+        :param fmt: 'pstats' for table of functions, 'collapsed' for sampled
+            stacks in format of flame graph tools.
+        :param sort: Sort key of pstats table.
+        :param limit: Max number of functions in pstats table.
+        """
+        session = self.current()
+        with self._lock:
+            if fmt == 'collapsed':
+                return ''.join(f'{stack} {count}\n' for stack, count in session.samples.most_common())
+            if sort not in SORT_KEYS:
+                raise BadRequest(f'Invalid sort: {sort}, expected one of {SORT_KEYS}.')
+            if session.stats is None:
+                return 'No requests were profiled.\n'
+            out = io.StringIO()
+            session.stats.stream = out
+            session.stats.sort_stats(sort).print_stats(limit)
+            return out.getvalue()
+
+    def start_tracing(self, frames: int):
+        """
+        Starts tracing memory allocations, keeping `frames` frames of
+        traceback of each allocation.
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._snapshot = None
+
+    def stop_tracing(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._snapshot = None
+
+    def snapshot(self, key: str='lineno', limit: int=20, include: Optional[str]=None) -> dict:
+        """
+        Takes snapshot of traced memory and compares it to the previous one.
+
+        :param key: Grouping of allocations, one of `SNAPSHOT_KEYS`.
+        :param limit: Max number of entries in top list and diff.
+        :param include: Filename pattern of allocations to include, for
+            example `*seventweets/tweet.py`.
+        """
+        if key not in SNAPSHOT_KEYS:
+            raise BadRequest(f'Invalid key: {key}, expected one of {SNAPSHOT_KEYS}.')
+        if not tracemalloc.is_tracing():
+            raise Conflict('Memory tracing is not started.')
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ]
+        if include:
+            filters.append(tracemalloc.Filter(True, include, all_frames=True))
+        snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+        with self._lock:
+            previous, self._snapshot = self._snapshot, snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        diff = None
+        if previous is not None:
+            diff = [
+                {'where': _where(s.traceback, key), 'size': s.size, 'size_diff': s.size_diff,
+                 'count': s.count, 'count_diff': s.count_diff}
+                for s in snapshot.compare_to(previous, key)[:limit]
+            ]
+        return {
+            'pid': os.getpid(),
+            'traced': {'current': current, 'peak': peak},
+            'top': [{'where': _where(s.traceback, key), 'size': s.size, 'count': s.count}
+                    for s in snapshot.statistics(key)[:limit]],
+            'diff': diff,
+        }
+
+
+def _where(traceback: tracemalloc.Traceback, key: str):
+    if key == 'traceback':
+        return traceback.format()
+    frame = traceback[0]
+    return frame.filename if key == 'filename' else f'{frame.filename}:{frame.lineno}'
+
+
+def object_counts(limit: int=30) -> List[dict]:
+    """
+    Returns numbers of live objects tracked by garbage collector, by type,
+    most common first.
+    """
+    counts = Counter(type(o).__qualname__ for o in gc.get_objects())
+    return [{'type': t, 'count': c} for t, c in counts.most_common(limit)]
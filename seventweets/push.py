@@ -0,0 +1,402 @@
+"""
+Push delivery of tweet changes to subscribed nodes.
+
+Nodes subscribe with callback address (`POST /subscriptions`), which is
+stored in database, so all workers see it. Creations, modifications, deletions
+and retweets are published as events to `Pusher` of the worker that made
+them. Every `ST_PUSH_DELAY` seconds collected events are appended to outbox
+of each subscriber, so burst of writes is sent in few requests instead of one
+request per write. All of it runs on background executor, requests only
+append event to list. When worker shuts down, collected events are flushed
+right away, so their deliveries are finished by drain of executor.
+
+Every subscriber has at most one delivery in flight, so events arrive in
+order they were published by the worker. Batch of at most `ST_PUSH_BATCH`
+events is sent as JSON in POST request::
+
+    {"server": {"name": ..., "address": ...},
+     "events": [{"op": "create", "id": 1, "changed_at": ..., "tweet": {...}}],
+     "dropped": 0}
+
+Failed delivery is retried with exponential backoff, other subscribers are
+not affected. Subscriber failing for `ST_PUSH_EVICT_AFTER` seconds is
+unsubscribed. Outbox holds at most `ST_PUSH_MAX_PENDING` events, oldest are
+dropped when it is full and their number is sent in `dropped`, so subscriber
+knows it has to pull changes to catch up.
+
+Callback has to resolve to public address, unless `ST_PUSH_ALLOW_PRIVATE`
+is set, so subscription can not make node send requests to its own network
+(loopback, cloud metadata service, private hosts). Address is checked again
+before every delivery, since DNS record can change after subscribing, and
+request is sent to the checked address instead of resolving host name again,
+so record changed right after the check can not point delivery elsewhere.
+TLS certificate is still verified for host name of callback. Redirects are
+not followed, response with 3xx status is failed delivery.
+
+State of delivery is per worker process and is lost on restart, pushing is
+best effort and subscribers should pull `/tweets/changes` after being down.
+"""
+import time
+import socket
+import logging
+import ipaddress
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+from functools import partial
+from typing import Optional, Dict, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, json
+
+from seventweets.db import get_db, get_ops
+from seventweets.utils import as_bool
+
+logger = logging.getLogger(__name__)
+
+CREATE = 'create'
+MODIFY = 'modify'
+DELETE = 'delete'
+RETWEET = 'retweet'
+
+# max length of callback address
+MAX_CALLBACK_LENGTH = 2048
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+def check_callback(callback: str, allow_private: bool=False) -> Optional[IPAddress]:
+    """
+    Checks that callback is http or https URL of public address.
+
+    :param callback: URL changes are sent to.
+    :param allow_private: If addresses of non-public networks are allowed.
+    :return: Checked address callback resolves to, None if private addresses
+        are allowed, then host name is not resolved.
+    :raises ValueError: If callback is not valid or resolves to address of
+        private, loopback, link-local or other non-public network.
+    """
+    try:
+        url = urlsplit(callback)
+        port = url.port or (443 if url.scheme == 'https' else 80)
+    except ValueError:
+        raise ValueError('expected http or https URL')
+    if url.scheme not in ('http', 'https') or not url.hostname or len(callback) > MAX_CALLBACK_LENGTH:
+        raise ValueError('expected http or https URL')
+    if allow_private:
+        return None
+    try:
+        infos = socket.getaddrinfo(url.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f'can not resolve {url.hostname}')
+    addresses = []
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f'{url.hostname} resolves to non-public address {address}')
+        addresses.append(address)
+    return addresses[0]
+
+
+def pin_address(callback: str, address: IPAddress) -> Tuple[str, dict]:
+    """
+    Replaces host name of callback with address it was checked to resolve to.
+
+    :return: URL with address and headers with original `Host`.
+    """
+    url = urlsplit(callback)
+    userinfo, _, host = url.netloc.rpartition('@')
+    pinned = f'[{address}]' if address.version == 6 else str(address)
+    if url.port:
+        pinned = f'{pinned}:{url.port}'
+    if userinfo:
+        pinned = f'{userinfo}@{pinned}'
+    return urlunsplit(url._replace(netloc=pinned)), {'Host': host}
+
+
+class PinnedAdapter(HTTPAdapter):
+    """
+    Adapter for https URLs with pinned address, which sends host name in SNI
+    and verifies certificate for it instead of address.
+    """
+
+    def __init__(self, hostname: str, **kwargs):
+        self.hostname = hostname
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['server_hostname'] = self.hostname
+        kwargs['assert_hostname'] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+
+def pinned_session(hostname: str) -> requests.Session:
+    """
+    Creates session for deliveries to single subscriber, so its pinned
+    address does not share connections with other host names.
+    """
+    session = requests.Session()
+    session.mount('https://', PinnedAdapter(hostname, pool_connections=1, pool_maxsize=1))
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    return session
+
+
+class Subscriber:
+    """
+    Delivery state of single subscription.
+    """
+
+    def __init__(self, id_: int, callback: str):
+        self.id = id_
+        self.callback = callback
+        # (sequence number, event) not delivered yet
+        self.outbox = deque()
+        # events dropped from full outbox, not reported to subscriber yet
+        self.dropped = 0
+        self.failures = 0
+        self.failing_since: Optional[float] = None
+        # if delivery job is queued, running or waiting for backoff
+        self.scheduled = False
+        self.delivered = 0
+        # created by the first delivery, used only by delivery in flight
+        self.session: Optional[requests.Session] = None
+
+    def add(self, events, max_pending: int):
+        self.outbox.extend(events)
+        while len(self.outbox) > max_pending:
+            self.outbox.popleft()
+            self.dropped += 1
+
+    def state(self) -> dict:
+        return {
+            'id': self.id,
+            'callback': self.callback,
+            'pending': len(self.outbox),
+            'dropped': self.dropped,
+            'delivered': self.delivered,
+            'failures': self.failures,
+        }
+
+
+class Pusher:
+    """
+    Batches published events and delivers them to subscribers on executor.
+    """
+
+    def __init__(self, executor, delay: float, batch_size: int, max_pending: int, backoff: float,
+                 max_backoff: float, evict_after: float, timeout: float, allow_private: bool=False):
+        """
+        :param executor: Executor running flushes and deliveries.
+        :param delay: Seconds events are collected before they are flushed to outboxes.
+        :param batch_size: Max number of events sent in one request.
+        :param max_pending: Max number of undelivered events per subscriber.
+        :param backoff: Seconds before first retry of failed delivery, doubled with every next one.
+        :param max_backoff: Max seconds between retries.
+        :param evict_after: Seconds of failing deliveries after which subscriber is removed.
+        :param timeout: Timeout of delivery request in seconds.
+        :param allow_private: If callbacks can be on non-public networks.
+        """
+        self.executor = executor
+        self.delay = delay
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.evict_after = evict_after
+        self.timeout = timeout
+        self.allow_private = allow_private
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._pending = deque()
+        self._pending_dropped = 0
+        self._started = False
+        self._subscribers: Dict[int, Subscriber] = {}
+        self.published = 0
+        self.delivered = 0
+        self.failed = 0
+        self.evicted = 0
+
+    def publish(self, event: dict):
+        """
+        Adds event to be delivered to all subscribers. Periodic flush is
+        started by the first event, so processes that never write (CLI
+        commands) do not run it.
+        """
+        with self._lock:
+            self._pending.append((next(self._seq), event))
+            self.published += 1
+            if len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self._pending_dropped += 1
+            if self._started:
+                return
+            self._started = True
+        self.executor.schedule('push flush', self.flush, self.delay, delay=self.delay)
+
+    def flush(self):
+        """
+        Moves published events to outboxes of current subscribers and
+        schedules delivery to those that are not being delivered to already.
+        """
+        with self._lock:
+            events, self._pending = self._pending, deque()
+            dropped, self._pending_dropped = self._pending_dropped, 0
+        if not events:
+            return
+        subscriptions = get_db().do(get_ops().get_subscriptions)
+        ready = []
+        with self._lock:
+            live = {id_ for id_, _, _ in subscriptions}
+            for id_ in [i for i in self._subscribers if i not in live]:
+                del self._subscribers[id_]
+            for id_, callback, _ in subscriptions:
+                sub = self._subscribers.get(id_)
+                if sub is None:
+                    sub = self._subscribers[id_] = Subscriber(id_, callback)
+                sub.dropped += dropped
+                sub.add(events, self.max_pending)
+                if not sub.scheduled:
+                    sub.scheduled = True
+                    ready.append(sub)
+        for sub in ready:
+            self._schedule(sub, 0)
+
+    def _schedule(self, sub: Subscriber, delay: float):
+        if not self.executor.submit(self._deliver, sub, name=f'push {sub.callback}', retries=0,
+                                    delay=delay):
+            # events stay in outbox, delivery is scheduled again by next flush
+            with self._lock:
+                sub.scheduled = False
+
+    def _deliver(self, sub: Subscriber):
+        """
+        Sends the oldest events of outbox to subscriber. Delivery is
+        scheduled again while there are events left in outbox.
+        """
+        with self._lock:
+            if self._subscribers.get(sub.id) is not sub:
+                return
+            batch = list(itertools.islice(sub.outbox, self.batch_size))
+            dropped = sub.dropped
+            if not batch and not dropped:
+                sub.scheduled = False
+                return
+        payload = {
+            'server': {
+                'name': current_app.config['ST_OWN_NAME'],
+                'address': current_app.config['ST_OWN_ADDRESS'],
+            },
+            'events': [event for _, event in batch],
+            'dropped': dropped,
+        }
+        try:
+            address = check_callback(sub.callback, self.allow_private)
+            url, headers = sub.callback, {}
+            if address is not None:
+                url, headers = pin_address(sub.callback, address)
+            if sub.session is None:
+                sub.session = pinned_session(urlsplit(sub.callback).hostname)
+            headers['Content-Type'] = 'application/json'
+            with sub.session.post(url, data=json.dumps(payload), headers=headers,
+                                  timeout=self.timeout, allow_redirects=False) as resp:
+                if 300 <= resp.status_code < 400:
+                    raise requests.HTTPError(f'Callback redirected with {resp.status_code}.',
+                                             response=resp)
+                resp.raise_for_status()
+        except (requests.RequestException, ValueError):
+            self._failed(sub)
+            return
+        with self._lock:
+            # outbox could be trimmed meanwhile, so delivered events are
+            # found by sequence number instead of position
+            last = batch[-1][0] if batch else 0
+            while sub.outbox and sub.outbox[0][0] <= last:
+                sub.outbox.popleft()
+            sub.dropped -= dropped
+            sub.delivered += len(batch)
+            sub.failures = 0
+            sub.failing_since = None
+            self.delivered += len(batch)
+            more = bool(sub.outbox) or sub.dropped > 0
+            if not more:
+                sub.scheduled = False
+        if more:
+            self._schedule(sub, 0)
+
+    def _failed(self, sub: Subscriber):
+        now = time.monotonic()
+        with self._lock:
+            self.failed += 1
+            sub.failures += 1
+            if sub.failing_since is None:
+                sub.failing_since = now
+            evict = now - sub.failing_since >= self.evict_after
+            if evict:
+                self._subscribers.pop(sub.id, None)
+                self.evicted += 1
+        if evict:
+            logger.warning('Unsubscribing %s, deliveries failed for %.0fs.', sub.callback,
+                           now - sub.failing_since)
+            get_db().do(partial(get_ops().delete_subscription, sub.id))
+            return
+        delay = min(self.backoff * 2 ** (sub.failures - 1), self.max_backoff)
+        logger.warning('Push to %s failed, retrying in %.1fs (failure %d).', sub.callback, delay,
+                       sub.failures, exc_info=True)
+        self._schedule(sub, delay)
+
+    def forget(self, id_: int):
+        """
+        Drops delivery state of removed subscription.
+        """
+        with self._lock:
+            self._subscribers.pop(id_, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'published': self.published,
+                'pending': len(self._pending),
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'evicted': self.evicted,
+                'subscribers': [s.state() for s in self._subscribers.values()],
+            }
+
+
+def create_pusher(app, executor) -> Pusher:
+    """
+    Creates pusher from application config. Pending events are flushed when
+    executor shuts down.
+    """
+    pusher = Pusher(
+        executor,
+        delay=float(app.config['ST_PUSH_DELAY']),
+        batch_size=int(app.config['ST_PUSH_BATCH']),
+        max_pending=int(app.config['ST_PUSH_MAX_PENDING']),
+        backoff=float(app.config['ST_PUSH_BACKOFF']),
+        max_backoff=float(app.config['ST_PUSH_MAX_BACKOFF']),
+        evict_after=float(app.config['ST_PUSH_EVICT_AFTER']),
+        timeout=float(app.config['ST_PUSH_TIMEOUT']),
+        allow_private=as_bool(app.config['ST_PUSH_ALLOW_PRIVATE']),
+    )
+    executor.on_shutdown(pusher.flush)
+    return pusher
+
+
+def publish(op: str, tweet_id: int, tweet: Optional[dict]):
+    """
+    Publishes change of tweet to subscribers, if pushing is enabled.
+
+    :param op: One of `CREATE`, `MODIFY`, `DELETE` and `RETWEET`.
+    :param tweet_id: ID of changed tweet.
+    :param tweet: Tweet after change, None if it was deleted.
+    """
+    pusher = current_app.extensions.get('pusher')
+    if pusher is None:
+        return
+    pusher.publish({'op': op, 'id': tweet_id, 'changed_at': datetime.utcnow(), 'tweet': tweet})
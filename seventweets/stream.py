@@ -0,0 +1,187 @@
+"""
+Live stream of tweet changes for Server-Sent Events.
+
+Each worker process has single `ChangeBroker`, which holds one database
+listener (Postgres `LISTEN` for pg backend, in-process notifications for
+memory backend). When notified, broker reads new entries from change log once
+and fans them out to all subscribers of that process, so number of database
+queries does not grow with number of connected clients.
+"""
+import queue
+import logging
+import threading
+from functools import partial
+from typing import Optional, List, Iterator
+
+from flask import json
+
+from seventweets import tweet, cache
+from seventweets.db import get_db, get_ops, get_listener
+from seventweets.exception import ServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'tweet_changes'
+FETCH_SIZE = 500
+
+
+class Subscription:
+    """
+    Queue of change batches for single subscriber. If subscriber is too slow
+    and queue fills up, subscription is closed and client is expected to
+    reconnect with `Last-Event-ID`.
+    """
+
+    def __init__(self, start_seq: int, maxsize: int):
+        self.start_seq = start_seq
+        self.closed = False
+        self._queue = queue.Queue(maxsize)
+
+    def put(self, changes: List['tweet.Change']):
+        try:
+            self._queue.put_nowait(changes)
+        except queue.Full:
+            logger.warning('Subscriber queue is full, closing subscription.')
+            self.close()
+
+    def get(self, timeout: float) -> Optional[List['tweet.Change']]:
+        """
+        Returns next batch of changes or None if nothing arrived in `timeout`
+        seconds or subscription is closed.
+        """
+        if self.closed:
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+
+
+class ChangeBroker:
+    """
+    Fans out changes from single database listener to many subscribers.
+
+    Listener thread is started with first subscriber and stopped when there
+    are no more subscribers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self.last_seq = 0
+
+    def subscribe(self, app, maxsize: int=1000, limit: int=0) -> Subscription:
+        """
+        Registers new subscriber, starting listener thread if needed.
+
+        :param app: Flask application, used to create app context for listener.
+        :param maxsize: Max number of undelivered batches for subscriber.
+        :param limit: Max number of subscribers, 0 is unlimited.
+        :raises ServiceUnavailable: If there are `limit` subscribers already.
+        """
+        with self._lock:
+            if limit and len(self._subscribers) >= limit:
+                raise ServiceUnavailable('Too many open streams, try again later.')
+            if self._thread is None:
+                self.last_seq = get_db().do(get_ops().last_change_seq)
+                self._thread = threading.Thread(
+                    target=self._run, args=(app,), name='seventweets-stream', daemon=True
+                )
+                self._thread.start()
+            subscription = Subscription(self.last_seq, maxsize)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _run(self, app):
+        interval = float(app.config['ST_STREAM_LISTEN_INTERVAL'])
+        with app.app_context():
+            listener = get_listener(CHANNEL)
+            try:
+                while True:
+                    with self._lock:
+                        if not self._subscribers:
+                            self._thread = None
+                            return
+                    try:
+                        notified = listener.wait(interval)
+                        if notified:
+                            self._dispatch()
+                    except Exception:
+                        logger.exception('Failed to dispatch changes to subscribers.')
+            finally:
+                listener.close()
+
+    def _dispatch(self):
+        while True:
+            fetch = partial(get_ops().get_changes, self.last_seq, FETCH_SIZE)
+            changes = [tweet.Change(*args) for args in get_db().do(fetch)]
+            if not changes:
+                return
+            # changes might come from other processes
+            cache.data_version.bump()
+            self.last_seq = changes[-1].seq
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                subscription.put(changes)
+            if len(changes) < FETCH_SIZE:
+                return
+
+
+broker = ChangeBroker()
+
+
+def format_event(change: 'tweet.Change') -> str:
+    return f'id: {change.seq}\nevent: {change.op}\ndata: {json.dumps(change.to_dict())}\n\n'
+
+
+def events(subscription: Subscription, last_event_id: Optional[int], heartbeat: float) -> Iterator[str]:
+    """
+    Generates Server-Sent Events for changes of tweets, subscription is
+    closed when generator is.
+
+    If `last_event_id` is provided, all changes after it are replayed from
+    change log first. Heartbeat comment is sent when there are no changes for
+    `heartbeat` seconds, so proxies and clients keep connection open.
+
+    :param subscription: Subscription to `broker`.
+    :param last_event_id: Sequence number of last change client has seen.
+    :param heartbeat: Seconds between heartbeats.
+    """
+    try:
+        last_seq = subscription.start_seq
+        if last_event_id is not None:
+            last_seq = last_event_id
+            while True:
+                replay = tweet.changes(last_seq, FETCH_SIZE)
+                for change in replay:
+                    yield format_event(change)
+                    last_seq = change.seq
+                if len(replay) < FETCH_SIZE:
+                    break
+
+        yield 'retry: 3000\n\n'
+        while True:
+            changes = subscription.get(heartbeat)
+            if changes is None:
+                if subscription.closed:
+                    return
+                yield ': heartbeat\n\n'
+                continue
+            for change in changes:
+                # replay and live changes can overlap
+                if change.seq <= last_seq:
+                    continue
+                yield format_event(change)
+                last_seq = change.seq
+    finally:
+        broker.unsubscribe(subscription)
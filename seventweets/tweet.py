@@ -1,9 +1,15 @@
+import time
 import logging
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from functools import partial
-from seventweets.db import get_db, get_ops
+from flask import current_app
+from seventweets import events, mirror, cache, push
+from seventweets.db import (
+    get_db, get_read_db, get_ops, make_reference, NewTweet, Columns, routing, project_tweets
+)
 from seventweets.exception import NotFound, BadRequest
-from typing import List
+from typing import List, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -13,26 +19,33 @@ class Tweet:
     Tweet model holding information about single tweet and providing operations
     on single tweet and multiple tweets. (batch)
     """
-    def __init__(self, id_, tweet, type_, created_at, modified_at, reference=None):
+    def __init__(self, id_, tweet, type_, created_at, modified_at, reference=None, server=None):
         self.id = id_
         self.tweet = tweet
         self.type = type_
         self.created_at = created_at
         self.modified_at = modified_at
         self.reference = reference
+        self.server = server
 
-    def to_dict(self):
+    def to_dict(self, fields: Columns=None):
         """
         Converts tweet to dictionary. Optionals filed may not exist in resulting dictionary.
+        :param fields: Columns to include, default set if None.
         :return: Tweet represented as dictionary
         """
-        r = {
-            'id': self.id,
-            'type': self.type,
-            'tweet': self.tweet,
-            'created_at': self.created_at,
-            'modified_at': self.modified_at
-        }
+        if fields is not None:
+            r = {f: getattr(self, f) for f in fields}
+        else:
+            r = {
+                'id': self.id,
+                'type': self.type,
+                'tweet': self.tweet,
+                'created_at': self.created_at,
+                'modified_at': self.modified_at
+            }
+        if self.server is not None:
+            r['server'] = self.server
         return r
 
     @classmethod
@@ -41,23 +54,83 @@ class Tweet:
             id_ = tweet_dict['id']
             tweet = tweet_dict['tweet']
             type_ = tweet_dict['type']
-            created_at = datetime.strftime(
-                tweet_dict['created_at'], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
-            modified_at = datetime.strftime(
-                tweet_dict['modified_at'], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
-            return cls(id_, tweet, type_, created_at, modified_at, None)
-        except KeyError:
+            created_at = _parse_dt(tweet_dict['created_at'])
+            modified_at = _parse_dt(tweet_dict['modified_at'])
+            return cls(id_, tweet, type_, created_at, modified_at,
+                       tweet_dict.get('reference'), tweet_dict.get('server'))
+        except (KeyError, TypeError):
             raise ValueError('Invalid format of tweet dict provided.')
 
+    @classmethod
+    def from_row(cls, row, columns: Columns=None):
+        """
+        Creates tweet from row with provided columns, columns that were not
+        read are None.
+        """
+        if columns is None:
+            return cls(*row)
+        values = dict(zip(columns, row))
+        return cls(values.get('id'), values.get('tweet'), values.get('type'),
+                   values.get('created_at'), values.get('modified_at'), values.get('reference'))
+
+    def to_row(self):
+        """
+        Returns tweet as tuple of columns in `TWEET_COLUMN_ORDER`.
+        """
+        return self.id, self.tweet, self.type, self.created_at, self.modified_at, self.reference
+
+
+def _parse_dt(value):
+    """
+    Converts datetime received from other node to naive datetime. Flask
+    serializes datetime in HTTP date format (RFC 822), ISO format and unix
+    timestamps are accepted as well. MessagePack responses are already decoded
+    to datetime.
+    """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    try:
+        return parsedate_to_datetime(value).replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class Change:
+    """
+    Single entry of change log. Holds current state of tweet for create and
+    modify changes, if tweet still exists.
+    """
+    def __init__(self, seq, op, changed_at, tweet_id, *tweet_columns):
+        self.seq = seq
+        self.op = op
+        self.changed_at = changed_at
+        self.tweet_id = tweet_id
+        self.tweet = Tweet(*tweet_columns) if tweet_columns and tweet_columns[0] is not None else None
+
+    def to_dict(self):
+        tweet = None
+        if self.tweet is not None:
+            # mirrors need reference of retweets, which API responses omit
+            tweet = dict(self.tweet.to_dict(), reference=self.tweet.reference)
+        return {
+            'seq': self.seq,
+            'op': self.op,
+            'id': self.tweet_id,
+            'changed_at': self.changed_at,
+            'tweet': tweet,
+        }
+
 
-def get_all():
+def get_all(fields: Columns=None):
     """
     Returns list of all tweets.
+    :param fields: Columns to read, all if None.
     :return: [Tweet]
     """
-    return [Tweet(*args) for args in get_db().do(get_ops().get_all_tweets)]
+    rows = get_read_db().do(partial(get_ops().get_all_tweets, fields))
+    return [Tweet.from_row(args, fields) for args in rows]
 
 
 def by_id(id_):
@@ -66,12 +139,37 @@ def by_id(id_):
     :param int id_: ID of tweet to get.
     :raises NotFound: If tweet with provided ID was not founc.
     """
-    res = get_db().do(partial(get_ops().get_tweet, id_))
+    res = _cached(('by_id', id_), lambda: get_read_db().do(partial(get_ops().get_tweet, id_)))
     if res is None:
         raise NotFound(f'Tweet with id: {id_} not found.')
     return Tweet(*res)
 
 
+def by_tag(kind: str, tag: str, limit: int=100) -> List[Tweet]:
+    """
+    Returns tweets of this node with hashtag or mention, newest first.
+    :param kind: Either `HASHTAG` or `MENTION`.
+    :param tag: Lower cased tag without leading `#` or `@`.
+    :param limit: Max number of tweets to return.
+    """
+    rows = _cached(('by_tag', kind, tag, limit),
+                   lambda: get_read_db().do(partial(get_ops().get_tagged_tweets, kind, tag, limit)))
+    return [Tweet(*row) for row in rows]
+
+
+def trending(kind: str, window: int, limit: int=10) -> List[Tuple[str, int]]:
+    """
+    Returns the most used tags of tweets created in the last `window`
+    seconds, with number of tweets containing them.
+    :param kind: Either `HASHTAG` or `MENTION`.
+    :param window: Length of time window in seconds.
+    :param limit: Max number of tags to return.
+    :return: List of (tag, count) tuples.
+    """
+    return _cached(('trending', kind, window, limit),
+                   lambda: get_read_db().do(partial(get_ops().count_tags, kind, window, limit)))
+
+
 def create(content):
     """
     Creates new tweet with provided content.
@@ -79,7 +177,13 @@ def create(content):
     :return: Tweet
     """
     check_length(content)
-    return Tweet(*get_db().do(partial(get_ops().insert_tweet, content)))
+    coalescer = current_app.extensions.get('write_coalescer')
+    if coalescer is not None:
+        new_tweet = Tweet(*coalescer.submit((content, 'original', None)))
+    else:
+        new_tweet = Tweet(*get_db().do(partial(get_ops().insert_tweet, content)))
+    _changed(push.CREATE, new_tweet)
+    return new_tweet
 
 
 def modify(id_, new_content):
@@ -93,7 +197,9 @@ def modify(id_, new_content):
     updated = get_db().do(partial(get_ops().modify_tweet, id_, new_content))
     if not updated:
         raise NotFound(f'Tweet for ID: {id_} not found.')
-    return Tweet(*updated)
+    modified = Tweet(*updated)
+    _changed(push.MODIFY, modified)
+    return modified
 
 
 def delete(id_):
@@ -105,6 +211,7 @@ def delete(id_):
     deleted = get_db().do(partial(get_ops().delete_tweet, id_))
     if not deleted:
         raise NotFound(f'Tweet with provided id: {id_} not found.')
+    _changed(push.DELETE, id_=id_)
     return deleted
 
 
@@ -116,7 +223,47 @@ def retweet(server, id_):
     :return: Newly created tweet.
     :rtype: Tweet
     """
-    return Tweet(*get_db().do(partial(get_ops().create_retweet, server, id_)))
+    coalescer = current_app.extensions.get('write_coalescer')
+    if coalescer is not None:
+        new_tweet = Tweet(*coalescer.submit((None, 'retweet', make_reference(server, id_))))
+    else:
+        new_tweet = Tweet(*get_db().do(partial(get_ops().create_retweet, server, id_)))
+    _changed(push.RETWEET, new_tweet)
+    return new_tweet
+
+
+def insert_many(tweets: List[NewTweet]):
+    """
+    Inserts multiple tweets in single transaction. Used by write coalescing.
+    :param tweets: List of (tweet, type, reference) tuples to insert.
+    :return: Created rows, in the same order as provided.
+    """
+    return get_db().do(partial(get_ops().insert_tweets, tweets))
+
+
+def changes(since: int=0, limit: int=100, wait: float=0) -> List[Change]:
+    """
+    Returns changes of tweets recorded after provided sequence number.
+
+    If there are no such changes and `wait` is provided, this blocks until
+    change happens or `wait` seconds pass. Writes from this process wake
+    waiters immediately, changes made by other processes are picked up by
+    re-checking database every `ST_CHANGES_POLL_INTERVAL` seconds.
+
+    :param since: Sequence number of last change caller has seen.
+    :param limit: Max number of changes to return.
+    :param wait: Max time in seconds to wait for new changes.
+    :return: List of changes, ordered by sequence number.
+    """
+    poll_interval = float(current_app.config['ST_CHANGES_POLL_INTERVAL'])
+    deadline = time.monotonic() + wait
+    while True:
+        seen_version = events.changes.version
+        res = [Change(*args) for args in get_db().do(partial(get_ops().get_changes, since, limit))]
+        remaining = deadline - time.monotonic()
+        if res or remaining <= 0:
+            return res
+        events.changes.wait(seen_version, min(poll_interval, remaining))
 
 
 def search(content: str=None,
@@ -125,10 +272,13 @@ def search(content: str=None,
            modified_from: datetime=None,
            modified_to: datetime=None,
            retweets: bool=None,
-           all: bool=False) -> List[Tweet]:
+           all: bool=False,
+           fields: Columns=None) -> List[Tweet]:
     """
     Performs search on tweets and returns list of results.
     If no parameters are provided, this will yield same results as listing tweets.
+    Only `fields` columns of local tweets are read, tweets of other nodes are
+    always complete.
 
     :param content: Content to search in tweet.
     :param created_from: Start time for tweet creation.
@@ -137,12 +287,13 @@ def search(content: str=None,
     :param modified_to: End time for tweet modification.
     :param retweets: Flag indication if retweet or original tweets should be searched.
     :param all: Flag indication if all nodes should be searched or only this one.
+    :param fields: Columns to read, all if None.
     :return: Result searching tweets.
     :rtype: [Tweet]
     """
-    search_fun = partial(get_ops().search_tweets, content, created_from, created_to,
-                         modified_from, modified_to, retweets)
-    res = [Tweet(*args) for args in get_db().do(search_fun)]
+    params = (content, created_from, created_to, modified_from, modified_to, retweets, fields)
+    res = [Tweet.from_row(args, fields) for args in _read_once(('search',) + params,
+                                                               partial(_search_local, *params))]
     if all:
         others_res = search_others(content, created_from, created_to,
                                    modified_from, modified_to, retweets)
@@ -150,6 +301,37 @@ def search(content: str=None,
     return res
 
 
+def _search_local(content, created_from, created_to, modified_from, modified_to, retweets, fields):
+    """
+    Searches tweets of this node, using search cache if it is enabled.
+
+    Cache is filled only by reads from primary, see `_cached`. Cache holds
+    complete rows, so narrow search is served from cache if it
+    is there, otherwise it reads only requested columns and is not cached.
+    Complete rows missing in cache of this worker are looked up in cache
+    shared by workers.
+    """
+    search_fun = partial(get_ops().search_tweets, content, created_from, created_to,
+                         modified_from, modified_to, retweets, fields)
+    search_cache = current_app.extensions.get('search_cache')
+    if search_cache is None:
+        return get_read_db().do(search_fun)
+
+    key = search_cache.normalize(content, created_from, created_to,
+                                 modified_from, modified_to, retweets)
+    rows = search_cache.get(key)
+    if rows is None:
+        if fields is not None:
+            return get_read_db().do(search_fun)
+        version = cache.data_version.value
+        rows = _cached(('search',) + key,
+                       lambda: get_read_db().do(partial(get_ops().search_tweets, *key, None)))
+        if routing.reads_primary():
+            search_cache.put(key, rows, version)
+    rows = search_cache.narrow(rows, created_from, created_to, modified_from, modified_to)
+    return project_tweets(rows, fields)
+
+
 def search_others(content: str=None,
            created_from: datetime=None,
            created_to: datetime=None,
@@ -157,7 +339,31 @@ def search_others(content: str=None,
            modified_to: datetime=None,
            retweets: bool=None,
            all: bool=False):
-    return []
+    """
+    Searches tweets of other nodes. If mirror mode is enabled, search is served
+    from local mirror of peer tweets, so peers do not have to be online.
+    """
+    if not mirror.enabled():
+        return []
+    search_fun = partial(get_ops().search_peer_tweets, content, created_from, created_to,
+                         modified_from, modified_to, retweets)
+    return [Tweet(*args[1:], server=args[0]) for args in get_db().do(search_fun)]
+
+
+def _changed(op: str, changed: Tweet=None, id_: int=None):
+    """
+    Notifies waiters about change, invalidates cached searches, makes
+    following reads of the client go to primary database and publishes change
+    to subscribers.
+    :param op: Kind of change, one of operations of `push`.
+    :param changed: Tweet after change, None if it was deleted.
+    :param id_: ID of deleted tweet.
+    """
+    routing.mark_write()
+    cache.data_version.bump()
+    events.changes.notify()
+    push.publish(op, changed.id if changed is not None else id_,
+                 changed.to_dict() if changed is not None else None)
 
 
 def check_length(tweet):
@@ -180,4 +386,46 @@ def count(type_: str=None):
     If `separate` is False (default) only one number is returned.
     :param type_: Type of tweets to count. Valid values are 'original' and 'retweet'.
     """
-    return get_db().do(partial(get_ops().count_tweets, type_))
+    return _cached(('count', type_),
+                   lambda: get_read_db().do(partial(get_ops().count_tweets, type_)))
+
+
+def _cached(key, fn):
+    """
+    Executes read through cache shared by worker processes, if it is enabled.
+    Reads missing in cache are shared with identical concurrent reads.
+
+    Cache is filled only by reads from primary. Replica may lag behind
+    writes, so its result stored under current data version could be served
+    to client that just wrote and must read its writes.
+    :param key: Hashable description of read.
+    :param fn: Function executing read.
+    """
+    shared_cache = current_app.extensions.get('shared_cache')
+    if shared_cache is None:
+        return _read_once(key, fn)
+    value = shared_cache.get(key)
+    if value is None:
+        version = cache.data_version.value
+        value = _read_once(key, fn)
+        # None can not be told apart from missing entry, so it is not cached
+        if value is not None and routing.reads_primary():
+            shared_cache.put(key, value, version)
+    return value
+
+
+def _read_once(key, fn):
+    """
+    Executes read, sharing it with identical reads running concurrently in
+    this process if read coalescing is enabled.
+
+    Data version is part of key, so reads started after write of this
+    process never share result of read started before it. Reads from primary
+    and from replica are never shared either.
+    :param key: Hashable description of read.
+    :param fn: Function executing read.
+    """
+    coalescer = current_app.extensions.get('read_coalescer')
+    if coalescer is None:
+        return fn()
+    return coalescer.do((cache.data_version.value, routing.reads_primary()) + key, fn)
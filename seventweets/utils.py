@@ -1,5 +1,6 @@
 import os
 import binascii
+from typing import List
 
 
 def generate_api_token():
@@ -7,3 +8,40 @@ def generate_api_token():
     Generates random token.
     """
     return binascii.b2a_hex(os.urandom(15)).decode('ascii')
+
+
+def as_bool(val):
+    """
+    Converts config value to boolean. Values provided through environment
+    variables are strings, so 'true', '1' and 'yes' are treated as True.
+    """
+    if isinstance(val, str):
+        return val.strip().lower() in ('true', '1', 'yes', 'on')
+    return bool(val)
+
+
+def serves_concurrently(config) -> bool:
+    """
+    Checks if worker handles requests concurrently (gthread or gevent). Sync
+    worker handles one request at a time, so request waiting for something
+    (long poll, stream) blocks the whole worker.
+    """
+    return config['ST_WORKER_MODEL'] != 'sync'
+
+
+def per_worker(total: float, config) -> float:
+    """
+    Returns share of node wide limit enforced by single worker process, limit
+    is split evenly between `ST_WORKERS` processes. Zero (unlimited) stays zero.
+    """
+    return float(total) / max(1, int(config['ST_WORKERS']))
+
+
+def percentiles_ms(values: List[float]) -> dict:
+    """
+    Returns median, 99th percentile and max of sorted durations in seconds,
+    converted to milliseconds.
+    """
+    def at(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+    return {'p50': at(0.5), 'p99': at(0.99), 'max': at(1)}
@@ -0,0 +1,134 @@
+"""
+Wire formats used by HTTP layer.
+
+Responses are encoded as JSON by default. Clients (usually other nodes) can
+ask for MessagePack with `Accept: application/msgpack`, which is smaller and
+faster to encode and decode. MessagePack support is optional and is enabled
+only if `msgpack` package is installed.
+
+Responses larger than `ST_COMPRESS_MIN_SIZE` bytes are compressed with gzip or
+deflate if client accepts it.
+"""
+import gzip
+import zlib
+import struct
+import logging
+from datetime import datetime, timezone, timedelta
+
+from flask import request, jsonify, current_app, Response
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+# MessagePack extension type holding datetime as microseconds since epoch
+_DATETIME_EXT = 1
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        if obj.tzinfo is not None:
+            obj = obj.astimezone(timezone.utc).replace(tzinfo=None)
+        micros = (obj - _EPOCH) // timedelta(microseconds=1)
+        return msgpack.ExtType(_DATETIME_EXT, struct.pack('>q', micros))
+    raise TypeError(f'Unable to serialize {type(obj)}.')
+
+
+def _ext_hook(code, data):
+    if code == _DATETIME_EXT:
+        return _EPOCH + timedelta(microseconds=struct.unpack('>q', data)[0])
+    return msgpack.ExtType(code, data)
+
+
+def dumps_msgpack(data) -> bytes:
+    """
+    Encodes data as MessagePack. Datetimes are encoded as extension type,
+    so they are decoded back to datetime without any parsing.
+    """
+    return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+def loads_msgpack(data: bytes):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+
+
+def available_types():
+    return [JSON] + (list(MSGPACK_TYPES) if msgpack is not None else [])
+
+
+def accept_header() -> str:
+    """
+    Returns `Accept` header for requests to other nodes, preferring
+    MessagePack if it is available.
+    """
+    if msgpack is None:
+        return JSON
+    return f'{MSGPACK}, {JSON};q=0.5'
+
+
+def respond(data, status: int=200) -> Response:
+    """
+    Creates response with data encoded in format client asked for in
+    `Accept` header. JSON is used if client does not care.
+
+    :param data: Data to send, anything `jsonify` accepts.
+    :param status: HTTP status code.
+    """
+    mimetype = request.accept_mimetypes.best_match(available_types(), default=JSON)
+    if mimetype in MSGPACK_TYPES:
+        response = Response(dumps_msgpack(data), status=status, mimetype=MSGPACK)
+    else:
+        response = jsonify(data)
+        response.status_code = status
+    response.vary.add('Accept')
+    return response
+
+
+def request_body():
+    """
+    Returns decoded request body. MessagePack is used if request content type
+    says so, otherwise body is parsed as JSON.
+    """
+    if msgpack is not None and request.mimetype in MSGPACK_TYPES:
+        return loads_msgpack(request.get_data())
+    return request.get_json(force=True)
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compresses response body with gzip or deflate, if client accepts it and
+    body is large enough for compression to pay off. Streamed responses are
+    left untouched.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 304)):
+        return response
+
+    min_size = int(current_app.config['ST_COMPRESS_MIN_SIZE'])
+    if min_size < 0:
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    level = int(current_app.config['ST_COMPRESS_LEVEL'])
+    encodings = request.accept_encodings
+    if encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=level))
+        response.headers['Content-Encoding'] = 'gzip'
+    elif encodings['deflate']:
+        response.set_data(zlib.compress(body, level))
+        response.headers['Content-Encoding'] = 'deflate'
+    else:
+        return response
+    response.vary.add('Accept-Encoding')
+    return response
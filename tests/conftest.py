@@ -0,0 +1,82 @@
+import os
+import time
+
+# tests run against in-memory storage, so they do not need database server,
+# except for Postgres tests using `pg_app`
+os.environ['ST_DB_BACKEND'] = 'memory'
+
+import pytest
+
+from seventweets.app import create_app
+from seventweets.db import get_connection
+from seventweets.db.backends import memory
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config['ST_OWN_NAME'] = 'test'
+    app.config['ST_OWN_ADDRESS'] = 'http://test'
+    yield app
+    # otherwise it is shut down at exit, after output capture is closed
+    app.extensions['executor'].shutdown(1)
+    memory.Database().subscriptions.clear()
+
+
+@pytest.fixture
+def wait_until():
+    """
+    Returns function waiting until condition is true, failing test if it
+    does not happen in time.
+    """
+    def wait(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                pytest.fail('Condition was not met in time.')
+            time.sleep(0.005)
+    return wait
+
+
+@pytest.fixture(scope='session')
+def postgresql():
+    """
+    Starts temporary Postgres server for the test session. Tests using it are
+    skipped if testing.postgresql or Postgres itself is not installed.
+    """
+    try:
+        import testing.postgresql
+    except ImportError:
+        pytest.skip('testing.postgresql is not installed.')
+    try:
+        server = testing.postgresql.Postgresql()
+    except RuntimeError as e:
+        pytest.skip(f'Postgres is not available: {e}')
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def pg_app(app, postgresql):
+    """
+    App configured to use temporary Postgres server, inside of app context.
+    Database is empty, tests migrate it with `MigrationManager(backend='pg')`.
+    """
+    dsn = postgresql.dsn()
+    app.config.update(
+        ST_DB_HOST=dsn['host'],
+        ST_DB_PORT=dsn['port'],
+        ST_DB_USER=dsn['user'],
+        ST_DB_NAME=dsn['database'],
+        ST_DB_PASS=None,
+    )
+    with app.app_context():
+        db = get_connection('pg')
+        try:
+            cursor = db.cursor()
+            cursor.execute('DROP SCHEMA public CASCADE;')
+            cursor.execute('CREATE SCHEMA public;')
+            db.commit()
+        finally:
+            db.close()
+        yield app
@@ -0,0 +1,74 @@
+import pytest
+
+from seventweets import admission
+from seventweets.admission import AdmissionController, HIGH, NORMAL, LOW
+from seventweets.exception import ServiceUnavailable, TooManyRequests
+
+
+def test_low_priority_is_shed_first():
+    controller = AdmissionController(capacity=4, limits={})
+    for _ in range(2):
+        controller.acquire('list', LOW, 'client')
+
+    with pytest.raises(ServiceUnavailable):
+        controller.acquire('list', LOW, 'client')
+    controller.acquire('read', NORMAL, 'client')
+    controller.acquire('health', HIGH, 'client')
+    assert controller.in_flight == 4
+
+    # low priority requests are admitted while less than half of capacity is used
+    controller.release('list')
+    with pytest.raises(ServiceUnavailable):
+        controller.acquire('list', LOW, 'client')
+    controller.release('read')
+    controller.release('health')
+    controller.acquire('list', LOW, 'client')
+    assert controller.rejected == 2
+
+
+def test_endpoint_concurrency_is_limited():
+    controller = AdmissionController(capacity=10, limits={'search': (2, 0, 0)})
+    controller.acquire('search', NORMAL, 'a')
+    controller.acquire('search', NORMAL, 'b')
+
+    with pytest.raises(ServiceUnavailable):
+        controller.acquire('search', NORMAL, 'c')
+    # other endpoints are not affected
+    controller.acquire('read', NORMAL, 'c')
+
+    controller.release('search')
+    controller.acquire('search', NORMAL, 'c')
+
+
+def test_rate_is_limited_per_client():
+    controller = AdmissionController(capacity=10, limits={'search': (0, 1, 2)})
+    for _ in range(2):
+        controller.acquire('search', NORMAL, 'a')
+        controller.release('search')
+
+    with pytest.raises(TooManyRequests) as e:
+        controller.acquire('search', NORMAL, 'a')
+    assert 0 < e.value.retry_after <= 1
+    controller.acquire('search', NORMAL, 'b')
+
+
+def test_node_rate_is_split_between_workers(app):
+    app.config.update(ST_WORKERS=4, ST_SEARCH_RATE=8, ST_SEARCH_BURST=8, ST_SEARCH_CONCURRENCY=3)
+    controller = admission.create_controller(app.config)
+    limit = controller.limits['search']
+
+    assert (limit.concurrency, limit.rate, limit.burst) == (3, 2, 2)
+    assert controller.limits['list'].rate == float(app.config['ST_LIST_RATE']) / 4
+
+
+def test_rejected_request_gets_retry_after(app):
+    app.config.update(ST_WORKERS=1, ST_LIST_RATE=1, ST_LIST_BURST=1)
+    app.extensions['admission'] = admission.create_controller(app.config)
+    client = app.test_client()
+
+    assert client.get('/tweets/').status_code == 200
+    resp = client.get('/tweets/')
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '1'
+    # clients are told apart by address
+    assert client.get('/tweets/', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
@@ -0,0 +1,95 @@
+import io
+import json
+from functools import partial
+
+import pytest
+
+from seventweets import bulk
+from seventweets.db import get_db, get_ops
+from seventweets.db.backends import memory
+
+CONTENTS = ['plain', 'comma, "quotes" and\nnewline', 'unicode žš \U0001f600', None]
+
+
+@pytest.fixture
+def storage(app, monkeypatch):
+    """
+    Empty in-memory storage, inside of app context.
+    """
+    monkeypatch.setattr(memory.Database, '_instance', None)
+    with app.app_context():
+        yield
+
+
+def _empty(monkeypatch):
+    monkeypatch.setattr(memory.Database, '_instance', None)
+
+
+def _all():
+    return get_db().do(partial(get_ops().get_tweets_page, 0, 1000))
+
+
+def _seed():
+    ops = get_ops()
+    created = get_db().do(partial(ops.insert_tweets, [(c, 'original', None) for c in CONTENTS[:3]]))
+    get_db().do(partial(ops.create_retweet, 'peer', '7'))
+    get_db().do(partial(ops.modify_tweet, created[0][0], 'plain, modified'))
+    get_db().do(partial(ops.delete_tweet, created[1][0]))
+    return [tuple(t) for t in _all()]
+
+
+@pytest.mark.parametrize('fmt', bulk.FORMATS)
+def test_export_and_import_keep_tweets(storage, monkeypatch, fmt):
+    tweets = _seed()
+    out = io.BytesIO()
+    assert bulk.export_tweets(out, fmt, batch_size=2) == len(tweets)
+
+    _empty(monkeypatch)
+    progress = []
+    imported = bulk.import_tweets(io.BytesIO(out.getvalue()), fmt, batch_size=2, keep_ids=True,
+                                  progress=progress.append)
+
+    assert imported == len(tweets)
+    assert progress == [2, 3]
+    assert [tuple(t) for t in _all()] == tweets
+    # IDs of new tweets continue after imported ones
+    assert get_db().do(partial(get_ops().insert_tweet, 'new'))[0] > tweets[-1][0]
+
+
+def test_import_assigns_new_ids_to_node_with_tweets(storage):
+    tweets = _seed()
+    out = io.BytesIO()
+    bulk.export_tweets(out, 'jsonl')
+
+    assert bulk.import_tweets(io.BytesIO(out.getvalue()), 'jsonl') == len(tweets)
+
+    imported = _all()[len(tweets):]
+    assert [t[1:] for t in imported] == [t[1:] for t in tweets]
+    assert all(t[0] > tweets[-1][0] for t in imported)
+    with pytest.raises(ValueError):
+        bulk.import_tweets(io.BytesIO(out.getvalue()), 'jsonl', keep_ids=True)
+
+
+@pytest.mark.parametrize('line', [
+    'not json',
+    '[1, 2]',
+    '{"tweet": "no creation time"}',
+    '{"tweet": "x", "type": "reply", "created_at": "2017-01-01T00:00:00"}',
+    json.dumps({'tweet': 'x' * 141, 'created_at': '2017-01-01T00:00:00'}),
+])
+def test_invalid_input_is_rejected_with_line_number(storage, line):
+    data = '{"tweet": "valid", "created_at": "2017-01-01T00:00:00"}\n' + line + '\n'
+
+    with pytest.raises(ValueError) as e:
+        bulk.import_tweets(io.BytesIO(data.encode()), 'jsonl', batch_size=1)
+
+    assert 'line 2' in str(e.value)
+
+
+def test_import_converts_times_to_utc(storage):
+    data = b'{"tweet": "x", "created_at": "2017-01-01T02:00:00+02:00"}\n'
+
+    bulk.import_tweets(io.BytesIO(data), 'jsonl')
+
+    (_, _, _, created_at, modified_at, _), = _all()
+    assert created_at.isoformat() == modified_at.isoformat() == '2017-01-01T00:00:00'
@@ -0,0 +1,208 @@
+import json
+import time
+import multiprocessing
+from datetime import datetime
+
+from seventweets import app as application, config
+from seventweets.cache import SearchCache, SharedCache, data_version, _SHARED_SLOT
+from seventweets.db.backends import memory
+
+
+def _cache(tmpdir, slots=16, slot_size=4096, ttl=60):
+    return SharedCache(str(tmpdir.join('shared.cache')), slots=slots, slot_size=slot_size, ttl=ttl)
+
+
+def _slot(cache, key):
+    return cache._offset(cache._digest(key))
+
+
+def test_shared_cache_is_shared_between_instances(tmpdir):
+    writer, reader = _cache(tmpdir), _cache(tmpdir)
+    writer.put(('by_id', 1), {'id': 1}, writer.version)
+    assert reader.get(('by_id', 1)) == {'id': 1}
+    assert reader.get(('by_id', 2)) is None
+
+
+def test_shared_cache_invalidate_affects_all_instances(tmpdir):
+    writer, reader = _cache(tmpdir), _cache(tmpdir)
+    writer.put('key', 'value', writer.version)
+    reader.invalidate()
+    assert writer.get('key') is None
+    assert writer.version == 1
+
+
+def test_shared_cache_ignores_value_read_before_write(tmpdir):
+    cache = _cache(tmpdir)
+    version = cache.version
+    cache.invalidate()
+    cache.put('key', 'stale', version)
+    assert cache.get('key') is None
+
+
+def test_shared_cache_entry_expires(tmpdir):
+    cache = _cache(tmpdir, ttl=0.01)
+    cache.put('key', 'value', cache.version)
+    time.sleep(0.02)
+    assert cache.get('key') is None
+
+
+def test_shared_cache_skips_too_large_value(tmpdir):
+    cache = _cache(tmpdir, slot_size=128)
+    cache.put('key', 'x' * 1000, cache.version)
+    assert cache.get('key') is None
+    assert cache.too_large == 1
+
+
+def test_shared_cache_misses_slot_being_written(tmpdir):
+    cache = _cache(tmpdir)
+    cache.put('key', 'value', cache.version)
+    data = cache._open()
+    offset = _slot(cache, 'key')
+    header = list(_SHARED_SLOT.unpack_from(data, offset))
+    # writer in other process stopped between marking and finishing slot
+    header[0] += 1
+    _SHARED_SLOT.pack_into(data, offset, *header)
+    assert cache.get('key') is None
+    header[0] += 1
+    _SHARED_SLOT.pack_into(data, offset, *header)
+    assert cache.get('key') == 'value'
+
+
+def test_shared_cache_misses_torn_payload(tmpdir):
+    cache = _cache(tmpdir)
+    cache.put('key', 'value', cache.version)
+    data = cache._open()
+    start = _slot(cache, 'key') + _SHARED_SLOT.size
+    # payload partially overwritten while sequence looked unchanged
+    data[start + 5] = data[start + 5] ^ 0xff
+    assert cache.get('key') is None
+
+
+def _write_alternately(path, stop_at):
+    cache = SharedCache(path, slots=1, slot_size=8192, ttl=60)
+    values = [b'a' * 6000, b'b' * 6000]
+    i = 0
+    while time.time() < stop_at:
+        cache.put('key', values[i % 2], cache.version)
+        i += 1
+
+
+def test_shared_cache_never_returns_torn_value(tmpdir):
+    path = str(tmpdir.join('shared.cache'))
+    cache = SharedCache(path, slots=1, slot_size=8192, ttl=60)
+    cache.put('key', b'a' * 6000, cache.version)
+    writer = multiprocessing.get_context('fork').Process(
+        target=_write_alternately, args=(path, time.time() + 0.5))
+    writer.start()
+    try:
+        while writer.is_alive():
+            value = cache.get('key')
+            assert value in (None, b'a' * 6000, b'b' * 6000)
+    finally:
+        writer.join()
+
+
+def _search_cache(**kwargs):
+    options = dict(max_entries=2, max_rows=100, ttl=60, granularity=60)
+    options.update(kwargs)
+    return SearchCache(**options)
+
+
+def _row(id_, created_at):
+    return (id_, 'tweet', 'original', created_at, created_at, None)
+
+
+def test_search_cache_normalizes_content_and_date_bounds():
+    cache = _search_cache()
+    key = cache.normalize('Hello', datetime(2017, 1, 1, 10, 0, 30), datetime(2017, 1, 1, 11, 0, 30),
+                          None, None, False)
+    other = cache.normalize('hELLO', datetime(2017, 1, 1, 10, 0, 50), datetime(2017, 1, 1, 11, 0, 10),
+                            None, None, True)
+
+    assert key == other == ('hello', datetime(2017, 1, 1, 10), datetime(2017, 1, 1, 11, 1),
+                            None, None, True)
+
+
+def test_search_cache_narrows_rows_to_exact_bounds():
+    rows = [_row(i, datetime(2017, 1, 1, 10, 0, i)) for i in range(10)]
+
+    narrowed = SearchCache.narrow(rows, datetime(2017, 1, 1, 10, 0, 2), datetime(2017, 1, 1, 10, 0, 5),
+                                  None, None)
+
+    assert [r[0] for r in narrowed] == [3, 4]
+    assert SearchCache.narrow(rows, None, None, None, None) is rows
+
+
+def test_search_cache_entry_is_invalidated_by_write():
+    cache = _search_cache()
+    cache.put('key', [1], data_version.value)
+    assert cache.get('key') == [1]
+
+    data_version.bump()
+
+    assert cache.get('key') is None
+    assert cache.stats()['hit_rate'] == 0.5
+
+
+def test_search_cache_ignores_result_read_before_write():
+    cache = _search_cache()
+    version = data_version.value
+    data_version.bump()
+    cache.put('key', [1], version)
+    assert cache.get('key') is None
+
+
+def test_search_cache_evicts_least_recently_used():
+    cache = _search_cache(max_entries=2, max_rows=5)
+    version = data_version.value
+    cache.put('a', [1], version)
+    cache.put('b', [1], version)
+    cache.get('a')
+    cache.put('c', [1], version)
+    assert cache.get('b') is None
+    assert cache.get('a') == [1]
+
+    cache.put('d', [1, 2, 3, 4], version)
+    assert cache.stats()['rows'] <= 5
+    cache.put('e', list(range(6)), version)
+    assert cache.get('e') is None
+    assert cache.stats()['evictions'] == 2
+
+
+def test_search_cache_entry_expires():
+    cache = _search_cache(ttl=0.01)
+    cache.put('key', [1], data_version.value)
+    time.sleep(0.02)
+    assert cache.get('key') is None
+
+
+def test_repeated_search_is_served_from_cache(app, monkeypatch):
+    monkeypatch.setattr(memory.Database, '_instance', None)
+    client = app.test_client()
+    search_cache = app.extensions['search_cache']
+
+    def search(content):
+        resp = client.get('/tweets/search', query_string={'content': content})
+        return [t['tweet'] for t in json.loads(resp.data)]
+
+    client.post('/tweets/create', data=json.dumps({'tweet': 'cached fox'}), content_type='application/json')
+    assert search('FOX') == ['cached fox']
+    assert search('fox') == ['cached fox']
+    assert search_cache.stats()['hits'] == 1
+
+    client.post('/tweets/create', data=json.dumps({'tweet': 'new fox'}), content_type='application/json')
+    assert sorted(search('fox')) == ['cached fox', 'new fox']
+
+
+def test_search_cache_requires_global_invalidation(monkeypatch):
+    monkeypatch.setattr(application, 'default_backend', 'pg')
+    monkeypatch.setattr(config, 'ST_WORKERS', '4')
+    app = application.create_app()
+    app.extensions['executor'].shutdown(1)
+    assert 'search_cache' not in app.extensions
+
+    monkeypatch.setattr(config, 'ST_SHARED_CACHE_PATH', '')
+    monkeypatch.setattr(config, 'ST_WORKERS', '1')
+    app = application.create_app()
+    app.extensions['executor'].shutdown(1)
+    assert 'search_cache' in app.extensions
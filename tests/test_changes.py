@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+
+from seventweets import admission
+
+
+def _create(client, content):
+    resp = client.post('/tweets/create', data=json.dumps({'tweet': content}),
+                       content_type='application/json')
+    assert resp.status_code == 201
+    return json.loads(resp.data)
+
+
+def _changes(client, **args):
+    resp = client.get('/tweets/changes', query_string=args)
+    assert resp.status_code == 200
+    return json.loads(resp.data)
+
+
+def _last_seq(client):
+    return _changes(client, since=0, limit=1000)['last_seq']
+
+
+def test_changes_are_in_order_of_writes(app):
+    client = app.test_client()
+    since = _last_seq(client)
+    created = _create(client, 'first')
+    resp = client.put(f'/tweets/{created["id"]}', data=json.dumps({'tweet': 'second'}),
+                      content_type='application/json')
+    assert resp.status_code == 200
+    assert client.delete(f'/tweets/{created["id"]}').status_code in (200, 204)
+
+    feed = _changes(client, since=since)
+    ops = [(c['op'], c['id']) for c in feed['changes']]
+    assert ops == [('create', created['id']), ('modify', created['id']), ('delete', created['id'])]
+    seqs = [c['seq'] for c in feed['changes']]
+    assert seqs == sorted(seqs) and seqs[0] > since
+    assert feed['last_seq'] == seqs[-1]
+
+
+def test_changes_are_paged_by_limit(app):
+    client = app.test_client()
+    since = _last_seq(client)
+    for i in range(3):
+        _create(client, f'paged {i}')
+
+    first = _changes(client, since=since, limit=2)['changes']
+    rest = _changes(client, since=first[-1]['seq'], limit=2)['changes']
+    assert len(first) == 2 and len(rest) == 1
+    assert rest[0]['seq'] > first[-1]['seq']
+
+
+def test_wait_is_ignored_by_sync_worker(app):
+    app.config['ST_WORKER_MODEL'] = 'sync'
+    client = app.test_client()
+    since = _last_seq(client)
+
+    start = time.monotonic()
+    feed = _changes(client, since=since, wait=5)
+    assert feed['changes'] == []
+    assert time.monotonic() - start < 1
+
+
+def test_long_poll_returns_on_change(app):
+    app.config['ST_WORKER_MODEL'] = 'gthread'
+    client = app.test_client()
+    since = _last_seq(client)
+    result = {}
+
+    def poll():
+        result['feed'] = _changes(app.test_client(), since=since, wait=5)
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    time.sleep(0.1)
+    created = _create(client, 'wake up')
+    poller.join(5)
+
+    assert [c['id'] for c in result['feed']['changes']] == [created['id']]
+
+
+def test_long_polls_are_limited(app, wait_until):
+    app.config['ST_WORKER_MODEL'] = 'gthread'
+    app.config['ST_CHANGES_CONCURRENCY'] = 1
+    app.extensions['admission'] = controller = admission.create_controller(app.config)
+    client = app.test_client()
+    since = _last_seq(client)
+
+    poller = threading.Thread(target=lambda: app.test_client().get(
+        '/tweets/changes', query_string={'since': since, 'wait': 5}))
+    poller.start()
+    wait_until(lambda: controller.limits['changes'].in_flight == 1)
+
+    resp = client.get('/tweets/changes', query_string={'since': since})
+    assert resp.status_code == 503
+
+    _create(client, 'release poller')
+    poller.join(5)
+    assert controller.limits['changes'].in_flight == 0
+
+
+def test_changes_include_reference_of_retweet(app):
+    client = app.test_client()
+    since = _last_seq(client)
+    resp = client.post('/tweets/retweet', data=json.dumps({'server': 'other', 'id': 7}),
+                       content_type='application/json')
+    assert resp.status_code == 200
+    retweet = json.loads(resp.data)
+
+    change, = _changes(client, since=since)['changes']
+    assert change['id'] == retweet['id']
+    assert change['tweet']['type'] == 'retweet'
+    assert change['tweet']['reference'] == 'other#7'
@@ -0,0 +1,165 @@
+import time
+import threading
+
+import pytest
+import requests
+
+from seventweets.client import PeerClient, CircuitOpen
+from seventweets.exception import error_handler
+
+URL = 'http://peer.test/tweets/1'
+
+
+class ScriptedSession:
+    """
+    Session answering requests by functions of `script`, in order.
+    """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def request(self, method, url, timeout, **kwargs):
+        self.calls += 1
+        return self.script.pop(0)()
+
+
+def ok():
+    resp = requests.Response()
+    resp.status_code = 200
+    return resp
+
+
+def down():
+    raise requests.ConnectionError('peer is down')
+
+
+def _client(session, breaker_failures=2, breaker_reset=0.05):
+    client = PeerClient(pool_peers=1, pool_size=1, connect_timeout=1, read_timeout=1, retries=0,
+                        backoff=0, max_backoff=0, breaker_failures=breaker_failures,
+                        breaker_reset=breaker_reset)
+    client._session = session
+    return client
+
+
+def _open_circuit(client):
+    for _ in range(client.breaker_failures):
+        with pytest.raises(requests.ConnectionError):
+            client.get(URL)
+
+
+def test_circuit_opens_after_failures_in_a_row():
+    session = ScriptedSession(down, down)
+    client = _client(session)
+    _open_circuit(client)
+
+    with pytest.raises(CircuitOpen):
+        client.get(URL)
+    assert session.calls == 2
+    stats = client.stats()['http://peer.test']
+    assert stats['state'] == 'open'
+    assert stats['rejected'] == 1
+
+
+def test_success_resets_failure_count():
+    session = ScriptedSession(down, ok, down, ok)
+    client = _client(session)
+    for step in session.script[:]:
+        if step is down:
+            with pytest.raises(requests.ConnectionError):
+                client.get(URL)
+        else:
+            assert client.get(URL).status_code == 200
+    assert client.stats()['http://peer.test']['state'] == 'closed'
+
+
+def test_half_open_lets_single_trial_through():
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_ok():
+        started.set()
+        release.wait(5)
+        return ok()
+
+    session = ScriptedSession(down, down, slow_ok, ok)
+    client = _client(session)
+    _open_circuit(client)
+    time.sleep(0.06)
+    assert client.stats()['http://peer.test']['state'] == 'half-open'
+
+    results = []
+    trial = threading.Thread(target=lambda: results.append(client.get(URL).status_code))
+    trial.start()
+    assert started.wait(5)
+    # other requests are rejected while trial is in flight
+    with pytest.raises(CircuitOpen):
+        client.get(URL)
+    release.set()
+    trial.join()
+
+    assert results == [200]
+    assert client.stats()['http://peer.test']['state'] == 'closed'
+    assert client.get(URL).status_code == 200
+
+
+def test_failed_trial_opens_circuit_again():
+    session = ScriptedSession(down, down, down)
+    client = _client(session)
+    _open_circuit(client)
+    time.sleep(0.06)
+
+    with pytest.raises(requests.ConnectionError) as trial:
+        client.get(URL)
+    assert not isinstance(trial.value, CircuitOpen)
+    with pytest.raises(CircuitOpen):
+        client.get(URL)
+    assert session.calls == 3
+
+
+def test_server_errors_count_as_failures():
+    def error():
+        resp = requests.Response()
+        resp.status_code = 503
+        return resp
+
+    client = _client(ScriptedSession(error, error))
+    assert client.get(URL).status_code == 503
+    assert client.get(URL).status_code == 503
+    with pytest.raises(CircuitOpen):
+        client.get(URL)
+
+
+def test_idempotent_request_is_retried():
+    session = ScriptedSession(down, ok)
+    client = _client(session, breaker_failures=5)
+    assert client.get(URL, retries=1).status_code == 200
+    assert client.stats()['http://peer.test']['retries'] == 1
+
+
+def test_post_is_not_retried_after_connection_error():
+    session = ScriptedSession(down, ok)
+    client = _client(session, breaker_failures=5)
+    with pytest.raises(requests.ConnectionError):
+        client.post(URL, retries=1)
+    assert session.calls == 1
+
+
+def test_open_circuit_is_sent_as_service_unavailable(app):
+    client = _client(ScriptedSession(down, down), breaker_reset=30)
+    _open_circuit(client)
+
+    with app.test_request_context():
+        resp, code = error_handler(lambda: client.get(URL))()
+    assert code == 503
+    assert 25 <= int(resp.headers['Retry-After']) <= 30
+
+
+def test_peer_timeout_is_sent_as_gateway_timeout(app):
+    def slow():
+        raise requests.ReadTimeout('peer is slow')
+
+    client = _client(ScriptedSession(slow))
+    with app.test_request_context():
+        resp, code = error_handler(lambda: client.get(URL))()
+    assert code == 504
@@ -0,0 +1,204 @@
+import threading
+import time
+
+import pytest
+from flask import g
+
+from seventweets import deadline
+from seventweets.coalesce import SingleFlight, WriteCoalescer
+from seventweets.exception import DeadlineExceeded
+
+
+def _run(n, target):
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def _with_deadline(app, seconds, fn):
+    """
+    Calls `fn` in app context with request deadline `seconds` from now.
+    """
+    with app.app_context():
+        g.deadline = time.monotonic() + seconds
+        return fn()
+
+
+def test_single_flight_shares_result(wait_until):
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def read():
+        calls.append(1)
+        release.wait(5)
+        return 'tweet'
+
+    threads = _run(5, lambda: results.append(flight.do('key', read)))
+    wait_until(lambda: flight.shared == 4)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert calls == [1]
+    assert results == ['tweet'] * 5
+    assert flight.calls == 1
+
+
+def test_single_flight_propagates_leader_error_to_followers(wait_until):
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def read():
+        release.wait(5)
+        raise ValueError('read failed')
+
+    def call():
+        try:
+            flight.do('key', read)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = _run(3, call)
+    wait_until(lambda: flight.shared == 2)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(errors) == 3
+    assert all(e is errors[0] for e in errors)
+
+
+def test_single_flight_forgets_finished_call():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('key', lambda: int('x'))
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.calls == 2
+
+
+def test_single_flight_does_not_share_different_keys():
+    flight = SingleFlight()
+    assert flight.do(('by_id', 1), lambda: 1) == 1
+    assert flight.do(('by_id', 2), lambda: 2) == 2
+    assert flight.shared == 0
+
+
+def test_write_coalescer_writes_full_batch_at_once():
+    batches = []
+
+    def write(rows):
+        batches.append(list(rows))
+        return [r * 10 for r in rows]
+
+    coalescer = WriteCoalescer(write, max_delay=5, max_batch=3)
+    results = {}
+    threads = [threading.Thread(target=lambda r=r: results.__setitem__(r, coalescer.submit(r)))
+               for r in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(batches) == 1
+    assert sorted(batches[0]) == [0, 1, 2]
+    assert results == {0: 0, 1: 10, 2: 20}
+    assert (coalescer.batches, coalescer.rows) == (1, 3)
+
+
+def test_write_coalescer_writes_rows_one_by_one_when_batch_fails():
+    def write(rows):
+        if len(rows) > 1 or rows[0] == 'bad':
+            raise ValueError(rows)
+        return [rows[0].upper()]
+
+    coalescer = WriteCoalescer(write, max_delay=5, max_batch=3)
+    results = {}
+
+    def submit(row):
+        try:
+            results[row] = coalescer.submit(row)
+        except ValueError as e:
+            results[row] = e
+
+    threads = [threading.Thread(target=submit, args=(r,)) for r in ('a', 'bad', 'c')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results['a'] == 'A'
+    assert results['c'] == 'C'
+    assert isinstance(results['bad'], ValueError)
+
+
+def test_write_coalescer_leader_writes_after_delay():
+    coalescer = WriteCoalescer(lambda rows: [len(rows)] * len(rows), max_delay=0.01, max_batch=100)
+    assert coalescer.submit('row') == 1
+    assert coalescer.submit('row') == 1
+    assert coalescer.batches == 2
+
+
+def test_single_flight_runs_shared_read_without_leader_deadline(app):
+    flight = SingleFlight()
+    seen = []
+
+    def read():
+        seen.append(deadline.remaining())
+        return 'tweet'
+
+    def call():
+        result = flight.do('key', read)
+        # deadline of leader applies again after shared read
+        assert deadline.remaining() is not None
+        return result
+
+    assert _with_deadline(app, 0.05, call) == 'tweet'
+    assert seen == [None]
+
+
+def test_single_flight_follower_stops_waiting_at_its_deadline(app, wait_until):
+    flight = SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def read():
+        release.wait(5)
+        return 'tweet'
+
+    leader, = _run(1, lambda: results.append(flight.do('key', read)))
+    wait_until(lambda: flight.calls == 1)
+
+    with pytest.raises(DeadlineExceeded):
+        _with_deadline(app, 0.05, lambda: flight.do('key', read))
+    release.set()
+    leader.join()
+
+    assert results == ['tweet']
+
+
+def test_write_coalescer_follower_stops_waiting_at_its_deadline(app, wait_until):
+    release = threading.Event()
+    written = []
+
+    def write(rows):
+        release.wait(5)
+        written.extend(rows)
+        return rows
+
+    coalescer = WriteCoalescer(write, max_delay=5, max_batch=2)
+    results = []
+    leader, = _run(1, lambda: results.append(_with_deadline(app, 0.01, lambda: coalescer.submit('a'))))
+    wait_until(lambda: coalescer._batch is not None)
+
+    with pytest.raises(DeadlineExceeded):
+        _with_deadline(app, 0.05, lambda: coalescer.submit('b'))
+    release.set()
+    leader.join()
+
+    # leader deadline did not cut write of the whole batch short
+    assert results == ['a']
+    assert sorted(written) == ['a', 'b']
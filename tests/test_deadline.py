@@ -0,0 +1,96 @@
+import json
+import time
+
+import pytest
+import requests
+from flask import g
+
+from seventweets import deadline
+from seventweets.client import PeerClient
+from seventweets.exception import BadRequest, DeadlineExceeded
+
+URL = 'http://peer.test/tweets/1'
+
+
+class RecordingSession:
+    """
+    Session recording timeouts and headers of requests.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def request(self, method, url, timeout, **kwargs):
+        self.calls.append((timeout, kwargs.get('headers') or {}))
+        resp = requests.Response()
+        resp.status_code = 200
+        return resp
+
+
+def _start(app, endpoint, headers=None):
+    with app.test_request_context('/', headers=headers or {}):
+        deadline.start(endpoint)
+        return deadline.remaining()
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({}, 2),
+    ({deadline.HEADER: '0.5'}, 0.5),
+    ({deadline.HEADER: '1000'}, 60),
+    ({deadline.HEADER: 'inf'}, 60),
+])
+def test_deadline_of_request(app, headers, expected):
+    assert _start(app, 'read', headers) == pytest.approx(expected, abs=0.1)
+
+
+def test_endpoint_without_deadline(app):
+    assert _start(app, 'stream') is None
+    with app.app_context():
+        assert deadline.remaining() is None
+    assert deadline.remaining() is None
+
+
+@pytest.mark.parametrize('header', ['abc', '0', '-1', 'nan', ''])
+def test_invalid_header_is_rejected(app, header):
+    with pytest.raises(BadRequest):
+        _start(app, 'read', {deadline.HEADER: header})
+
+    resp = app.test_client().get('/tweets/1', headers={deadline.HEADER: header})
+    assert resp.status_code == 400
+
+
+def test_request_past_deadline_gets_504(app, monkeypatch):
+    controller = app.extensions['admission']
+    acquire = controller.acquire
+
+    def slow_acquire(*args):
+        # request waits in admission queue until its deadline passes
+        acquire(*args)
+        time.sleep(0.02)
+    monkeypatch.setattr(controller, 'acquire', slow_acquire)
+
+    resp = app.test_client().post('/tweets/create', data=json.dumps({'tweet': 'late'}),
+                                  content_type='application/json', headers={deadline.HEADER: '0.01'})
+
+    assert resp.status_code == 504
+    assert json.loads(resp.data)['code'] == 504
+
+
+def test_peer_request_gets_remaining_time(app):
+    session = RecordingSession()
+    client = PeerClient(pool_peers=1, pool_size=1, connect_timeout=1, read_timeout=5, retries=0,
+                        backoff=0, max_backoff=0, breaker_failures=5, breaker_reset=1)
+    client._session = session
+
+    with app.app_context():
+        g.deadline = time.monotonic() + 2
+        client.get(URL)
+        g.deadline = time.monotonic() - 1
+        with pytest.raises(DeadlineExceeded):
+            client.get(URL)
+
+    (connect, read), headers = session.calls[0]
+    assert connect == 1
+    assert 1.5 < read <= 2
+    assert 1.5 < float(headers[deadline.HEADER]) <= 2
+    assert len(session.calls) == 1
@@ -0,0 +1,73 @@
+import json
+from datetime import datetime
+from functools import partial
+
+import pytest
+
+from seventweets.db import get_db, get_ops, project_tweets
+from seventweets.db.backends import memory, sqlite
+from seventweets.exception import BadRequest
+from seventweets.handlers.utils import ensure_fields
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setattr(memory.Database, '_instance', None)
+    client = app.test_client()
+    for content in ('first tweet', 'second tweet'):
+        client.post('/tweets/create', data=json.dumps({'tweet': content}), content_type='application/json')
+    return client
+
+
+def test_ensure_fields_keeps_order_without_duplicates():
+    assert ensure_fields(' tweet,id , tweet') == ('tweet', 'id')
+    assert ensure_fields(None) is None
+    for value in ('password', 'id,,bogus', ','):
+        with pytest.raises(BadRequest):
+            ensure_fields(value)
+
+
+def test_project_tweets():
+    row = (1, 'tweet', 'original', datetime(2017, 1, 1), datetime(2017, 1, 2), None)
+    assert project_tweets([row], ('modified_at', 'id')) == [(datetime(2017, 1, 2), 1)]
+    assert project_tweets([row], None) == [row]
+
+
+@pytest.mark.parametrize('path', ['/tweets/', '/tweets/search'])
+def test_only_requested_fields_are_returned(client, path):
+    tweets = json.loads(client.get(path, query_string={'fields': 'tweet,id'}).data)
+
+    assert sorted(t['tweet'] for t in tweets) == ['first tweet', 'second tweet']
+    assert all(set(t) == {'id', 'tweet'} for t in tweets)
+
+
+def test_all_fields_are_returned_by_default(client):
+    tweets = json.loads(client.get('/tweets/', query_string={'fields': ''}).data)
+
+    assert set(tweets[0]) == {'id', 'type', 'tweet', 'created_at', 'modified_at'}
+
+
+def test_unknown_field_is_rejected(client):
+    resp = client.get('/tweets/', query_string={'fields': 'id,secret'})
+
+    assert resp.status_code == 400
+    assert 'secret' in json.loads(resp.data)['message']
+
+
+def test_sqlite_reads_only_requested_columns(app, tmpdir):
+    path = str(tmpdir.join('tweets.sqlite3'))
+    app.config.update(ST_SQLITE_PATH=path)
+    ops = get_ops('sqlite')
+    with app.app_context():
+        try:
+            db = get_db('sqlite')
+            db.do(partial(ops.insert_tweet, 'projected'))
+
+            (created_at, content), = db.do(partial(ops.get_all_tweets, ('created_at', 'tweet')))
+            found = db.do(partial(ops.search_tweets, 'project', None, None, None, None, None, ('id',)))
+        finally:
+            sqlite.Database._instances.pop(path).close()
+
+    assert isinstance(created_at, datetime)
+    assert content == 'projected'
+    assert found == [(1,)]
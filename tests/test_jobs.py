@@ -0,0 +1,134 @@
+import time
+import threading
+
+import pytest
+
+from seventweets.jobs import Executor
+
+
+@pytest.fixture
+def executor(app):
+    executor = Executor(app, workers=2, queue_size=10, retries=2, backoff=0.05, max_backoff=1)
+    yield executor
+    executor.shutdown(1)
+
+
+def test_failed_job_is_retried_with_backoff(executor, wait_until):
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise RuntimeError('try again')
+
+    assert executor.submit(flaky)
+    wait_until(lambda: executor.completed == 1)
+
+    assert len(attempts) == 3
+    assert executor.retried == 2
+    assert executor.failed == 0
+    # backoff doubles after every failure
+    assert attempts[1] - attempts[0] >= 0.05
+    assert attempts[2] - attempts[1] >= 0.1
+
+
+def test_job_fails_after_retries_are_exhausted(executor, wait_until):
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise RuntimeError('broken')
+
+    executor.submit(broken, retries=1)
+    wait_until(lambda: executor.failed == 1)
+    assert len(attempts) == 2
+
+
+def test_job_runs_with_app_context(executor, wait_until):
+    from flask import current_app
+    names = []
+    executor.submit(lambda: names.append(current_app.name))
+    wait_until(lambda: names)
+    assert names == ['seventweets']
+
+
+def test_job_is_rejected_when_queue_is_full(app):
+    executor = Executor(app, workers=1, queue_size=1, retries=0, backoff=0, max_backoff=0)
+    release = threading.Event()
+    try:
+        assert executor.submit(release.wait, 5)
+        # worker might not have taken the first job yet
+        accepted = [executor.submit(lambda: None) for _ in range(3)]
+        assert not all(accepted)
+        assert executor.rejected >= 1
+    finally:
+        release.set()
+        executor.shutdown(1)
+
+
+def test_shutdown_drains_queued_jobs(app):
+    executor = Executor(app, workers=1, queue_size=10, retries=0, backoff=0, max_backoff=0)
+    done = []
+    executor.submit(time.sleep, 0.05)
+    for i in range(5):
+        executor.submit(done.append, i)
+
+    executor.shutdown(5)
+
+    assert done == [0, 1, 2, 3, 4]
+    assert not executor.submit(done.append, 5)
+
+
+def test_shutdown_runs_hooks_before_draining(app):
+    executor = Executor(app, workers=1, queue_size=10, retries=0, backoff=0, max_backoff=0)
+    done = []
+    executor.on_shutdown(lambda: executor.submit(done.append, 'flushed'))
+    executor.submit(done.append, 'queued')
+
+    executor.shutdown(5)
+
+    assert done == ['queued', 'flushed']
+
+
+def test_shutdown_drops_pending_retries(app, wait_until):
+    executor = Executor(app, workers=1, queue_size=10, retries=5, backoff=60, max_backoff=60)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise RuntimeError('broken')
+
+    executor.submit(broken)
+    wait_until(lambda: executor.retried == 1)
+
+    start = time.monotonic()
+    executor.shutdown(5)
+
+    assert time.monotonic() - start < 1
+    assert attempts == [1]
+
+
+def test_shutdown_gives_up_after_timeout(app):
+    executor = Executor(app, workers=1, queue_size=10, retries=0, backoff=0, max_backoff=0)
+    release = threading.Event()
+    executor.submit(release.wait, 5)
+    start = time.monotonic()
+    executor.shutdown(0.1)
+    release.set()
+    assert time.monotonic() - start < 1
+
+
+def test_periodic_job_runs_are_not_overlapping(executor, wait_until):
+    running = []
+    overlaps = []
+
+    def periodic():
+        if running:
+            overlaps.append(1)
+        running.append(1)
+        time.sleep(0.02)
+        running.pop()
+
+    executor.schedule('periodic', periodic, 0.001)
+    wait_until(lambda: executor.completed >= 5)
+    assert overlaps == []
@@ -0,0 +1,78 @@
+import pytest
+
+from seventweets import loadtest
+from seventweets.db.backends import memory
+
+
+class FixedTransport:
+    """
+    Answers every request with the same status, records requests.
+    """
+
+    def __init__(self, status=200, body=None):
+        self.status = status
+        self.body = body
+        self.requests = []
+
+    def request(self, method, path, json=None, params=None):
+        self.requests.append((method, path))
+        return self.status, self.body
+
+
+def test_parse_mix():
+    assert loadtest.parse_mix('read=3, search=1,') == {'read': 3.0, 'search': 1.0}
+    for mix in ('read=1,tweet=2', 'read=x', 'read=0', ''):
+        with pytest.raises(ValueError):
+            loadtest.parse_mix(mix)
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile(values, 100) == 100
+    assert loadtest.percentile([], 50) == 0.0
+
+
+def test_operation_without_known_tweet_falls_back_to_create():
+    test = loadtest.LoadTest(FixedTransport, {'delete': 1}, concurrency=1, max_requests=1)
+    transport = FixedTransport(201, {'id': 7})
+
+    assert test._request(transport, 'delete') == ('create', loadtest.OK)
+    assert test._request(transport, 'delete') == ('delete', loadtest.OK)
+    assert transport.requests == [('POST', '/tweets/create'), ('DELETE', '/tweets/7')]
+
+
+@pytest.mark.parametrize('status, outcome', [
+    (200, loadtest.OK),
+    (429, loadtest.REJECTED),
+    (503, loadtest.REJECTED),
+    (500, loadtest.ERROR),
+    (404, loadtest.ERROR),
+])
+def test_outcome_of_status(status, outcome):
+    test = loadtest.LoadTest(FixedTransport, {'list': 1}, concurrency=1, max_requests=1)
+    assert test._request(FixedTransport(status), 'list') == ('list', outcome)
+
+
+def test_rate_schedules_requests_at_fixed_intervals():
+    test = loadtest.LoadTest(FixedTransport, {'list': 1}, concurrency=2, rate=100, max_requests=10)
+
+    elapsed = test.run()
+
+    assert elapsed >= 0.09
+    assert test.stats.report(elapsed)[-1][1] == 10
+
+
+def test_mixed_workload_against_app(app, monkeypatch):
+    monkeypatch.setattr(memory.Database, '_instance', None)
+    mix = loadtest.parse_mix('create=10,modify=5,delete=2,read=40,list=5,search=30')
+    test = loadtest.LoadTest(lambda: loadtest.AppTransport(app), mix, concurrency=4, max_requests=200)
+
+    elapsed = test.run()
+    rows = test.stats.report(elapsed)
+
+    name, count, error_rate, rejected_rate, *_ = rows[-1]
+    assert (name, count) == ('total', 200)
+    assert error_rate == 0
+    assert 'total' in loadtest.format_report(rows, elapsed)
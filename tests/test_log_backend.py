@@ -0,0 +1,107 @@
+import atexit
+from functools import partial
+
+import pytest
+
+from seventweets import app as application, config
+from seventweets.db import get_db, get_ops
+from seventweets.db.backends import log
+
+ops = get_ops('log')
+
+
+@pytest.fixture
+def log_app(app, tmpdir):
+    app.config.update(ST_LOG_DIR=str(tmpdir), ST_LOG_FSYNC=False, ST_LOG_SEGMENT_SIZE=4096)
+    with app.app_context():
+        yield app
+        _close(get_db('log'))
+
+
+def _close(storage):
+    """
+    Closes storage like process exit would, so it can be opened again.
+    """
+    storage.checkpoint()
+    atexit.unregister(storage.checkpoint)
+    log.Database._instances.pop(storage.path)
+    for f in storage._segments.values():
+        f.close()
+    storage._index.close()
+    storage._index_file.close()
+    storage._lock_file.close()
+
+
+def _insert(n):
+    return get_db('log').do(partial(ops.insert_tweets, [(f'tweet {i}', 'original', None) for i in range(n)]))
+
+
+def _changes(since, limit=10000):
+    return get_db('log').do(partial(ops.get_changes, since, limit))
+
+
+def test_log_backend_requires_single_worker(monkeypatch):
+    monkeypatch.setattr(application, 'default_backend', 'log')
+    monkeypatch.setattr(config, 'ST_WORKERS', '4')
+    with pytest.raises(ValueError):
+        application.create_app()
+
+
+def test_tweets_survive_reopening(log_app):
+    created = _insert(3)
+    storage = get_db('log')
+    storage.do(partial(ops.modify_tweet, created[0][0], 'modified'))
+    storage.do(partial(ops.delete_tweet, created[1][0]))
+    _close(storage)
+
+    storage = get_db('log')
+    assert storage.do(partial(ops.get_tweet, created[0][0]))[1] == 'modified'
+    assert storage.do(partial(ops.get_tweet, created[1][0])) is None
+    assert storage.do(partial(ops.get_tweet, created[2][0]))[1] == 'tweet 2'
+    assert storage.do(partial(ops.count_tweets, 'original')) == 2
+
+
+def test_changes_across_segments_and_reopening(log_app):
+    _insert(100)
+    # segments are small, so changes span several of them
+    assert len(get_db('log')._segments) > 1
+    _close(get_db('log'))
+    _insert(100)
+
+    changes = _changes(0)
+    assert [c[0] for c in changes] == list(range(1, 201))
+    assert [c[0] for c in _changes(150)] == list(range(151, 201))
+    assert [c[0] for c in _changes(42, limit=3)] == [43, 44, 45]
+
+
+def test_changes_after_compaction(log_app):
+    created = _insert(10)
+    for row in created[:5]:
+        get_db('log').do(partial(ops.delete_tweet, row[0]))
+    last = get_db('log').do(ops.last_change_seq)
+    assert get_db('log').compact(force=True)
+    _insert(1)
+
+    # deleted tweets are gone from log, the rest keep their changes
+    assert [c[3] for c in _changes(0)] == [row[0] for row in created[5:]] + [created[-1][0] + 1]
+    assert [c[0] for c in _changes(last)] == [last + 1]
+
+
+def test_recent_changes_are_read_without_scanning_whole_log(log_app, monkeypatch):
+    # all records are in single segment
+    log_app.config['ST_LOG_SEGMENT_SIZE'] = 64 * 1024 * 1024
+    _insert(1000)
+    storage = get_db('log')
+    last = storage.do(ops.last_change_seq)
+    _insert(1)
+    scanned = []
+    scan = storage._scan
+
+    def counting_scan(*args, **kwargs):
+        for item in scan(*args, **kwargs):
+            scanned.append(item)
+            yield item
+
+    monkeypatch.setattr(storage, '_scan', counting_scan)
+    assert [c[0] for c in _changes(last)] == [last + 1]
+    assert len(scanned) <= log._SEQ_MARK_INTERVAL + 1
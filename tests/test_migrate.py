@@ -0,0 +1,138 @@
+import types
+import threading
+from functools import partial
+
+import pytest
+
+from seventweets.db import get_db, get_ops
+from seventweets.migrate import MigrationManager
+
+UP = MigrationManager.UP
+DOWN = MigrationManager.DOWN
+
+
+def _ids(applied):
+    return [migration_id for migration_id, _, _ in applied]
+
+
+def _migration(id_, upgrade, **attrs):
+    """
+    Returns migration module with provided `upgrade` and attributes.
+    """
+    migration = types.ModuleType(f'test_migration_{id_}')
+    migration.id = id_
+    migration.upgrade = upgrade
+    migration.downgrade = lambda cursor: None
+    for name, value in attrs.items():
+        setattr(migration, name, value)
+    return migration
+
+
+def test_upgrade_applies_all_migrations(pg_app):
+    manager = MigrationManager(backend='pg')
+    applied = manager.migrate(UP)
+
+    assert _ids(applied) == [m.id for m in manager.migrations]
+    assert manager.status() == (manager.migrations[-1].id, 0)
+    # schema is usable after backfills replaced tables
+    row = get_db('pg').do(partial(get_ops('pg').insert_tweet, 'migrated'))
+    assert row[1] == 'migrated'
+
+
+def test_upgrade_of_up_to_date_database_does_nothing(pg_app):
+    MigrationManager(backend='pg').migrate(UP)
+    assert MigrationManager(backend='pg').migrate(UP) == []
+
+
+def test_concurrent_upgrades_apply_each_migration_once(pg_app):
+    results, errors = [], []
+
+    def upgrade():
+        with pg_app.app_context():
+            try:
+                results.append(MigrationManager(backend='pg').migrate(UP))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=upgrade) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    applied = sorted(migration_id for r in results for migration_id in _ids(r))
+    assert applied == [m.id for m in MigrationManager.collect_migrations()]
+
+
+def test_downgrade_reverts_latest_migration(pg_app):
+    manager = MigrationManager(backend='pg')
+    manager.migrate(UP)
+    latest, previous = manager.migrations[-1], manager.migrations[-2]
+
+    assert _ids(manager.migrate(DOWN)) == [latest.id]
+    assert manager.current_version() == previous.id
+    assert _ids(manager.migrate(UP)) == [latest.id]
+
+
+def test_version_of_non_transactional_migration_survives_failure_of_next(pg_app):
+    manager = MigrationManager(backend='pg')
+    manager.migrate(UP)
+    last = manager.migrations[-1].id
+
+    def create_index(cursor):
+        cursor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS tweet_ids_test_idx ON tweet_ids (id);')
+
+    def fail(cursor):
+        raise RuntimeError('migration failed')
+
+    manager.migrations = manager.migrations + [
+        _migration(last + 1, create_index, transactional=False),
+        _migration(last + 2, fail),
+    ]
+    with pytest.raises(RuntimeError):
+        manager.migrate(UP)
+
+    assert manager.current_version() == last + 1
+
+
+def test_interrupted_backfill_resumes_from_stored_position(pg_app):
+    manager = MigrationManager(backend='pg')
+    manager.migrate(UP)
+    last = manager.migrations[-1].id
+    calls = []
+
+    def upgrade(cursor):
+        cursor.execute('CREATE TABLE backfilled (id INTEGER PRIMARY KEY, done BOOLEAN NOT NULL DEFAULT false);')
+        cursor.execute('INSERT INTO backfilled (id) SELECT generate_series(1, 5);')
+
+    def backfill(cursor, after, limit):
+        calls.append(after)
+        if len(calls) == 2:
+            raise RuntimeError('backfill interrupted')
+        cursor.execute('''
+            UPDATE backfilled SET done = true WHERE id IN (
+                SELECT id FROM backfilled WHERE id > %s ORDER BY id LIMIT %s
+            ) RETURNING id;
+        ''', (after or 0, limit))
+        ids = [row[0] for row in cursor.fetchall()]
+        return max(ids) if ids else None
+
+    manager.migrations = manager.migrations + [_migration(last + 1, upgrade, backfill=backfill, batch_size=2)]
+    with pytest.raises(RuntimeError):
+        manager.migrate(UP)
+    # migration itself is applied, its backfill is not finished
+    assert manager.status() == (last + 1, 1)
+
+    resumed = MigrationManager(backend='pg')
+    resumed.migrations = manager.migrations
+    assert resumed.migrate(UP) == []
+
+    assert calls == [None, 2, 2, 4, 5]
+    assert resumed.status() == (last + 1, 0)
+
+    def count_done(cursor):
+        cursor.execute('SELECT count(*) FROM backfilled WHERE done;')
+        return cursor.fetchone()[0]
+
+    assert get_db('pg').do(count_done) == 5
@@ -0,0 +1,115 @@
+import json
+import fcntl
+
+import pytest
+import requests
+
+from seventweets import mirror
+from seventweets.db import get_connection
+from seventweets.db.backends import memory
+
+PEER = 'http://peer.test'
+
+
+def _change(seq, op, id_, content=None, type_='original', reference=None):
+    tweet = None
+    if op != 'delete':
+        tweet = {'id': id_, 'tweet': content, 'type': type_, 'reference': reference,
+                 'created_at': '2017-03-01T10:00:00.000000Z', 'modified_at': '2017-03-01T10:00:00.000000Z'}
+    return {'seq': seq, 'op': op, 'id': id_, 'changed_at': None, 'tweet': tweet}
+
+
+class FakePeer:
+    """
+    Client answering change feed requests from list of changes.
+    """
+
+    def __init__(self, changes):
+        self.changes = changes
+        self.requested = []
+
+    def get(self, url, params=None, **kwargs):
+        self.requested.append(params['since'])
+        page = [c for c in self.changes if c['seq'] > params['since']][:params['limit']]
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.headers['Content-Type'] = 'application/json'
+        resp._content = json.dumps({
+            'changes': page,
+            'last_seq': page[-1]['seq'] if page else params['since'],
+        }).encode('utf-8')
+        return resp
+
+
+@pytest.fixture
+def mirror_app(app):
+    app.config['ST_MIRROR_PEERS'] = PEER
+    with app.app_context():
+        yield app
+    storage = memory.Database()
+    storage.peer_sync.pop(PEER, None)
+    for key in [k for k in storage.peer_tweets if k[0] == PEER]:
+        del storage.peer_tweets[key]
+
+
+def _mirrored():
+    return {id_: t for (peer, id_), t in memory.Database().peer_tweets.items() if peer == PEER}
+
+
+def test_mirror_applies_changes_incrementally(mirror_app):
+    peer = FakePeer([
+        _change(1, 'create', 1, 'first'),
+        _change(2, 'create', 2, 'second'),
+        _change(3, 'create', 3, 'retweet', type_='retweet', reference='other#7'),
+    ])
+    mirror_app.extensions['http_client'] = peer
+    mirror.sync_all()
+    assert sorted(_mirrored()) == [1, 2, 3]
+    assert _mirrored()[3].reference == 'other#7'
+
+    peer.changes += [_change(4, 'modify', 1, 'first, modified'), _change(5, 'delete', 2)]
+    mirror.sync_all()
+
+    assert peer.requested == [0, 3]
+    assert sorted(_mirrored()) == [1, 3]
+    assert _mirrored()[1].tweet == 'first, modified'
+
+
+def test_mirror_pulls_changes_in_pages(mirror_app, monkeypatch):
+    monkeypatch.setattr(mirror, 'CHANGES_PAGE', 2)
+    peer = FakePeer([_change(seq, 'create', seq, f'tweet {seq}') for seq in range(1, 6)])
+    mirror_app.extensions['http_client'] = peer
+
+    assert mirror.sync_peer(PEER) == 5
+    assert peer.requested == [0, 2, 4]
+
+
+def test_single_worker_syncs_shared_storage(mirror_app, monkeypatch, tmpdir):
+    monkeypatch.setattr(mirror, 'default_backend', 'sqlite')
+    monkeypatch.setattr(mirror, '_lock', None)
+    mirror_app.config['ST_SQLITE_PATH'] = str(tmpdir.join('seventweets.sqlite3'))
+
+    # other worker holds the lock
+    other = open(mirror_app.config['ST_SQLITE_PATH'] + '.mirror-lock', 'a')
+    fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    assert not mirror.is_leader()
+
+    # lock is released when worker holding it exits
+    other.close()
+    assert mirror.is_leader()
+    assert mirror.is_leader()
+    mirror._lock.close()
+
+
+def test_single_worker_syncs_postgres(pg_app, monkeypatch):
+    monkeypatch.setattr(mirror, 'default_backend', 'pg')
+    monkeypatch.setattr(mirror, '_lock', None)
+
+    other = get_connection('pg')
+    assert other.do(mirror._try_lock)
+    assert not mirror.is_leader()
+
+    other.cleanup()
+    assert mirror.is_leader()
+    assert mirror.is_leader()
+    mirror._lock.cleanup()
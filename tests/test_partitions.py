@@ -0,0 +1,68 @@
+import threading
+from functools import partial
+
+from seventweets.db import get_db, get_ops
+from seventweets.migrate import MigrationManager
+
+
+def _query(sql, *args):
+    def run(cursor):
+        cursor.execute(sql, args)
+        return [tuple(row) for row in cursor.fetchall()]
+    return get_db('pg').do(run)
+
+
+def _month_name(months_ahead):
+    return _query(f'''
+        SELECT 'tweets_' || to_char(date_trunc('month', now()) + interval '{months_ahead} months', 'YYYY_MM');
+    ''')[0][0]
+
+
+def _ensure_partitions(months_ahead):
+    return get_db('pg').do(partial(get_ops('pg').ensure_partitions, months_ahead))
+
+
+def test_rows_in_default_partition_are_moved_to_created_partition(pg_app):
+    MigrationManager(backend='pg').migrate(MigrationManager.UP)
+    tweet_id = _query('''
+        INSERT INTO tweets (tweet, created_at)
+        VALUES ('from future', date_trunc('month', now()) + interval '5 months 1 day')
+        RETURNING id;
+    ''')[0][0]
+    assert _query('SELECT tableoid::regclass::text FROM tweets WHERE id = %s;', tweet_id) == [('tweets_default',)]
+
+    assert _ensure_partitions(5) == 2
+
+    assert _query('SELECT tableoid::regclass::text FROM tweets WHERE id = %s;', tweet_id) == [(_month_name(5),)]
+    # row was moved, not deleted and created again
+    assert _query('SELECT op FROM tweet_changes WHERE tweet_id = %s;', tweet_id) == [('create',)]
+    assert _query('SELECT id FROM tweet_ids WHERE id = %s;', tweet_id) == [(tweet_id,)]
+
+
+def test_concurrent_partition_creation(pg_app):
+    MigrationManager(backend='pg').migrate(MigrationManager.UP)
+    created, errors = [], []
+
+    def ensure():
+        with pg_app.app_context():
+            try:
+                created.append(_ensure_partitions(8))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=ensure) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert sum(created) == 5
+
+
+def test_partitions_are_not_created_before_tweets_are_partitioned(pg_app):
+    manager = MigrationManager(backend='pg')
+    manager.migrations = [m for m in manager.migrations if m.id < 6]
+    manager.migrate(MigrationManager.UP)
+
+    assert _ensure_partitions(3) == 0
@@ -0,0 +1,186 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from seventweets.db import get_db
+from seventweets.db.backends import pg
+from seventweets.db.backends.pg import Pool
+
+THREADS = 16
+CALLS = 20
+
+GEVENT_SCRIPT = '''
+from gevent import monkey
+monkey.patch_all()
+
+import json
+import gevent
+from seventweets.app import create_app
+from seventweets.db import get_db
+from seventweets.db.backends.pg import pool_stats
+
+app = create_app()
+active, shared, pids, errors = set(), [], set(), []
+
+
+def query(cursor):
+    cursor.execute('SELECT pg_backend_pid()')
+    pid = cursor.fetchone()[0]
+    if pid in active:
+        shared.append(pid)
+    active.add(pid)
+    try:
+        cursor.execute('SELECT pg_sleep(0.005)')
+    finally:
+        active.discard(pid)
+    return pid
+
+
+def work():
+    with app.app_context():
+        for _ in range({calls}):
+            try:
+                pids.add(get_db().do(query))
+            except Exception as e:
+                errors.append(repr(e))
+
+
+gevent.joinall([gevent.spawn(work) for _ in range({greenlets})])
+with app.app_context():
+    print(json.dumps({{'errors': errors, 'shared': shared, 'pids': len(pids),
+                      'stats': pool_stats()['primary']}}))
+'''
+
+
+class Recorder:
+    """
+    Records connections in use, to find connection used by two callers at
+    the same time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = set()
+        self.shared = []
+        self.errors = []
+        self.used = set()
+
+    def enter(self, key):
+        with self.lock:
+            if key in self.active:
+                self.shared.append(key)
+            self.active.add(key)
+            self.used.add(key)
+
+    def exit(self, key):
+        with self.lock:
+            self.active.discard(key)
+
+
+class FakeConnection:
+    """
+    Connection guarded the same way as `pg.Database`.
+    """
+
+    def __init__(self):
+        self.broken = False
+        self._guard = threading.Lock()
+
+    def do(self, fn):
+        if not self._guard.acquire(blocking=False):
+            raise RuntimeError('Database connection is used by two callers at the same time.')
+        try:
+            return fn(self)
+        finally:
+            self._guard.release()
+
+    def cleanup(self):
+        pass
+
+
+def _run_threads(work):
+    threads = [threading.Thread(target=work) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+
+def test_pool_never_shares_connection_between_threads():
+    pool = Pool(FakeConnection, size=4, max_connections=THREADS, timeout=5)
+    recorder = Recorder()
+
+    def query(connection):
+        recorder.enter(id(connection))
+        try:
+            time.sleep(0.001)
+        finally:
+            recorder.exit(id(connection))
+
+    def work():
+        for _ in range(CALLS):
+            try:
+                pool.do(query)
+            except Exception as e:
+                recorder.errors.append(e)
+
+    _run_threads(work)
+
+    assert recorder.errors == []
+    assert recorder.shared == []
+    assert 1 < pool.max_in_use <= THREADS
+    assert pool.in_use == 0
+    assert len(pool._idle) <= 4
+
+
+def test_concurrent_calls_get_own_connections(pg_app, monkeypatch):
+    monkeypatch.setattr(pg, '_pools', {})
+    recorder = Recorder()
+
+    def query(cursor):
+        cursor.execute('SELECT pg_backend_pid()')
+        pid = cursor.fetchone()[0]
+        recorder.enter(pid)
+        try:
+            cursor.execute('SELECT pg_sleep(0.005)')
+        finally:
+            recorder.exit(pid)
+
+    def work():
+        with pg_app.app_context():
+            for _ in range(CALLS):
+                try:
+                    get_db('pg').do(query)
+                except Exception as e:
+                    recorder.errors.append(e)
+
+    _run_threads(work)
+
+    stats = pg.pool_stats()['primary']
+    assert recorder.errors == []
+    assert recorder.shared == []
+    assert 1 < stats['max_in_use'] <= THREADS
+    assert 0 < len(recorder.used) <= stats['opened']
+    assert stats['in_use'] == 0
+    pg._pools[None].close()
+
+
+def test_concurrent_calls_get_own_connections_under_gevent(pg_app, postgresql):
+    pytest.importorskip('gevent')
+    dsn = postgresql.dsn()
+    env = dict(os.environ, ST_DB_BACKEND='pg', ST_WORKER_MODEL='gevent', ST_DB_HOST=dsn['host'],
+               ST_DB_PORT=str(dsn['port']), ST_DB_USER=dsn['user'], ST_DB_NAME=dsn['database'])
+    script = GEVENT_SCRIPT.format(calls=CALLS, greenlets=THREADS)
+    out = subprocess.run([sys.executable, '-c', script], env=env, stdout=subprocess.PIPE,
+                         check=True, timeout=60).stdout
+    result = json.loads(out.decode().splitlines()[-1])
+
+    assert result['errors'] == []
+    assert result['shared'] == []
+    assert 1 < result['stats']['max_in_use'] <= THREADS
+    assert 0 < result['pids'] <= result['stats']['opened']
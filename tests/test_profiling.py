@@ -0,0 +1,75 @@
+import json
+import threading
+import time
+
+import pytest
+
+from seventweets import config
+from seventweets.app import create_app
+
+TOKEN = {'X-Api-Token': 'secret'}
+
+
+@pytest.fixture
+def profiled_app(monkeypatch):
+    monkeypatch.setattr(config, 'ST_PROFILING', True)
+    monkeypatch.setattr(config, 'ST_API_TOKEN', 'secret')
+    app = create_app()
+    yield app
+    app.extensions['executor'].shutdown(1)
+
+
+def _start(client, **args):
+    resp = client.post('/admin/profile', query_string=args, headers=TOKEN)
+    return resp.status_code, json.loads(resp.data)
+
+
+def test_profiling_requires_token_to_start(monkeypatch):
+    monkeypatch.setattr(config, 'ST_PROFILING', True)
+    with pytest.raises(ValueError):
+        create_app()
+
+
+def test_profile_endpoints_require_token(profiled_app):
+    client = profiled_app.test_client()
+    assert client.post('/admin/profile', query_string={'requests': 1}).status_code == 401
+    assert client.get('/admin/profile', headers={'X-Api-Token': 'wrong'}).status_code == 401
+
+
+def test_profile_of_requests(profiled_app):
+    client = profiled_app.test_client()
+    code, state = _start(client, requests=2)
+    assert code == 202 and state['state'] == 'running'
+    for _ in range(2):
+        assert client.get('/tweets/').status_code == 200
+
+    resp = client.get('/admin/profile', query_string={'format': 'pstats'}, headers=TOKEN)
+    assert resp.status_code == 200
+    assert resp.headers['X-Profile-State'] == 'finished'
+    assert resp.headers['X-Profile-Requests'] == '2'
+    assert 'get_all' in resp.data.decode()
+
+
+def test_wait_is_ignored_by_sync_worker(profiled_app):
+    profiled_app.config['ST_WORKER_MODEL'] = 'sync'
+    start = time.monotonic()
+    code, state = _start(profiled_app.test_client(), seconds=5, wait='true')
+
+    assert time.monotonic() - start < 1
+    assert code == 202 and state['state'] == 'running'
+    assert str(state['pid']) in state['note']
+
+
+def test_wait_returns_finished_profile(profiled_app, wait_until):
+    profiled_app.config['ST_WORKER_MODEL'] = 'gthread'
+    result = {}
+    starter = threading.Thread(target=lambda: result.update(
+        response=_start(profiled_app.test_client(), requests=1, wait='true')))
+    starter.start()
+    wait_until(lambda: profiled_app.extensions['profiler'].session is not None)
+    profiled_app.test_client().get('/tweets/')
+    starter.join(5)
+
+    code, state = result['response']
+    assert code == 200
+    assert state['state'] == 'finished' and state['requests'] == 1
@@ -0,0 +1,213 @@
+import io
+import json
+import threading
+import ipaddress
+from functools import partial
+
+import pytest
+import requests
+
+from seventweets import push, config
+from seventweets.app import create_app
+from seventweets.db import get_db, get_ops
+from seventweets.db.backends import memory
+from seventweets.jobs import Executor
+from seventweets.push import Pusher, check_callback, pin_address
+
+CALLBACK = 'http://subscriber.test/changes'
+
+
+class RecordingClient:
+    """
+    Records payloads posted to subscribers, failing first `failures` posts.
+    """
+
+    def __init__(self, failures=0, status=200):
+        self.failures = failures
+        self.status = status
+        self.payloads = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def post(self, url, data, **kwargs):
+        with self.lock:
+            self.requests.append((url, kwargs))
+            if self.failures:
+                self.failures -= 1
+                raise requests.ConnectionError('subscriber is down')
+            self.payloads.append(json.loads(data))
+        resp = requests.Response()
+        resp.status_code = self.status
+        resp.raw = io.BytesIO()
+        return resp
+
+    def ids(self):
+        return [e['id'] for p in self.payloads for e in p['events']]
+
+
+@pytest.fixture
+def executor(app):
+    executor = Executor(app, workers=2, queue_size=100, retries=0, backoff=0, max_backoff=0)
+    yield executor
+    executor.shutdown(1)
+
+
+def _pusher(app, executor, client, monkeypatch, **kwargs):
+    monkeypatch.setattr(push, 'pinned_session', lambda hostname: client)
+    options = dict(delay=60, batch_size=2, max_pending=100, backoff=0.01, max_backoff=0.05,
+                   evict_after=60, timeout=1, allow_private=True)
+    options.update(kwargs)
+    with app.app_context():
+        get_db().do(partial(get_ops().add_subscription, CALLBACK))
+    return Pusher(executor, **options)
+
+
+def _publish(app, pusher, ids):
+    for id_ in ids:
+        pusher.publish({'op': 'create', 'id': id_, 'tweet': None})
+    with app.app_context():
+        pusher.flush()
+
+
+def test_events_are_delivered_in_order_in_batches(app, executor, wait_until, monkeypatch):
+    client = RecordingClient()
+    pusher = _pusher(app, executor, client, monkeypatch)
+
+    _publish(app, pusher, [1, 2, 3])
+    _publish(app, pusher, [4, 5])
+    wait_until(lambda: pusher.delivered == 5)
+
+    assert client.ids() == [1, 2, 3, 4, 5]
+    assert all(len(p['events']) <= 2 for p in client.payloads)
+    assert client.payloads[0]['server'] == {'name': 'test', 'address': 'http://test'}
+
+
+def test_failed_delivery_is_retried_without_reordering(app, executor, wait_until, monkeypatch):
+    client = RecordingClient(failures=2)
+    pusher = _pusher(app, executor, client, monkeypatch)
+
+    _publish(app, pusher, [1, 2, 3])
+    wait_until(lambda: pusher.delivered == 3)
+
+    assert client.ids() == [1, 2, 3]
+    assert pusher.failed == 2
+    assert pusher.stats()['subscribers'][0]['failures'] == 0
+
+
+def test_dropped_events_are_reported(app, executor, wait_until, monkeypatch):
+    client = RecordingClient()
+    pusher = _pusher(app, executor, client, monkeypatch, max_pending=3, batch_size=10)
+
+    _publish(app, pusher, [1, 2, 3, 4, 5])
+    wait_until(lambda: pusher.delivered == 3)
+
+    assert client.ids() == [3, 4, 5]
+    assert client.payloads[0]['dropped'] == 2
+
+
+def test_failing_subscriber_is_evicted(app, executor, wait_until, monkeypatch):
+    client = RecordingClient(failures=1000)
+    pusher = _pusher(app, executor, client, monkeypatch, evict_after=0.05)
+
+    _publish(app, pusher, [1])
+    with app.app_context():
+        wait_until(lambda: get_db().do(get_ops().get_subscriptions) == [])
+
+    assert pusher.evicted == 1
+    assert pusher.stats()['subscribers'] == []
+
+
+def test_unsubscribed_callback_gets_no_more_events(app, executor, wait_until, monkeypatch):
+    client = RecordingClient()
+    pusher = _pusher(app, executor, client, monkeypatch)
+    _publish(app, pusher, [1])
+    wait_until(lambda: pusher.delivered == 1)
+
+    with app.app_context():
+        (id_, _, _), = get_db().do(get_ops().get_subscriptions)
+        get_db().do(partial(get_ops().delete_subscription, id_))
+    pusher.forget(id_)
+    _publish(app, pusher, [2])
+
+    assert pusher.stats()['subscribers'] == []
+    assert client.ids() == [1]
+
+
+@pytest.mark.parametrize('callback', [
+    'ftp://example.com/changes',
+    'http:///changes',
+    'http://127.0.0.1/changes',
+    'http://169.254.169.254/latest/meta-data',
+    'http://[::ffff:10.0.0.1]/changes',
+])
+def test_callback_on_non_public_address_is_rejected(callback):
+    with pytest.raises(ValueError):
+        check_callback(callback)
+
+
+def test_callback_on_private_address_is_allowed_when_configured():
+    check_callback('http://127.0.0.1/changes', allow_private=True)
+
+
+def test_redirect_is_failed_delivery(app, executor, wait_until, monkeypatch):
+    client = RecordingClient(status=307)
+    pusher = _pusher(app, executor, client, monkeypatch)
+
+    _publish(app, pusher, [1])
+    wait_until(lambda: pusher.failed >= 1)
+
+    url, kwargs = client.requests[0]
+    assert kwargs['allow_redirects'] is False
+    assert pusher.delivered == 0
+    assert pusher.stats()['subscribers'][0]['pending'] == 1
+
+
+def test_delivery_is_sent_to_checked_address(app, executor, wait_until, monkeypatch):
+    monkeypatch.setattr(push, 'check_callback',
+                        lambda callback, allow_private: ipaddress.ip_address('93.184.216.34'))
+    client = RecordingClient()
+    pusher = _pusher(app, executor, client, monkeypatch)
+
+    _publish(app, pusher, [1])
+    wait_until(lambda: pusher.delivered == 1)
+
+    url, kwargs = client.requests[0]
+    assert url == 'http://93.184.216.34/changes'
+    assert kwargs['headers']['Host'] == 'subscriber.test'
+
+
+@pytest.mark.parametrize('callback, address, expected', [
+    ('https://example.com/changes?a=1', '93.184.216.34', 'https://93.184.216.34/changes?a=1'),
+    ('http://user:pw@example.com:8080/c', '93.184.216.34', 'http://user:pw@93.184.216.34:8080/c'),
+    ('https://example.com/changes', '2606:2800:220:1::1', 'https://[2606:2800:220:1::1]/changes'),
+])
+def test_pin_address_keeps_host_header(callback, address, expected):
+    url, headers = pin_address(callback, ipaddress.ip_address(address))
+
+    assert url == expected
+    assert headers['Host'] in ('example.com', 'example.com:8080')
+
+
+def test_push_requires_token_to_start(monkeypatch):
+    monkeypatch.setattr(config, 'ST_PUSH', True)
+    with pytest.raises(ValueError):
+        create_app()
+
+
+def test_subscribing_requires_token_when_push_is_enabled(monkeypatch):
+    monkeypatch.setattr(config, 'ST_PUSH', True)
+    monkeypatch.setattr(config, 'ST_API_TOKEN', 'secret')
+    monkeypatch.setattr(config, 'ST_PUSH_ALLOW_PRIVATE', True)
+    app = create_app()
+    try:
+        client = app.test_client()
+        body = json.dumps({'callback': CALLBACK})
+        resp = client.post('/subscriptions/', data=body, content_type='application/json')
+        assert resp.status_code == 401
+        resp = client.post('/subscriptions/', data=body, content_type='application/json',
+                           headers={'X-Api-Token': 'secret'})
+        assert resp.status_code == 201
+        assert 'pusher' in app.extensions
+    finally:
+        app.extensions['executor'].shutdown(1)
+        memory.Database().subscriptions.clear()
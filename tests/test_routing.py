@@ -0,0 +1,86 @@
+import json
+import time
+
+import pytest
+
+from seventweets import config
+from seventweets.app import create_app
+from seventweets.db import routing
+
+PRIMARY = {'ST_DB_PORT': 5432, 'ST_DB_USER': 'primary_user', 'ST_DB_PASS': 'secret',
+           'ST_DB_NAME': 'seventweets'}
+
+
+def _router(n=2, strategy=routing.ROUND_ROBIN, **kwargs):
+    replicas = [routing.Replica(f'replica{i}', 5432, 'user', None, 'db') for i in range(n)]
+    options = dict(sticky_seconds=5, retry_after=60)
+    options.update(kwargs)
+    return routing.ReadRouter(replicas, strategy, **options)
+
+
+def test_replicas_take_missing_parts_from_primary():
+    replicas = routing.parse_replicas(' r1 , reader:p%40ss@r2:6432/other,', PRIMARY)
+
+    assert [r.params for r in replicas] == [
+        dict(host='r1', port=5432, user='primary_user', password='secret', database='seventweets'),
+        dict(host='r2', port=6432, user='reader', password='p@ss', database='other'),
+    ]
+    assert routing.parse_replicas('', PRIMARY) == []
+
+
+def test_invalid_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        _router(strategy='random')
+
+
+def test_round_robin_skips_replica_that_is_down():
+    router = _router(3)
+    router.mark_down(router.replicas[1])
+
+    chosen = [router.choose().name for _ in range(4)]
+
+    assert chosen == ['replica0:5432', 'replica2:5432'] * 2
+    for replica in router.replicas:
+        router.mark_down(replica)
+    assert router.choose() is None
+
+
+def test_least_latency_tries_unobserved_replica_first():
+    router = _router(3, strategy=routing.LEAST_LATENCY)
+    router.replicas[0].observe(0.02)
+    router.replicas[2].observe(0.01)
+    assert router.choose() is router.replicas[1]
+
+    router.replicas[1].observe(0.05)
+    assert router.choose() is router.replicas[2]
+
+
+def test_writer_is_sticky_by_key_and_cookie():
+    router = _router(sticky_seconds=0.05)
+    until = router.mark_write('addr:1.2.3.4')
+
+    assert router.is_sticky('addr:1.2.3.4', None)
+    assert router.is_sticky('addr:5.6.7.8', f'{until:.3f}')
+    assert not router.is_sticky('addr:5.6.7.8', 'invalid')
+    time.sleep(0.06)
+    assert not router.is_sticky('addr:1.2.3.4', f'{until:.3f}')
+
+
+def test_write_routes_following_reads_of_client_to_primary(monkeypatch):
+    monkeypatch.setattr(config, 'ST_DB_REPLICAS', 'replica1,replica2')
+    app = create_app()
+    try:
+        client = app.test_client()
+        with app.test_request_context('/', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+            assert not routing.reads_primary()
+            assert routing.choose_replica() is not None
+
+        resp = client.post('/tweets/create', data=json.dumps({'tweet': 'hello'}),
+                           content_type='application/json')
+        assert routing.STICKY_COOKIE in resp.headers['Set-Cookie']
+
+        with app.test_request_context('/', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+            assert routing.reads_primary()
+            assert routing.choose_replica() is None
+    finally:
+        app.extensions['executor'].shutdown(1)
@@ -0,0 +1,119 @@
+import threading
+import time
+from functools import partial
+
+import pytest
+from flask import g
+
+from seventweets.db import get_db, get_ops
+from seventweets.db.backends import sqlite
+from seventweets.exception import DeadlineExceeded
+
+ops = get_ops('sqlite')
+
+
+@pytest.fixture
+def sqlite_app(app, tmpdir):
+    path = str(tmpdir.join('tweets.sqlite3'))
+    app.config.update(ST_SQLITE_PATH=path)
+    with app.app_context():
+        yield app
+        sqlite.Database._instances.pop(path).close()
+
+
+def _insert(*contents):
+    return get_db('sqlite').do(partial(ops.insert_tweets, [(c, 'original', None) for c in contents]))
+
+
+def test_schema_is_created_in_wal_mode(sqlite_app):
+    db = get_db('sqlite')
+
+    assert db.schema_version() == sqlite.SCHEMA[-1][0]
+    assert db.connection.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+    assert db.bootstrap() == []
+
+
+def test_tweet_lifecycle_is_recorded_in_change_log(sqlite_app):
+    db = get_db('sqlite')
+    (id_, content, type_, created_at, modified_at, reference), = _insert('first')
+    assert db.do(partial(ops.get_tweet, id_)) == (id_, 'first', 'original', created_at, modified_at, None)
+
+    assert db.do(partial(ops.modify_tweet, id_, 'changed'))[1] == 'changed'
+    assert db.do(partial(ops.delete_tweet, id_))
+    assert db.do(partial(ops.get_tweet, id_)) is None
+    assert not db.do(partial(ops.delete_tweet, id_))
+
+    changes = db.do(partial(ops.get_changes, 0, 10))
+    assert [(op, tweet_id) for _, op, _, tweet_id, *_ in changes] == [
+        ('create', id_), ('modify', id_), ('delete', id_)]
+    assert db.do(ops.last_change_seq) == changes[-1][0]
+
+
+@pytest.mark.parametrize('content, expected', [
+    ('QUICK', ['The quick fox']),
+    ('ox', ['The quick fox', 'Oxen']),
+    ('slow', []),
+])
+def test_search_matches_substrings_case_insensitively(sqlite_app, content, expected):
+    _insert('The quick fox', 'Oxen', 'lazy dog')
+
+    found = get_db('sqlite').do(partial(ops.search_tweets, content, None, None, None, None, None, None))
+
+    assert sorted(t[1] for t in found) == sorted(expected)
+
+
+def test_search_index_follows_modifications(sqlite_app):
+    (id_, *_), = _insert('old content')
+    get_db('sqlite').do(partial(ops.modify_tweet, id_, 'new content'))
+
+    def search(content):
+        return get_db('sqlite').do(partial(ops.search_tweets, content, None, None, None, None, None, None))
+
+    assert search('old') == []
+    assert [t[0] for t in search('new')] == [id_]
+
+
+def test_tags_are_indexed(sqlite_app):
+    (id_, *_), = _insert('hello #World @alice')
+
+    tagged = get_db('sqlite').do(partial(ops.get_tagged_tweets, 'hashtag', 'world', 10))
+
+    assert [t[0] for t in tagged] == [id_]
+
+
+def test_concurrent_writers_all_succeed(sqlite_app):
+    errors = []
+
+    def write():
+        with sqlite_app.app_context():
+            try:
+                for i in range(20):
+                    _insert(f'tweet {i}')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                get_db('sqlite').close()
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert errors == []
+    assert get_db('sqlite').do(partial(ops.count_tweets, None)) == 160
+
+
+def test_statement_is_interrupted_at_deadline(sqlite_app):
+    g.deadline = time.monotonic() + 0.05
+
+    def slow(cursor):
+        cursor.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+            SELECT count(*) FROM n;
+        ''')
+
+    with pytest.raises(DeadlineExceeded):
+        get_db('sqlite').do(slow)
+    g.deadline = None
+    assert get_db('sqlite').do(partial(ops.count_tweets, None)) == 0
@@ -0,0 +1,97 @@
+import json
+import threading
+
+import pytest
+
+from seventweets import stream
+
+
+@pytest.fixture
+def streaming_app(app):
+    app.config['ST_WORKER_MODEL'] = 'gthread'
+    app.config['ST_STREAM_HEARTBEAT'] = 0.05
+    app.config['ST_STREAM_LISTEN_INTERVAL'] = 0.05
+    yield app
+    assert stream.broker._subscribers == set()
+
+
+def _open(app, **args):
+    return app.test_client().get('/tweets/stream', query_string=args, buffered=False)
+
+
+def _create(app, content):
+    resp = app.test_client().post('/tweets/create', data=json.dumps({'tweet': content}),
+                                  content_type='application/json')
+    assert resp.status_code == 201
+    return json.loads(resp.data)
+
+
+def _next_event(chunks):
+    """
+    Returns (id, event, data) of next event, skipping heartbeats and retry.
+    """
+    for chunk in chunks:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith('id: '):
+            lines = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+            return int(lines['id']), lines['event'], json.loads(lines['data'])
+    pytest.fail('Stream ended without event.')
+
+
+def _last_seq(app):
+    resp = app.test_client().get('/tweets/changes', query_string={'since': 0, 'limit': 1000})
+    return json.loads(resp.data)['last_seq']
+
+
+def test_stream_is_refused_by_sync_worker(app):
+    app.config['ST_WORKER_MODEL'] = 'sync'
+    resp = _open(app)
+    assert resp.status_code == 503
+    assert 'Retry-After' in resp.headers
+
+
+def test_stream_delivers_live_changes(streaming_app):
+    resp = _open(streaming_app)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/event-stream'
+    chunks = iter(resp.response)
+    # first chunk is sent after subscription is registered
+    next(chunks)
+    created = _create(streaming_app, 'live')
+
+    seq, op, data = _next_event(chunks)
+    assert op == 'create'
+    assert data['id'] == created['id'] and data['tweet']['tweet'] == 'live'
+    resp.close()
+
+
+def test_stream_replays_changes_after_last_event_id(streaming_app):
+    since = _last_seq(streaming_app)
+    first = _create(streaming_app, 'missed 1')
+    second = _create(streaming_app, 'missed 2')
+
+    resp = streaming_app.test_client().get('/tweets/stream', headers={'Last-Event-ID': str(since)},
+                                           buffered=False)
+    chunks = iter(resp.response)
+    replayed = [_next_event(chunks) for _ in range(2)]
+    assert [data['id'] for _, _, data in replayed] == [first['id'], second['id']]
+    assert replayed[0][0] > since
+    resp.close()
+
+
+def test_open_streams_are_limited_per_node(streaming_app):
+    streaming_app.config['ST_STREAM_MAX_CLIENTS'] = 4
+    streaming_app.config['ST_WORKERS'] = 2
+
+    # streams hold request context until closed, so they are closed in reverse
+    opened = [_open(streaming_app) for _ in range(2)]
+    assert [r.status_code for r in opened] == [200, 200]
+    rejected = _open(streaming_app)
+    assert rejected.status_code == 503
+
+    # closing stream before any event was read releases its slot
+    opened.pop().close()
+    again = _open(streaming_app)
+    assert again.status_code == 200
+    again.close()
+    opened.pop().close()
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from seventweets.db import extract_tags, HASHTAG, MENTION
+from seventweets.db.backends import memory
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setattr(memory.Database, '_instance', None)
+    return app.test_client()
+
+
+def _create(client, content):
+    resp = client.post('/tweets/create', data=json.dumps({'tweet': content}), content_type='application/json')
+    return json.loads(resp.data)['id']
+
+
+def _tagged(client, tag):
+    resp = client.get(f'/tweets/tags/{tag}')
+    assert resp.status_code == 200
+    return [t['id'] for t in json.loads(resp.data)]
+
+
+@pytest.mark.parametrize('content, expected', [
+    ('#Python and @Alice like #python', [(HASHTAG, 'python'), (MENTION, 'alice')]),
+    ('mail me at bob@example.com, I code C#', []),
+    ('(#first),#second', [(HASHTAG, 'first'), (HASHTAG, 'second')]),
+    (None, []),
+])
+def test_extract_tags(content, expected):
+    assert extract_tags(content) == expected
+
+
+def test_tweets_are_found_by_tag(client):
+    first = _create(client, 'learning #Python with @alice')
+    second = _create(client, 'more #python')
+    _create(client, 'no tags here')
+
+    assert _tagged(client, 'python') == [second, first]
+    assert _tagged(client, '%23PYTHON') == [second, first]
+    assert _tagged(client, '@Alice') == [first]
+    assert _tagged(client, 'alice') == []
+
+
+def test_tag_index_follows_modifications_and_deletes(client):
+    id_ = _create(client, 'about #flask')
+    client.put(f'/tweets/{id_}', data=json.dumps({'tweet': 'about #django'}), content_type='application/json')
+    assert _tagged(client, 'flask') == []
+    assert _tagged(client, 'django') == [id_]
+
+    client.delete(f'/tweets/{id_}')
+    assert _tagged(client, 'django') == []
+
+
+def test_trending_tags(client):
+    for content in ('#a #b', '#a', '#a @c', '#b'):
+        _create(client, content)
+
+    resp = client.get('/tweets/tags', query_string={'limit': 2})
+    assert json.loads(resp.data) == [{'tag': 'a', 'kind': HASHTAG, 'count': 3},
+                                     {'tag': 'b', 'kind': HASHTAG, 'count': 2}]
+    resp = client.get('/tweets/tags', query_string={'kind': MENTION})
+    assert json.loads(resp.data) == [{'tag': 'c', 'kind': MENTION, 'count': 1}]
+
+
+@pytest.mark.parametrize('path', ['/tweets/tags/bad-tag', '/tweets/tags?kind=emoji',
+                                  '/tweets/tags?window=hour'])
+def test_invalid_tag_requests_are_rejected(client, path):
+    assert client.get(path).status_code == 400
@@ -0,0 +1,90 @@
+import gzip
+import json
+import zlib
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from seventweets import wire
+from seventweets.db.backends import memory
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setattr(memory.Database, '_instance', None)
+    return app.test_client()
+
+
+def _create(client, *contents):
+    for content in contents:
+        resp = client.post('/tweets/create', data=json.dumps({'tweet': content}),
+                           content_type='application/json')
+        assert resp.status_code == 201
+
+
+def test_msgpack_round_trip_keeps_datetimes():
+    pytest.importorskip('msgpack')
+    naive = datetime(2017, 5, 1, 12, 30, 15, 123456)
+    aware = datetime(2017, 5, 1, 14, 30, 15, 123456, tzinfo=timezone(timedelta(hours=2)))
+
+    data = wire.loads_msgpack(wire.dumps_msgpack({'naive': naive, 'aware': aware, 'n': [1, 'x']}))
+
+    assert data == {'naive': naive, 'aware': naive, 'n': [1, 'x']}
+
+
+def test_json_is_default(client):
+    _create(client, 'hello')
+
+    resp = client.get('/tweets/')
+
+    assert resp.mimetype == wire.JSON
+    assert json.loads(resp.data)[0]['tweet'] == 'hello'
+    assert 'Accept' in resp.headers['Vary']
+
+
+def test_msgpack_is_negotiated(client):
+    pytest.importorskip('msgpack')
+    body = wire.dumps_msgpack({'tweet': 'packed'})
+    resp = client.post('/tweets/create', data=body, content_type=wire.MSGPACK,
+                       headers={'Accept': wire.accept_header()})
+    assert resp.status_code == 201
+    assert resp.mimetype == wire.MSGPACK
+    created = wire.loads_msgpack(resp.data)
+
+    resp = client.get(f'/tweets/{created["id"]}', headers={'Accept': 'application/x-msgpack'})
+
+    assert wire.loads_msgpack(resp.data) == created
+    assert created['tweet'] == 'packed'
+    assert isinstance(created['created_at'], datetime)
+
+
+@pytest.mark.parametrize('encoding, decompress', [
+    ('gzip', gzip.decompress),
+    ('deflate', zlib.decompress),
+])
+def test_large_response_is_compressed(client, encoding, decompress):
+    _create(client, *[f'tweet number {i}' for i in range(30)])
+
+    resp = client.get('/tweets/', headers={'Accept-Encoding': encoding})
+
+    assert resp.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in resp.headers['Vary']
+    assert len(json.loads(decompress(resp.data))) == 30
+
+
+def test_small_response_is_not_compressed(client):
+    _create(client, 'short')
+
+    resp = client.get('/tweets/', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in resp.headers
+    assert len(json.loads(resp.data)) == 1
+
+
+def test_compression_can_be_disabled(app, client):
+    app.config['ST_COMPRESS_MIN_SIZE'] = -1
+    _create(client, *[f'tweet number {i}' for i in range(30)])
+
+    resp = client.get('/tweets/', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in resp.headers